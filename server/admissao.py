@@ -0,0 +1,251 @@
+import os
+import time
+import hashlib
+import tempfile
+import threading
+from flask import request, jsonify
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows (desenvolvimento): vagas contadas só dentro do processo
+    fcntl = None
+
+# Controle de admissão por classe de endpoint.
+#
+# Relatórios longos (/reports/...) e importações/sincronizações ocupam um
+# worker e uma conexão cada; sem limite, no fechamento de safra eles tomam
+# todos os workers e as gravações (POST /programacoes) esperam até estourar o
+# timeout. Cada requisição é classificada (interativa, escrita, relatorio,
+# sync) e precisa de uma vaga da sua classe antes do handler:
+#   - limite: vagas simultâneas da classe no host (0 = sem limite). As vagas
+#     são arquivos travados com flock em DIR, então valem para todos os
+#     workers do gunicorn e são liberadas pelo kernel se o worker morrer;
+#   - espera: quanto tempo a requisição aguarda vaga na fila antes de receber
+#     503 com Retry-After;
+#   - por_usuario: vagas simultâneas por usuário na classe (0 = sem limite);
+#     acima disso a resposta é 429 imediato, sem entrar na fila. O usuário é o
+#     user_id do token verificado (sem token válido, o IP); os arquivos das
+#     vagas por usuário são apagados ao liberar, então DIR só guarda as vagas
+#     em uso.
+# Configuração: AGROPLAN_ADMISSAO_<CLASSE>="limite,espera,retry_after,por_usuario"
+# (ex. AGROPLAN_ADMISSAO_RELATORIO="3,2,15,1"); AGROPLAN_ADMISSAO=0 desliga.
+#
+# Requisições internas de /batch herdam a vaga da requisição externa quando
+# são da mesma classe; de outra classe (ex. um relatório no lote) passam pelo
+# controle normalmente.
+
+HABILITADO = os.environ.get("AGROPLAN_ADMISSAO", "1") not in ("0", "false")
+DIR = os.environ.get("AGROPLAN_ADMISSAO_DIR", os.path.join(tempfile.gettempdir(), "agroplan-admissao"))
+POLL_SEG = 0.05
+
+# classe: (limite, espera_seg, retry_after_seg, por_usuario)
+PADRAO = {
+    "interativa": (0, 5.0, 1, 0),
+    "escrita": (0, 10.0, 2, 0),
+    "relatorio": (2, 2.0, 15, 1),
+    "sync": (2, 5.0, 10, 0),
+}
+
+ISENTAS = ("/health", "/db/health", "/metrics")
+# Leituras curtas sob prefixos das outras classes (delta da sincronização incremental)
+INTERATIVAS = ("/sync/changes",)
+RELATORIO = ("/reports/", "/talhoes/geometry_audit", "/talhoes/sobreposicoes", "/demanda")
+SYNC_PREFIXOS = ("/import/", "/sync/")
+SYNC_SUFIXOS = ("/bulk", "/import", "/sync", "/sync/test")
+ESCRITA = ("POST", "PUT", "PATCH", "DELETE")
+
+_local = threading.local()
+_lock = threading.Lock()
+_em_uso = {}  # sem fcntl: nome da vaga -> ocupadas neste processo
+_verificar = None  # verify_jwt do app (configurar_token)
+
+
+def _config(classe):
+    padrao = PADRAO[classe]
+    bruto = os.environ.get(f"AGROPLAN_ADMISSAO_{classe.upper()}")
+    if not bruto:
+        return padrao
+    valores = list(padrao)
+    for i, parte in enumerate(bruto.split(",")[:4]):
+        if parte.strip():
+            valores[i] = type(padrao[i])(float(parte))
+    return tuple(valores)
+
+
+CLASSES = {c: _config(c) for c in PADRAO}
+
+
+def classificar(metodo, rota):
+    """Classe da requisição pela regra da rota (None = fora do controle)."""
+    if rota is None or metodo == "OPTIONS" or rota in ISENTAS or rota.startswith("/debug/"):
+        return None
+    if rota in INTERATIVAS:
+        return "interativa"
+    if rota.startswith(RELATORIO):
+        return "relatorio"
+    if rota.startswith(SYNC_PREFIXOS) or rota.endswith(SYNC_SUFIXOS):
+        return "sync"
+    if metodo in ESCRITA:
+        return "escrita"
+    return "interativa"
+
+
+def configurar_token(verificar):
+    """Função que verifica o JWT (payload ou exceção), para o limite por usuário."""
+    global _verificar
+    _verificar = verificar
+
+
+def _usuario():
+    # user_id só de token com assinatura válida: um token forjado não ocupa a
+    # vaga de outro usuário; sem token válido, o IP
+    auth = request.headers.get("Authorization") or ""
+    if _verificar is not None and auth.lower().startswith("bearer "):
+        try:
+            payload = _verificar(auth.split(" ", 1)[1])
+            if payload.get("user_id"):
+                return "u:" + str(payload["user_id"])
+        except Exception:
+            pass
+    return "ip:" + (request.remote_addr or "-")
+
+
+def _tentar(nome, limite, apagar=False):
+    # Vaga livre (descritor travado ou nome, sem fcntl) ou None.
+    # apagar: o arquivo é removido ao liberar (vagas por usuário)
+    if fcntl is None:
+        with _lock:
+            if _em_uso.get(nome, 0) >= limite:
+                return None
+            _em_uso[nome] = _em_uso.get(nome, 0) + 1
+        return nome
+    os.makedirs(DIR, exist_ok=True)
+    for i in range(limite):
+        caminho = os.path.join(DIR, f"{nome}.{i}")
+        while True:
+            fd = os.open(caminho, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                break
+            # Quem liberou pode ter apagado o arquivo entre o open e o flock:
+            # a trava só vale se o caminho ainda aponta para o mesmo arquivo
+            try:
+                mesmo = os.stat(caminho).st_ino == os.fstat(fd).st_ino
+            except FileNotFoundError:
+                mesmo = False
+            if mesmo:
+                return (fd, caminho if apagar else None)
+            os.close(fd)
+    return None
+
+
+def _liberar(vaga):
+    if isinstance(vaga, str):
+        with _lock:
+            _em_uso[vaga] -= 1
+            if not _em_uso[vaga]:
+                del _em_uso[vaga]
+        return
+    fd, caminho = vaga
+    if caminho is not None:
+        try:
+            os.unlink(caminho)  # ainda com a trava: quem abriu antes refaz o open
+        except OSError:
+            pass
+    os.close(fd)  # fechar o descritor solta o flock
+
+
+def _ocupadas(nome, limite):
+    # Vagas em uso no host (para /debug/admissao; leitura aproximada)
+    if fcntl is None:
+        with _lock:
+            return _em_uso.get(nome, 0)
+    livres = []
+    while True:
+        vaga = _tentar(nome, limite)
+        if vaga is None:
+            break
+        livres.append(vaga)
+        if len(livres) == limite:
+            break
+    for vaga in livres:
+        _liberar(vaga)
+    return limite - len(livres)
+
+
+def _recusar(classe, status, motivo, retry_after):
+    metrics.inc("admission_rejections_total", 1, {"classe": classe, "status": str(status)})
+    resp = jsonify({"error": motivo, "classe": classe})
+    resp.status_code = status
+    resp.headers["Retry-After"] = str(retry_after)
+    return resp
+
+
+def _admitir():
+    rota = request.url_rule.rule if request.url_rule is not None else None
+    classe = classificar(request.method, rota)
+    pilha = _local.__dict__.setdefault("pilha", [])
+    if classe is None or any(c == classe for _, c, _ in pilha):
+        return None
+    limite, espera, retry_after, por_usuario = CLASSES[classe]
+    vagas = []
+    if por_usuario:
+        chave = hashlib.sha1(_usuario().encode("utf-8")).hexdigest()
+        vaga = _tentar(f"{classe}-u{chave}", por_usuario, apagar=True)
+        if vaga is None:
+            return _recusar(classe, 429, "limite de requisições simultâneas do usuário", retry_after)
+        vagas.append(vaga)
+    if limite:
+        vaga = _tentar(classe, limite)
+        if vaga is None:
+            t0 = time.monotonic()
+            prazo = t0 + espera
+            metrics.gauge_add("admission_queue_depth", 1, {"classe": classe})
+            try:
+                while vaga is None and time.monotonic() < prazo:
+                    time.sleep(POLL_SEG)
+                    vaga = _tentar(classe, limite)
+            finally:
+                metrics.gauge_add("admission_queue_depth", -1, {"classe": classe})
+            metrics.observe("admission_wait_seconds", time.monotonic() - t0, {"classe": classe}, (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+            if vaga is None:
+                for v in vagas:
+                    _liberar(v)
+                return _recusar(classe, 503, "servidor ocupado, tente novamente", retry_after)
+        vagas.append(vaga)
+    pilha.append((request._get_current_object(), classe, vagas))
+    metrics.inc("admission_admitted_total", 1, {"classe": classe})
+    metrics.gauge_add("admission_in_flight", 1, {"classe": classe})
+    return None
+
+
+def _encerrar(exc):
+    pilha = getattr(_local, "pilha", None)
+    if pilha and pilha[-1][0] is request._get_current_object():
+        _, classe, vagas = pilha.pop()
+        for vaga in vagas:
+            _liberar(vaga)
+        metrics.gauge_add("admission_in_flight", -1, {"classe": classe})
+
+
+def init_app(app):
+    if not HABILITADO:
+        return
+    app.before_request(_admitir)
+    app.teardown_request(_encerrar)
+
+
+def estatisticas():
+    out = {}
+    for classe, (limite, espera, retry_after, por_usuario) in CLASSES.items():
+        out[classe] = {
+            "limite": limite,
+            "espera_seg": espera,
+            "retry_after_seg": retry_after,
+            "por_usuario": por_usuario,
+            "ocupadas_host": _ocupadas(classe, limite) if limite else None,
+        }
+    return {"habilitado": HABILITADO, "compartilhado_entre_workers": fcntl is not None, "classes": out}
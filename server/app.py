@@ -1,15 +1,36 @@
 import os
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, Response
 from werkzeug.utils import secure_filename
 from alembic.config import Config as _AlembicConfig
 from alembic import command as _alembic_command
 from flask_cors import CORS
-from db import get_pool, ensure_defensivos_schema, ensure_system_config_schema, get_config_map, upsert_config_items, ensure_fertilizantes_schema, ensure_safras_schema, ensure_programacao_schema, ensure_consultores_schema, ensure_import_history_schema, ensure_calendario_aplicacoes_schema, ensure_epocas_schema, ensure_justificativas_adubacao_schema, ensure_produtores_schema, ensure_fazendas_schema, ensure_talhoes_schema, ensure_cultivares_catalog_schema, ensure_tratamentos_sementes_schema, ensure_cultivares_tratamentos_schema, ensure_aplicacoes_defensivos_schema, ensure_gestor_consultores_schema, ensure_app_versions_schema, ensure_embalagens_schema, ensure_access_logs_schema
+from db import get_pool, ensure_jobs_schema, ensure_defensivos_schema, ensure_system_config_schema, get_config_map, upsert_config_items, ensure_fertilizantes_schema, ensure_safras_schema, ensure_programacao_schema, ensure_consultores_schema, ensure_import_history_schema, ensure_calendario_aplicacoes_schema, ensure_epocas_schema, ensure_justificativas_adubacao_schema, ensure_produtores_schema, ensure_fazendas_schema, ensure_talhoes_schema, ensure_cultivares_catalog_schema, ensure_tratamentos_sementes_schema, ensure_cultivares_tratamentos_schema, ensure_aplicacoes_defensivos_schema, ensure_gestor_consultores_schema, ensure_app_versions_schema, ensure_embalagens_schema, ensure_access_logs_schema
 from sqlalchemy import text, select, delete, or_, update
-from sqlalchemy.dialects.postgresql import insert as _pg_insert
 from sa import get_engine, get_session
 from models import AppVersion, SystemConfig, ImportHistory, DefensivoCatalog, FertilizanteCatalog, CultivarCatalog, TratamentoSemente, CultivarTratamento, Epoca, JustificativaAdubacao, Embalagem, UserFazenda, GestorConsultor, Consultor, CalendarioAplicacao, AccessLog
-from psycopg2.extras import execute_values
+from geometry import polygon_metrics, store_metrics, refresh_divergencia, get_tolerancia_pct, run_geometry_audit
+from spatial import talhao_index
+from overlap import check_talhao, run_overlap_analysis
+from http_cache import conditional_cache
+import cache_listas
+from compression import CompressionMiddleware
+import importer
+import duplicacao
+import demanda
+import programacao_lote
+import bulk
+import leitura
+import serializacao
+import swap
+import sync
+import eventos
+import bootstrap
+import multiplex
+import jobs
+import metrics
+import instrumentation
+import admissao
+import slowlog
 import uuid
 import time
 import json
@@ -29,7 +50,10 @@ app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024 * 1024
 print(f"DEBUG: MAX_CONTENT_LENGTH set to {app.config['MAX_CONTENT_LENGTH']}")
 
 # Abrir CORS para simplificar chamadas do front; sem credenciais
-CORS(app, origins="*", supports_credentials=False)
+CORS(app, origins="*", supports_credentials=False, expose_headers=["Server-Timing", "Retry-After"])
+instrumentation.init_app(app)
+admissao.init_app(app)
+slowlog.start()
 
 # Compatibilidade: aceitar prefixo '/api' nas rotas sem alterar endpoints
 class StripApiPrefixMiddleware:
@@ -44,7 +68,7 @@ class StripApiPrefixMiddleware:
             environ["PATH_INFO"] = path[4:]
         return self.app(environ, start_response)
 
-app.wsgi_app = StripApiPrefixMiddleware(app.wsgi_app)
+app.wsgi_app = CompressionMiddleware(StripApiPrefixMiddleware(app.wsgi_app))
 try:
     ensure_system_config_schema()
     ensure_defensivos_schema()
@@ -94,6 +118,8 @@ def db_health():
 
 @app.route("/talhoes/import", methods=["POST"])
 def import_talhoes():
+    if _is_planilha_upload():
+        return _importar_planilha("talhoes")
     ensure_talhoes_schema()
     ensure_import_history_schema()
     payload = request.get_json(silent=True)
@@ -111,13 +137,13 @@ def import_talhoes():
     conn = pool.getconn()
     deleted = 0
     imported = 0
+    pendentes = []
     try:
         with conn:
             with conn.cursor() as cur:
+                alvo = "talhoes"
                 if limpar_antes:
-                    cur.execute("SELECT COUNT(*) FROM public.talhoes")
-                    deleted = cur.fetchone()[0] or 0
-                    cur.execute("DELETE FROM public.talhoes")
+                    alvo = swap.criar_sombra(cur, "talhoes")
                 values = []
                 for it in (items or []):
                     fazenda_id = it.get("fazenda_id")
@@ -128,15 +154,16 @@ def import_talhoes():
                         continue
                     values.append([str(uuid.uuid4()), fazenda_id, nome, area, arrendado])
                 if values:
-                    execute_values(
-                        cur,
-                        """
-                        INSERT INTO public.talhoes (id, fazenda_id, nome, area, arrendado)
-                        VALUES %s
-                        """,
-                        values,
-                    )
+                    bulk.upsert(cur, alvo, ["id", "fazenda_id", "nome", "area", "arrendado"], values)
                     imported = len(values)
+                if limpar_antes:
+                    sub = importer.TABELAS["talhoes"]["substituicao"]
+                    swap.preservar(cur, "talhoes", alvo, sub["chave"], ["fazenda_id", "nome", "area", "arrendado"])
+                    sub["preparar"](cur, alvo)
+                    resumo, pendentes = swap.trocar(cur, "talhoes", alvo, ["id"], validar=sub["validar"])
+                    deleted = resumo["removidos"]
+                if imported or deleted:
+                    eventos.recarregar(cur, "talhoes")
                 cur.execute(
                     """
                     INSERT INTO public.import_history (id, user_id, tabela_nome, registros_importados, registros_deletados, arquivo_nome, limpar_antes)
@@ -144,124 +171,146 @@ def import_talhoes():
                     """,
                     [str(uuid.uuid4()), user_id, "talhoes", imported, deleted, arquivo_nome, limpar_antes]
                 )
+        swap.validar_fks(conn, pendentes)
         return jsonify({"ok": True, "imported": imported, "deleted": deleted})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
     finally:
         pool.putconn(conn)
+def _escopo_jwt():
+    # Escopo das listagens filtradas por usuário: o payload do token (sem os
+    # carimbos de tempo); token ausente/inválido é um escopo único
+    auth = request.headers.get("Authorization") or ""
+    if not auth.lower().startswith("bearer "):
+        return None
+    try:
+        payload = verify_jwt(auth.split(" ", 1)[1])
+    except Exception:
+        return None
+    return {k: v for k, v in payload.items() if k not in ("exp", "iat", "nbf")}
+
+def cache_escopo(*tabelas):
+    return cache_listas.por_escopo(tabelas, _escopo_jwt)
+
+_TABELAS_ACESSO = ("user_produtores", "user_fazendas", "gestor_consultores", "consultores")
+
+def _consulta_fazendas(cur, payload, numerocm=None, numerocm_consultor=None, safra_id=None, desde=None):
+    # Fazendas visíveis para o token (payload None = sem filtro de escopo)
+    base = (
+        "SELECT f.id, f.numerocm, f.idfazenda, f.nomefazenda, f.numerocm_consultor, f.cadpro, f.cod_imovel, f.created_at, f.updated_at, "
+        "COALESCE(SUM(t.area), 0) AS area_cultivavel "
+        "FROM public.fazendas f "
+        "LEFT JOIN public.talhoes t ON t.fazenda_id = f.id "
+        + ("AND (t.safras_todas OR EXISTS (SELECT 1 FROM public.talhao_safras ts WHERE ts.talhao_id = t.id AND ts.safra_id = %s))" if safra_id else "")
+    )
+    params = []
+    where = []
+    # RLS-like: filtrar por role e associações
+    role = (payload.get("role") or "consultor").lower() if payload else None
+    user_id = payload.get("user_id") if payload else None
+    cm_token = payload.get("numerocm_consultor") if payload else None
+    allowed_numerocm = []
+    allowed_fazendas = []
+    allowed_consultores = []
+    if user_id and role in ("gestor", "consultor"):
+        cur.execute("SELECT produtor_numerocm FROM public.user_produtores WHERE user_id = %s", [user_id])
+        allowed_numerocm = [r[0] for r in cur.fetchall()]
+        cur.execute("SELECT fazenda_id FROM public.user_fazendas WHERE user_id = %s", [user_id])
+        allowed_fazendas = [r[0] for r in cur.fetchall()]
+        if role == "gestor":
+            cur.execute("SELECT numerocm_consultor FROM public.gestor_consultores WHERE user_id = %s", [user_id])
+            allowed_consultores = [r[0] for r in cur.fetchall()]
+    if role == "consultor":
+        cm_val = numerocm_consultor or cm_token
+        if (not cm_val) and user_id:
+            try:
+                cur.execute("SELECT numerocm_consultor FROM public.consultores WHERE id = %s", [user_id])
+                r = cur.fetchone()
+                if r and r[0]:
+                    cm_val = r[0]
+            except Exception:
+                pass
+
+        conds = []
+        if cm_val:
+            conds.append("f.numerocm_consultor = %s")
+            params.append(cm_val)
+            # Também permitir se o produtor dono da fazenda é do consultor
+            conds.append("f.numerocm IN (SELECT p.numerocm FROM public.produtores p WHERE p.numerocm_consultor = %s)")
+            params.append(cm_val)
+
+        if allowed_numerocm:
+            conds.append("f.numerocm = ANY(%s)")
+            params.append(allowed_numerocm)
+
+        if allowed_fazendas:
+            conds.append("f.id = ANY(%s)")
+            params.append(allowed_fazendas)
+
+        if conds:
+            where.append("(" + " OR ".join(conds) + ")")
+        else:
+            where.append("1=0")
+    elif role == "gestor":
+        if allowed_numerocm or allowed_fazendas or allowed_consultores:
+            subconds = []
+            if allowed_numerocm:
+                subconds.append("f.numerocm = ANY(%s)")
+                params.append(allowed_numerocm)
+            if allowed_fazendas:
+                subconds.append("f.id = ANY(%s)")
+                params.append(allowed_fazendas)
+            if allowed_consultores:
+                subconds.append("f.numerocm_consultor = ANY(%s)")
+                params.append(allowed_consultores)
+            where.append("(" + " OR ".join(subconds) + ")")
+    # Admin: sem restrição
+    if numerocm:
+        where.append("numerocm = %s")
+        params.append(numerocm)
+    if numerocm_consultor:
+        where.append("numerocm_consultor = %s")
+        params.append(numerocm_consultor)
+    if safra_id:
+        where.append("EXISTS (SELECT 1 FROM public.talhoes t2 WHERE t2.fazenda_id = f.id AND (t2.safras_todas OR EXISTS (SELECT 1 FROM public.talhao_safras ts2 WHERE ts2.talhao_id = t2.id AND ts2.safra_id = %s)))")
+        params.append(safra_id)
+    if desde is not None:
+        where.append("f.updated_at >= %s")
+        params.append(desde)
+    sql = base + (" WHERE " + " AND ".join(where) if where else "") + " GROUP BY f.id ORDER BY f.nomefazenda"
+    # Se houve safra_id no JOIN, precisa entrar como primeiro parâmetro
+    if safra_id:
+        cur.execute(sql, [safra_id] + params)
+    else:
+        cur.execute(sql, params)
+    return serializacao.Linhas.do_cursor(cur)
+
 @app.route("/fazendas", methods=["GET"])
+@cache_escopo("fazendas", "talhoes", "talhao_safras", "produtores", *_TABELAS_ACESSO)
 def list_fazendas():
     ensure_fazendas_schema()
     ensure_talhoes_schema()
     numerocm = request.args.get("numerocm")
     numerocm_consultor = request.args.get("numerocm_consultor")
     safra_id = request.args.get("safra_id")
-    auth = request.headers.get("Authorization") or ""
+    try:
+        desde, reset = sync.parametro()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     pool = get_pool()
     conn = pool.getconn()
     try:
         with conn.cursor() as cur:
-            base = (
-                "SELECT f.id, f.numerocm, f.idfazenda, f.nomefazenda, f.numerocm_consultor, f.cadpro, f.cod_imovel, f.created_at, f.updated_at, "
-                "COALESCE(SUM(t.area), 0) AS area_cultivavel "
-                "FROM public.fazendas f "
-                "LEFT JOIN public.talhoes t ON t.fazenda_id = f.id "
-                + ("AND (t.safras_todas OR EXISTS (SELECT 1 FROM public.talhao_safras ts WHERE ts.talhao_id = t.id AND ts.safra_id = %s))" if safra_id else "")
-            )
-            params = []
-            where = []
-            # RLS-like: filtrar por role e associações
-            role = None
-            user_id = None
-            cm_token = None
-            if auth.lower().startswith("bearer "):
-                try:
-                    payload = verify_jwt(auth.split(" ", 1)[1])
-                    role = (payload.get("role") or "consultor").lower()
-                    user_id = payload.get("user_id")
-                    cm_token = payload.get("numerocm_consultor")
-                except Exception:
-                    role = None
-            allowed_numerocm = []
-            allowed_fazendas = []
-            allowed_consultores = []
-            if user_id and role in ("gestor", "consultor"):
-                cur.execute("SELECT produtor_numerocm FROM public.user_produtores WHERE user_id = %s", [user_id])
-                allowed_numerocm = [r[0] for r in cur.fetchall()]
-                cur.execute("SELECT fazenda_id FROM public.user_fazendas WHERE user_id = %s", [user_id])
-                allowed_fazendas = [r[0] for r in cur.fetchall()]
-                if role == "gestor":
-                    cur.execute("SELECT numerocm_consultor FROM public.gestor_consultores WHERE user_id = %s", [user_id])
-                    allowed_consultores = [r[0] for r in cur.fetchall()]
-            if role == "consultor":
-                cm_val = numerocm_consultor or cm_token
-                if (not cm_val) and user_id:
-                    try:
-                        cur.execute("SELECT numerocm_consultor FROM public.consultores WHERE id = %s", [user_id])
-                        r = cur.fetchone()
-                        if r and r[0]:
-                            cm_val = r[0]
-                    except Exception:
-                        pass
-                
-                conds = []
-                if cm_val:
-                    conds.append("f.numerocm_consultor = %s")
-                    params.append(cm_val)
-                    # Também permitir se o produtor dono da fazenda é do consultor
-                    conds.append("f.numerocm IN (SELECT p.numerocm FROM public.produtores p WHERE p.numerocm_consultor = %s)")
-                    params.append(cm_val)
-                
-                if allowed_numerocm:
-                    conds.append("f.numerocm = ANY(%s)")
-                    params.append(allowed_numerocm)
-                    
-                if allowed_fazendas:
-                    conds.append("f.id = ANY(%s)")
-                    params.append(allowed_fazendas)
-                    
-                if conds:
-                    where.append("(" + " OR ".join(conds) + ")")
-                else:
-                    where.append("1=0")
-            elif role == "gestor":
-                if allowed_numerocm or allowed_fazendas or allowed_consultores:
-                    subconds = []
-                    if allowed_numerocm:
-                        subconds.append("f.numerocm = ANY(%s)")
-                        params.append(allowed_numerocm)
-                    if allowed_fazendas:
-                        subconds.append("f.id = ANY(%s)")
-                        params.append(allowed_fazendas)
-                    if allowed_consultores:
-                        subconds.append("f.numerocm_consultor = ANY(%s)")
-                        params.append(allowed_consultores)
-                    where.append("(" + " OR ".join(subconds) + ")")
-            # Admin: sem restrição
-            if numerocm:
-                where.append("numerocm = %s")
-                params.append(numerocm)
-            if numerocm_consultor:
-                where.append("numerocm_consultor = %s")
-                params.append(numerocm_consultor)
-            if safra_id:
-                where.append("EXISTS (SELECT 1 FROM public.talhoes t2 WHERE t2.fazenda_id = f.id AND (t2.safras_todas OR EXISTS (SELECT 1 FROM public.talhao_safras ts2 WHERE ts2.talhao_id = t2.id AND ts2.safra_id = %s)))")
-                params.append(safra_id)
-            sql = base + (" WHERE " + " AND ".join(where) if where else "") + " GROUP BY f.id ORDER BY f.nomefazenda"
-            # Se houve safra_id no JOIN, precisa entrar como primeiro parâmetro
-            if safra_id:
-                cur.execute(sql, [safra_id] + params)
-            else:
-                cur.execute(sql, params)
-            rows = cur.fetchall()
-            cols = [d[0] for d in cur.description]
-            items = [dict(zip(cols, r)) for r in rows]
-            return jsonify({"items": items, "count": len(items)})
+            cursor = sync.marca(cur)
+            items = _consulta_fazendas(cur, _escopo_jwt(), numerocm, numerocm_consultor, safra_id, desde)
+            return jsonify(sync.completar(cur, {"items": items, "count": len(items)}, "fazendas", desde, reset, cursor))
     finally:
         pool.putconn(conn)
 
 @app.route("/fazendas/bulk", methods=["POST"])
 def import_fazendas():
+    if _is_planilha_upload():
+        return _importar_planilha("fazendas")
     ensure_fazendas_schema()
     ensure_import_history_schema()
     payload = request.get_json(silent=True) or {}
@@ -294,19 +343,9 @@ def import_fazendas():
                     seen.add(key)
                     values.append([str(uuid.uuid4()), numerocm, idfazenda, nomefazenda, cm_cons, cadpro, (cod_imovel or None)])
                 if values:
-                    execute_values(
-                        cur,
-                        """
-                        INSERT INTO public.fazendas (id, numerocm, idfazenda, nomefazenda, numerocm_consultor, cadpro, cod_imovel)
-                        VALUES %s
-                        ON CONFLICT (numerocm, idfazenda) DO UPDATE SET
-                          nomefazenda = EXCLUDED.nomefazenda,
-                          numerocm_consultor = EXCLUDED.numerocm_consultor,
-                          cadpro = EXCLUDED.cadpro,
-                          cod_imovel = EXCLUDED.cod_imovel,
-                          updated_at = now()
-                        """,
-                        values,
+                    bulk.upsert(
+                        cur, "fazendas", ["id", "numerocm", "idfazenda", "nomefazenda", "numerocm_consultor", "cadpro", "cod_imovel"], values,
+                        conflito=["numerocm", "idfazenda"], atualizar=["nomefazenda", "numerocm_consultor", "cadpro", "cod_imovel"],
                     )
                     imported = len(values)
                 cur.execute(
@@ -381,6 +420,7 @@ def delete_fazenda_by_key():
         pool.putconn(conn)
 
 @app.route("/justificativas_adubacao", methods=["GET"])
+@conditional_cache("justificativas_adubacao")
 def list_justificativas():
     ensure_justificativas_adubacao_schema()
     only_ativas = str(request.args.get("ativas", "")).strip().lower() in ("1", "true", "yes", "on")
@@ -437,106 +477,235 @@ def delete_justificativa(id: str):
     session.commit()
     return jsonify({"ok": True})
 
+def _consulta_produtores(cur, payload, numerocm_consultor=None, desde=None):
+    # Produtores visíveis para o token (payload None = sem filtro de escopo)
+    base = "SELECT id, numerocm, nome, numerocm_consultor, consultor, assistencia, compra_insumos, entrega_producao, paga_assistencia, observacao_flags, cod_empresa, created_at, updated_at FROM public.produtores"
+    params = []
+    where = []
+    role = (payload.get("role") or "consultor").lower() if payload else None
+    user_id = payload.get("user_id") if payload else None
+    cm_token = payload.get("numerocm_consultor") if payload else None
+    allowed_numerocm = []
+    allowed_consultores = []
+    if user_id and role in ("gestor", "consultor"):
+        cur.execute("SELECT produtor_numerocm FROM public.user_produtores WHERE user_id = %s", [user_id])
+        allowed_numerocm = [r[0] for r in cur.fetchall()]
+        try:
+            cur.execute("SELECT DISTINCT f.numerocm FROM public.fazendas f JOIN public.user_fazendas uf ON uf.fazenda_id = f.id WHERE uf.user_id = %s", [user_id])
+            from_fazendas = [r[0] for r in cur.fetchall()]
+            if from_fazendas:
+                allowed_numerocm = list({*(allowed_numerocm or []), *from_fazendas})
+        except Exception:
+            pass
+        if role == "gestor":
+            cur.execute("SELECT numerocm_consultor FROM public.gestor_consultores WHERE user_id = %s", [user_id])
+            allowed_consultores = [r[0] for r in cur.fetchall()]
+    if role == "consultor":
+        cm_val = numerocm_consultor or cm_token
+        if (not cm_val) and user_id:
+            try:
+                cur.execute("SELECT numerocm_consultor FROM public.consultores WHERE id = %s", [user_id])
+                r = cur.fetchone()
+                if r and r[0]:
+                    cm_val = r[0]
+            except Exception:
+                pass
+
+        conds = []
+        if cm_val:
+            conds.append("(numerocm_consultor = %s OR numerocm IN (SELECT numerocm FROM public.fazendas WHERE numerocm_consultor = %s))")
+            params.append(cm_val)
+            params.append(cm_val)
+
+        if allowed_numerocm:
+            conds.append("numerocm = ANY(%s)")
+            params.append(allowed_numerocm)
+
+        if conds:
+            where.append("(" + " OR ".join(conds) + ")")
+        else:
+            where.append("1=0")
+    elif role == "gestor":
+        subconds = []
+        if allowed_numerocm:
+            subconds.append("numerocm = ANY(%s)")
+            params.append(allowed_numerocm)
+        if allowed_consultores:
+            subconds.append("numerocm_consultor = ANY(%s)")
+            params.append(allowed_consultores)
+        cm_val = numerocm_consultor or cm_token
+        if (not cm_val) and user_id:
+            try:
+                cur.execute("SELECT numerocm_consultor FROM public.consultores WHERE id = %s", [user_id])
+                r = cur.fetchone()
+                if r and r[0]:
+                    cm_val = r[0]
+            except Exception:
+                pass
+        if cm_val:
+            subconds.append("numerocm_consultor = %s")
+            params.append(cm_val)
+        if subconds:
+            where.append("(" + " OR ".join(subconds) + ")")
+    # Admin: sem restrição
+    if numerocm_consultor:
+        where.append("numerocm_consultor = %s")
+        params.append(numerocm_consultor)
+    if desde is not None:
+        where.append("updated_at >= %s")
+        params.append(desde)
+    sql = base + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY nome"
+    cur.execute(sql, params)
+    return serializacao.Linhas.do_cursor(cur)
+
 @app.route("/produtores", methods=["GET"])
+@cache_escopo("produtores", "fazendas", *_TABELAS_ACESSO)
 def list_produtores():
     ensure_produtores_schema()
     numerocm_consultor = request.args.get("numerocm_consultor")
-    auth = request.headers.get("Authorization") or ""
+    try:
+        desde, reset = sync.parametro()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     pool = get_pool()
     conn = pool.getconn()
     try:
         with conn.cursor() as cur:
-            base = "SELECT id, numerocm, nome, numerocm_consultor, consultor, assistencia, compra_insumos, entrega_producao, paga_assistencia, observacao_flags, cod_empresa, created_at, updated_at FROM public.produtores"
-            params = []
-            where = []
-            role = None
-            user_id = None
-            cm_token = None
-            if auth.lower().startswith("bearer "):
-                try:
-                    payload = verify_jwt(auth.split(" ", 1)[1])
-                    role = (payload.get("role") or "consultor").lower()
-                    user_id = payload.get("user_id")
-                    cm_token = payload.get("numerocm_consultor")
-                except Exception:
-                    role = None
-            allowed_numerocm = []
-            allowed_consultores = []
-            if user_id and role in ("gestor", "consultor"):
-                cur.execute("SELECT produtor_numerocm FROM public.user_produtores WHERE user_id = %s", [user_id])
-                allowed_numerocm = [r[0] for r in cur.fetchall()]
-                try:
-                    cur.execute("SELECT DISTINCT f.numerocm FROM public.fazendas f JOIN public.user_fazendas uf ON uf.fazenda_id = f.id WHERE uf.user_id = %s", [user_id])
-                    from_fazendas = [r[0] for r in cur.fetchall()]
-                    if from_fazendas:
-                        allowed_numerocm = list({*(allowed_numerocm or []), *from_fazendas})
-                except Exception:
-                    pass
-                if role == "gestor":
-                    cur.execute("SELECT numerocm_consultor FROM public.gestor_consultores WHERE user_id = %s", [user_id])
-                    allowed_consultores = [r[0] for r in cur.fetchall()]
-            if role == "consultor":
-                cm_val = numerocm_consultor or cm_token
-                if (not cm_val) and user_id:
-                    try:
-                        cur.execute("SELECT numerocm_consultor FROM public.consultores WHERE id = %s", [user_id])
-                        r = cur.fetchone()
-                        if r and r[0]:
-                            cm_val = r[0]
-                    except Exception:
-                        pass
-                
-                conds = []
-                if cm_val:
-                    conds.append("(numerocm_consultor = %s OR numerocm IN (SELECT numerocm FROM public.fazendas WHERE numerocm_consultor = %s))")
-                    params.append(cm_val)
-                    params.append(cm_val)
-                
-                if allowed_numerocm:
-                    conds.append("numerocm = ANY(%s)")
-                    params.append(allowed_numerocm)
-                
-                if conds:
-                    where.append("(" + " OR ".join(conds) + ")")
-                else:
-                    where.append("1=0")
-            elif role == "gestor":
-                subconds = []
-                if allowed_numerocm:
-                    subconds.append("numerocm = ANY(%s)")
-                    params.append(allowed_numerocm)
-                if allowed_consultores:
-                    subconds.append("numerocm_consultor = ANY(%s)")
-                    params.append(allowed_consultores)
-                cm_val = numerocm_consultor or cm_token
-                if (not cm_val) and user_id:
-                    try:
-                        cur.execute("SELECT numerocm_consultor FROM public.consultores WHERE id = %s", [user_id])
-                        r = cur.fetchone()
-                        if r and r[0]:
-                            cm_val = r[0]
-                    except Exception:
-                        pass
-                if cm_val:
-                    subconds.append("numerocm_consultor = %s")
-                    params.append(cm_val)
-                if subconds:
-                    where.append("(" + " OR ".join(subconds) + ")")
-            # Admin: sem restrição
-            if numerocm_consultor:
-                where.append("numerocm_consultor = %s")
-                params.append(numerocm_consultor)
-            sql = base + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY nome"
-            cur.execute(sql, params)
-            rows = cur.fetchall()
-            cols = [d[0] for d in cur.description]
-            items = [dict(zip(cols, r)) for r in rows]
-            return jsonify({"items": items, "count": len(items)})
+            cursor = sync.marca(cur)
+            items = _consulta_produtores(cur, _escopo_jwt(), numerocm_consultor, desde)
+            return jsonify(sync.completar(cur, {"items": items, "count": len(items)}, "produtores", desde, reset, cursor))
+    finally:
+        pool.putconn(conn)
+
+@app.route("/sync/changes", methods=["GET"])
+def sync_changes():
+    # Delta para clientes offline: ?updated_since=<cursor anterior>&tabelas=a,b
+    auth = request.headers.get("Authorization") or ""
+    if not auth.lower().startswith("bearer "):
+        return jsonify({"error": "sem token"}), 401
+    try:
+        payload = verify_jwt(auth.split(" ", 1)[1])
+    except Exception as e:
+        return jsonify({"error": str(e)}), 401
+    tabelas = [t.strip() for t in (request.args.get("tabelas") or "").split(",") if t.strip()] or list(sync.TABELAS)
+    invalidas = [t for t in tabelas if t not in sync.TABELAS]
+    if invalidas:
+        return jsonify({"error": f"tabelas inválidas: {', '.join(invalidas)}", "tabelas": list(sync.TABELAS)}), 400
+    try:
+        desde, reset = sync.parametro()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        return jsonify(sync.mudancas(conn, payload, tabelas, desde, reset))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+    finally:
+        pool.putconn(conn)
+
+def _secao_itens(cur, sql, iso=True):
+    cur.execute(sql)
+    items = serializacao.Linhas.do_cursor(cur, iso=iso)
+    return {"items": items, "count": len(items)}
+
+# Seções de /bootstrap: mesmas consultas das listagens, sem os filtros opcionais
+_CATALOGO_SQL = "SELECT cod_item, item, grupo, marca, principio_ativo, saldo, created_at, updated_at FROM public.{} ORDER BY item NULLS LAST, cod_item"
+
+@bootstrap.secao("me", escopo=True)
+def _bootstrap_me(cur, payload):
+    return {"user": payload}
+
+@bootstrap.secao("role", escopo=True)
+def _bootstrap_role(cur, payload):
+    return {"role": payload.get("role", "consultor")}
+
+@bootstrap.secao("safras", ("safras",), preparar=(ensure_safras_schema,))
+def _bootstrap_safras(cur, payload):
+    return _secao_itens(cur, "SELECT id, nome, is_default, ativa, ano_inicio, ano_fim, created_at, updated_at FROM public.safras ORDER BY nome DESC", iso=False)
+
+@bootstrap.secao("epocas", ("epocas",), preparar=(ensure_epocas_schema,))
+def _bootstrap_epocas(cur, payload):
+    return _secao_itens(cur, "SELECT id, nome, descricao, COALESCE(ativa, false) AS ativa, created_at, updated_at FROM public.epocas ORDER BY nome")
+
+@bootstrap.secao("embalagens", ("embalagens",), preparar=(ensure_embalagens_schema,))
+def _bootstrap_embalagens(cur, payload):
+    return _secao_itens(
+        cur,
+        "SELECT id, nome, ativo, scope_cultivar, scope_fertilizante, scope_defensivo, cultura, created_at, updated_at"
+        " FROM public.embalagens WHERE ativo ORDER BY nome",
+    )
+
+@bootstrap.secao("justificativas_adubacao", ("justificativas_adubacao",), preparar=(ensure_justificativas_adubacao_schema,))
+def _bootstrap_justificativas(cur, payload):
+    return _secao_itens(cur, "SELECT id, descricao, COALESCE(ativo, false) AS ativo, created_at, updated_at FROM public.justificativas_adubacao ORDER BY descricao")
+
+@bootstrap.secao("produtores", ("produtores", "fazendas", *_TABELAS_ACESSO), escopo=True, preparar=(ensure_produtores_schema,))
+def _bootstrap_produtores(cur, payload):
+    items = _consulta_produtores(cur, payload)
+    return {"items": items, "count": len(items)}
+
+@bootstrap.secao("fazendas", ("fazendas", "talhoes", "talhao_safras", "produtores", *_TABELAS_ACESSO), escopo=True, preparar=(ensure_fazendas_schema, ensure_talhoes_schema))
+def _bootstrap_fazendas(cur, payload):
+    items = _consulta_fazendas(cur, payload)
+    return {"items": items, "count": len(items)}
+
+@bootstrap.secao("defensivos", ("defensivos_catalog",), preparar=(ensure_defensivos_schema,))
+def _bootstrap_defensivos(cur, payload):
+    return _secao_itens(cur, _CATALOGO_SQL.format("defensivos_catalog"))
+
+@bootstrap.secao("fertilizantes", ("fertilizantes_catalog",), preparar=(ensure_fertilizantes_schema,))
+def _bootstrap_fertilizantes(cur, payload):
+    return _secao_itens(cur, _CATALOGO_SQL.format("fertilizantes_catalog"))
+
+@bootstrap.secao("cultivares_catalog", ("cultivares_catalog",), preparar=(ensure_cultivares_catalog_schema,))
+def _bootstrap_cultivares(cur, payload):
+    return _secao_itens(cur, "SELECT cultivar, cultura, nome_cientifico, rnc, created_at, updated_at FROM public.cultivares_catalog ORDER BY cultivar")
+
+@bootstrap.secao("config", ("system_config",), preparar=(ensure_system_config_schema,))
+def _bootstrap_config(cur, payload):
+    return _secao_itens(cur, "SELECT config_key, config_value, description, created_at, updated_at FROM public.system_config ORDER BY config_key")
+
+@app.route("/bootstrap", methods=["GET"])
+def get_bootstrap():
+    # Dados de início de sessão numa só ida: ?secoes=a,b&etags=secao:etag,...
+    # (ou cabeçalho X-Bootstrap-ETags) para pular as seções que o cliente já tem
+    auth = request.headers.get("Authorization") or ""
+    if not auth.lower().startswith("bearer "):
+        return jsonify({"error": "sem token"}), 401
+    try:
+        payload = verify_jwt(auth.split(" ", 1)[1])
+    except Exception as e:
+        return jsonify({"error": str(e)}), 401
+    secoes = [s.strip() for s in (request.args.get("secoes") or "").split(",") if s.strip()] or bootstrap.nomes()
+    invalidas = [s for s in secoes if s not in bootstrap.nomes()]
+    if invalidas:
+        return jsonify({"error": f"seções inválidas: {', '.join(invalidas)}", "secoes": bootstrap.nomes()}), 400
+    etags = bootstrap.tokens(request.headers.get("X-Bootstrap-ETags"))
+    etags.update(bootstrap.tokens(request.args.get("etags")))
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        return jsonify(bootstrap.montar(conn, payload, secoes, etags))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
     finally:
         pool.putconn(conn)
 
+@app.route("/batch", methods=["POST"])
+def batch():
+    # Várias chamadas numa requisição: {"requests": [{"id", "method", "path", "body", "headers"}]}
+    payload = request.get_json(silent=True) or {}
+    itens = payload.get("requests")
+    erro = multiplex.validar(itens)
+    if erro:
+        return jsonify({"error": erro, "max_itens": multiplex.MAX_ITENS}), 400
+    return multiplex.executar(app, itens, verify_jwt)
+
 @app.route("/produtores/bulk", methods=["POST"])
 def import_produtores():
+    if _is_planilha_upload():
+        return _importar_planilha("produtores")
     ensure_produtores_schema()
     ensure_import_history_schema()
     payload = request.get_json(silent=True) or {}
@@ -567,19 +736,9 @@ def import_produtores():
                     seen.add(numerocm)
                     values.append([str(uuid.uuid4()), numerocm, nome, cm_cons, consultor, (cod_empresa or None)])
                 if values:
-                    execute_values(
-                        cur,
-                        """
-                        INSERT INTO public.produtores (id, numerocm, nome, numerocm_consultor, consultor, cod_empresa)
-                        VALUES %s
-                        ON CONFLICT (numerocm) DO UPDATE SET
-                          nome = EXCLUDED.nome,
-                          numerocm_consultor = EXCLUDED.numerocm_consultor,
-                          consultor = EXCLUDED.consultor,
-                          cod_empresa = EXCLUDED.cod_empresa,
-                          updated_at = now()
-                        """,
-                        values,
+                    bulk.upsert(
+                        cur, "produtores", ["id", "numerocm", "nome", "numerocm_consultor", "consultor", "cod_empresa"], values,
+                        conflito=["numerocm"], atualizar=["nome", "numerocm_consultor", "consultor", "cod_empresa"],
                     )
                     imported = len(values)
                 cur.execute(
@@ -668,6 +827,7 @@ def delete_produtor(id: str):
         pool.putconn(conn)
 
 @app.route("/epocas", methods=["GET"])
+@conditional_cache("epocas")
 def list_epocas():
     ensure_epocas_schema()
     only_ativas = str(request.args.get("ativas", "")).strip().lower() in ("1", "true", "yes", "on")
@@ -729,6 +889,7 @@ def delete_epoca(id: str):
     return jsonify({"ok": True})
 
 @app.route("/calendario_aplicacoes", methods=["GET"])
+@conditional_cache("calendario_aplicacoes")
 def list_calendario_aplicacoes():
     ensure_calendario_aplicacoes_schema()
     session = get_session()
@@ -789,6 +950,8 @@ def delete_calendario_aplicacao(id: str):
 
 @app.route("/calendario_aplicacoes/import", methods=["POST"])
 def import_calendario_aplicacoes():
+    if _is_planilha_upload():
+        return _importar_planilha("calendario_aplicacoes")
     ensure_calendario_aplicacoes_schema()
     ensure_import_history_schema()
     payload = request.get_json(silent=True) or {}
@@ -813,19 +976,9 @@ def import_calendario_aplicacoes():
                 "trat_sementes": it.get("trat_sementes"),
             })
         if to_upsert:
-            stmt = _pg_insert(CalendarioAplicacao.__table__).values(to_upsert)
-            session.execute(
-                stmt.on_conflict_do_update(
-                    index_elements=[CalendarioAplicacao.cod_aplic],
-                    set_={
-                        "descr_aplicacao": stmt.excluded.descr_aplicacao,
-                        "cod_aplic_ger": stmt.excluded.cod_aplic_ger,
-                        "cod_classe": stmt.excluded.cod_classe,
-                        "descricao_classe": stmt.excluded.descricao_classe,
-                        "trat_sementes": stmt.excluded.trat_sementes,
-                        "updated_at": text("now()"),
-                    },
-                )
+            bulk.upsert(
+                bulk.cursor_sessao(session), "calendario_aplicacoes", list(to_upsert[0]), to_upsert,
+                conflito=["cod_aplic"], atualizar=["descr_aplicacao", "cod_aplic_ger", "cod_classe", "descricao_classe", "trat_sementes"],
             )
             imported_count = len(to_upsert)
         session.add(ImportHistory(id=str(uuid.uuid4()), user_id=user_id, tabela_nome="calendario_aplicacoes", registros_importados=imported_count, registros_deletados=0, arquivo_nome=arquivo_nome, limpar_antes=False))
@@ -856,28 +1009,191 @@ def version():
         pass
     return jsonify({"app": "agro-plan-assist-api", "version": "0.1.0"})
 
+_IMPORT_SCHEMAS = {
+    "produtores": ensure_produtores_schema,
+    "fazendas": ensure_fazendas_schema,
+    "talhoes": ensure_talhoes_schema,
+    "cultivares_catalog": ensure_cultivares_catalog_schema,
+    "fertilizantes": ensure_fertilizantes_schema,
+    "defensivos": ensure_defensivos_schema,
+    "calendario_aplicacoes": ensure_calendario_aplicacoes_schema,
+}
+
+def _is_planilha_upload():
+    # Arquivo CSV/XLSX (multipart ou corpo cru) em vez do JSON com "items"
+    return bool(request.files) or (request.mimetype or "").lower() in importer.MIMETYPES
+
+def _wants_async(payload=None):
+    # ?async=1, campo async no form/JSON ou "Prefer: respond-async"
+    val = request.args.get("async")
+    if val is None and request.files:
+        val = request.form.get("async")
+    if val is None and isinstance(payload, dict):
+        val = payload.get("async")
+    if "respond-async" in (request.headers.get("Prefer") or "").lower():
+        return True
+    return str(val or "").strip().lower() in ("1", "true", "yes", "on")
+
+def _usuario_token():
+    # user_id do token verificado (dono das tarefas em /jobs), ou None
+    escopo = _escopo_jwt()
+    return escopo.get("user_id") if escopo else None
+
+def _job_accepted(job_id: str):
+    return jsonify({"ok": True, "job_id": job_id, "status_url": f"/jobs/{job_id}"}), 202
+
+def _importar_planilha(tabela: str):
+    if tabela not in importer.TABELAS:
+        return jsonify({"error": f"tabela não suportada: {tabela}"}), 404
+    _IMPORT_SCHEMAS[tabela]()
+    ensure_import_history_schema()
+    params = request.form if request.files else request.args
+    f = request.files.get("file") or request.files.get("arquivo") or next(iter(request.files.values()), None)
+    if f is not None:
+        fh = f.stream
+        nome = params.get("arquivo_nome") or f.filename
+        mimetype = f.mimetype
+    else:
+        fh = importer.spool(request.stream)
+        nome = params.get("arquivo_nome")
+        mimetype = request.mimetype
+    cabeca = fh.read(4)
+    fh.seek(0)
+    formato = params.get("formato") or importer.detectar_formato(nome, mimetype, cabeca)
+    limpar_antes = str(params.get("limpar_antes") or params.get("limparAntes") or "").strip().lower() in ("1", "true", "yes", "on")
+    try:
+        mapeamento = json.loads(params.get("mapeamento")) if params.get("mapeamento") else None
+    except ValueError:
+        return jsonify({"error": "mapeamento inválido (esperado JSON {coluna_arquivo: coluna_destino})"}), 400
+    if _wants_async():
+        # O arquivo vai para o disco antes de responder: a tarefa pode rodar em outro worker
+        job_id = str(uuid.uuid4())
+        path = jobs.arquivo_path(job_id, "." + formato)
+        with open(path, "wb") as out:
+            while True:
+                chunk = fh.read(importer.PEEK_BYTES)
+                if not chunk:
+                    break
+                out.write(chunk)
+        jobs.submit("import", {
+            "tabela": tabela,
+            "formato": formato,
+            "arquivo_nome": nome,
+            "user_id": params.get("user_id"),
+            "mapeamento": mapeamento,
+            "limpar_antes": limpar_antes,
+            "aba": params.get("aba"),
+        }, user_id=_usuario_token() or params.get("user_id"), job_id=job_id, arquivo=path)
+        return _job_accepted(job_id)
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        result = importer.importar(
+            conn, tabela, fh, formato=formato, arquivo_nome=nome, user_id=params.get("user_id"),
+            mapeamento=mapeamento, limpar_antes=limpar_antes, aba=params.get("aba"),
+        )
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+    finally:
+        pool.putconn(conn)
+
+def _job_import(payload, arquivo, progresso, job_id):
+    tabela = payload.get("tabela")
+    _IMPORT_SCHEMAS[tabela]()
+    ensure_import_history_schema()
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        with open(arquivo, "rb") as fh:
+            return importer.importar(
+                conn, tabela, fh, formato=payload.get("formato") or "csv", arquivo_nome=payload.get("arquivo_nome"),
+                user_id=payload.get("user_id"), mapeamento=payload.get("mapeamento"),
+                limpar_antes=bool(payload.get("limpar_antes")), aba=payload.get("aba"),
+                progresso=progresso, job_id=job_id,
+            )
+    finally:
+        pool.putconn(conn)
+
+@app.route("/import/<tabela>", methods=["POST"])
+def import_planilha(tabela: str):
+    return _importar_planilha(tabela)
+
+def _dono_jobs():
+    # (user_id para filtrar ou None se admin, resposta de erro)
+    auth = request.headers.get("Authorization") or ""
+    if not auth.lower().startswith("bearer "):
+        return None, (jsonify({"error": "sem token"}), 401)
+    try:
+        payload = verify_jwt(auth.split(" ", 1)[1])
+    except Exception as e:
+        return None, (jsonify({"error": str(e)}), 401)
+    if (payload.get("role") or "").lower() == "admin":
+        return None, None
+    return str(payload.get("user_id") or ""), None
+
+@app.route("/jobs", methods=["GET"])
+def list_jobs():
+    # Admin vê todas as tarefas; os demais, só as que enviaram
+    dono, negado = _dono_jobs()
+    if negado:
+        return negado
+    ensure_jobs_schema()
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            items = jobs.listar(cur, request.args.get("tipo"), request.args.get("status"), min(int(request.args.get("limit", 50) or 50), 500), user_id=dono)
+            return jsonify({"items": [jobs.publico(it) for it in items], "count": len(items)})
+    finally:
+        pool.putconn(conn)
+
+@app.route("/jobs/<id>", methods=["GET"])
+def get_job(id: str):
+    dono, negado = _dono_jobs()
+    if negado:
+        return negado
+    ensure_jobs_schema()
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            item = jobs.get(cur, id)
+            if not item or (dono is not None and item.get("user_id") != dono):
+                return jsonify({"error": "não encontrado"}), 404
+            return jsonify(jobs.publico(item))
+    finally:
+        pool.putconn(conn)
+
+@app.route("/import_history/<id>/rejeicoes", methods=["GET"])
+def list_import_rejeicoes(id: str):
+    ensure_import_history_schema()
+    try:
+        limit = min(int(request.args.get("limit", 500)), 5000)
+        offset = max(int(request.args.get("offset", 0)), 0)
+    except ValueError:
+        return jsonify({"error": "limit/offset inválidos"}), 400
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT registros_rejeitados FROM public.import_history WHERE id = %s", [id])
+            row = cur.fetchone()
+            if not row:
+                return jsonify({"error": "não encontrado"}), 404
+            items = importer.listar_rejeicoes(cur, id, limit, offset)
+            return jsonify({"items": items, "count": len(items), "total": row[0]})
+    finally:
+        pool.putconn(conn)
+
 @app.route("/import_history", methods=["GET"])
 def list_import_history():
     ensure_import_history_schema()
-    session = get_session()
-    items = session.execute(
-        select(ImportHistory).order_by(ImportHistory.created_at.desc()).limit(100)
-    ).scalars().all()
-    return jsonify({
-        "items": [
-            {
-                "id": it.id,
-                "user_id": it.user_id,
-                "tabela_nome": it.tabela_nome,
-                "registros_importados": it.registros_importados,
-                "registros_deletados": it.registros_deletados,
-                "arquivo_nome": it.arquivo_nome,
-                "limpar_antes": bool(it.limpar_antes),
-                "created_at": it.created_at.isoformat() if it.created_at else None,
-            } for it in items
-        ],
-        "count": len(items),
-    })
+    return jsonify(leitura.itens(
+        "SELECT id, user_id, tabela_nome, registros_importados, registros_deletados, registros_rejeitados,"
+        " duracao_ms, arquivo_nome, COALESCE(limpar_antes, false) AS limpar_antes, created_at"
+        " FROM public.import_history ORDER BY created_at DESC LIMIT 100"
+    ))
 
 @app.route("/consultores", methods=["GET"])
 def list_consultores():
@@ -1022,16 +1338,9 @@ def import_consultores():
                 "email": (it.get("email") or "").lower(),
             })
         if to_upsert:
-            stmt = _pg_insert(Consultor.__table__).values(to_upsert)
-            session.execute(
-                stmt.on_conflict_do_update(
-                    index_elements=[Consultor.email],
-                    set_={
-                        "numerocm_consultor": stmt.excluded.numerocm_consultor,
-                        "consultor": stmt.excluded.consultor,
-                        "updated_at": text("now()"),
-                    },
-                )
+            bulk.upsert(
+                bulk.cursor_sessao(session), "consultores", list(to_upsert[0]), to_upsert,
+                conflito=["email"], atualizar=["numerocm_consultor", "consultor"],
             )
             imported_count = len(to_upsert)
         session.add(ImportHistory(id=str(uuid.uuid4()), user_id=user_id, tabela_nome="consultores", registros_importados=imported_count, registros_deletados=0, arquivo_nome=arquivo_nome, limpar_antes=False))
@@ -1043,10 +1352,15 @@ def import_consultores():
 
 @app.route("/programacoes", methods=["GET"])
 def list_programacoes():
+    try:
+        desde, reset = sync.parametro()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     pool = get_pool()
     conn = pool.getconn()
     try:
         with conn.cursor() as cur:
+            cursor = sync.marca(cur)
             base = (
                 "SELECT p.id, p.user_id, p.produtor_numerocm, p.fazenda_idfazenda, p.area, p.area_hectares, p.safra_id, p.tipo, p.revisada, p.created_at, p.updated_at, "
                 "p.cod_unidade_fabril, p.campo_semente, p.categoria, p.renasem, p.proposito_semente, "
@@ -1108,12 +1422,14 @@ def list_programacoes():
             if safra_id:
                 where.append("p.safra_id = %s")
                 params.append(safra_id)
+            if desde is not None:
+                where.append("p.updated_at >= %s")
+                params.append(desde)
             sql = base + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY p.created_at DESC"
             cur.execute(sql, params)
             rows = cur.fetchall()
-            cols = [d[0] for d in cur.description]
-            data = [dict(zip(cols, r)) for r in rows]
-            return jsonify({"items": data, "count": len(data)})
+            data = serializacao.Linhas.do_cursor(cur, rows)
+            return jsonify(sync.completar(cur, {"items": data, "count": len(data)}, "programacoes", desde, reset, cursor))
     finally:
         pool.putconn(conn)
 
@@ -1282,12 +1598,57 @@ def create_programacao():
                         """,
                         [str(uuid.uuid4()), prog_id, tid, safra_id, fazenda_idfazenda, epoca_id]
                     )
+                eventos.publicar(cur, "programacoes", "insert", prog_id)
         return jsonify({"id": prog_id})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
     finally:
         pool.putconn(conn)
 
+@app.route("/programacoes/batch", methods=["POST"])
+def batch_programacoes():
+    # Várias glebas numa requisição/transação: cada item no formato do POST /programacoes
+    # (com "id" substitui a programação existente). Tudo ou nada: com qualquer item
+    # inválido nada é gravado e a resposta lista o erro de cada item.
+    payload = request.get_json(silent=True) or {}
+    itens = payload.get("items") if isinstance(payload, dict) else payload
+    if not isinstance(itens, list) or not itens:
+        return jsonify({"error": "items vazio"}), 400
+    if len(itens) > programacao_lote.MAX_ITENS:
+        return jsonify({"error": f"máximo de {programacao_lote.MAX_ITENS} itens por lote"}), 400
+    itens = [it if isinstance(it, dict) else {} for it in itens]
+    auth = request.headers.get("Authorization") or ""
+    user_id = None
+    cm_token = None
+    if auth.lower().startswith("bearer "):
+        try:
+            payload_jwt = verify_jwt(auth.split(" ", 1)[1])
+            cm_token = payload_jwt.get("numerocm_consultor")
+            user_id = payload_jwt.get("user_id")
+        except Exception:
+            pass
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                for safra in {it.get("safra_id") for it in itens if it.get("safra_id")}:
+                    check_cutoff_permission(cur, safra, cm_token)
+                erros = programacao_lote.validar(cur, itens)
+                if erros:
+                    conn.rollback()
+                    detalhes = [dict(erros[i], index=i) for i in sorted(erros)]
+                    return jsonify({"error": "lote inválido", "items": detalhes, "count": len(detalhes)}), 400
+                resultados = programacao_lote.gravar(cur, itens, user_id, cm_token)
+                for status, op in (("criado", "insert"), ("atualizado", "update")):
+                    eventos.publicar(cur, "programacoes", op, [r["id"] for r in resultados if r["status"] == status])
+        criados = sum(1 for r in resultados if r["status"] == "criado")
+        return jsonify({"items": resultados, "count": len(resultados), "criados": criados, "atualizados": len(resultados) - criados})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+    finally:
+        pool.putconn(conn)
+
 @app.route("/programacoes/<id>", methods=["DELETE"])
 def delete_programacao(id: str):
     pool = get_pool()
@@ -1328,6 +1689,7 @@ def delete_programacao(id: str):
                             "talhoes_nomes": talhoes_nomes,
                             "count": cnt,
                         }), 400
+                eventos.publicar(cur, "programacoes", "delete", id)
                 cur.execute("DELETE FROM public.programacoes WHERE id = %s", [id])
         return jsonify({"ok": True})
     except Exception as e:
@@ -1405,6 +1767,64 @@ def get_programacao_children(id: str):
     finally:
         pool.putconn(conn)
 
+@app.route("/programacoes/<id>/duplicate", methods=["POST"])
+def duplicate_programacao(id: str):
+    # Cópia feita no banco (INSERT ... SELECT por tabela filha). O corpo pode trazer
+    # sobreposições (safra_id, epoca_id, fazenda_id ou fazenda_idfazenda/produtor_numerocm,
+    # talhao_ids, area, area_hectares) ou uma lista "destinos" com várias delas.
+    payload = request.get_json(silent=True) or {}
+    destinos = payload.get("destinos")
+    lote = isinstance(destinos, list)
+    if not lote:
+        destinos = [payload]
+    if not destinos:
+        return jsonify({"error": "destinos vazio"}), 400
+    auth = request.headers.get("Authorization") or ""
+    user_id = payload.get("user_id")
+    cm_token = None
+    role = None
+    if auth.lower().startswith("bearer "):
+        try:
+            payload_jwt = verify_jwt(auth.split(" ", 1)[1])
+            cm_token = payload_jwt.get("numerocm_consultor")
+            role = (payload_jwt.get("role") or "consultor").lower()
+            if payload_jwt.get("user_id"):
+                user_id = payload_jwt.get("user_id")
+        except Exception:
+            pass
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                if role and role != "admin" and user_id:
+                    cur.execute("SELECT pode_duplicar_programacao FROM public.consultores WHERE id = %s", [user_id])
+                    r = cur.fetchone()
+                    if r and not r[0]:
+                        return jsonify({"error": "usuário sem permissão para duplicar programação"}), 403
+                origem = duplicacao.carregar_origem(cur, id)
+                if origem is None:
+                    return jsonify({"error": "programacao nao encontrada"}), 404
+                for safra_destino in {d.get("safra_id", origem["safra_id"]) for d in destinos}:
+                    check_cutoff_permission(cur, safra_destino, cm_token)
+                items = []
+                for i, (destino, novo_id) in enumerate(zip(destinos, duplicacao.novos_ids(len(destinos)))):
+                    try:
+                        items.append(duplicacao.duplicar(cur, origem, id, destino or {}, novo_id, user_id, cm_token))
+                    except duplicacao.ConflitoTalhoes as e:
+                        conn.rollback()
+                        body = {"error": str(e), "talhoes": e.talhoes, "talhoes_nomes": e.talhoes_nomes}
+                        if lote:
+                            body["destino"] = i
+                        return jsonify(body), 400
+                eventos.publicar(cur, "programacoes", "insert", [it["id"] for it in items])
+        metrics.inc("programacoes_duplicadas_total", len(items))
+        return jsonify({"items": items, "count": len(items)} if lote else items[0])
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+    finally:
+        pool.putconn(conn)
+
 @app.route("/programacoes/<id>", methods=["PUT"])
 def update_programacao(id: str):
     payload = request.get_json(silent=True) or {}
@@ -1618,6 +2038,7 @@ def update_programacao(id: str):
                         """,
                         [str(uuid.uuid4()), id, tid, safra_id, fazenda_idfazenda, epoca_id]
                     )
+                eventos.publicar(cur, "programacoes", "update", id)
         return jsonify({"ok": True, "id": id})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
@@ -1691,10 +2112,17 @@ def create_programacao_talhoes():
 
 @app.route("/programacao_cultivares", methods=["GET"])
 def list_programacao_cultivares():
+    try:
+        desde, reset = sync.parametro()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     pool = get_pool()
     conn = pool.getconn()
     try:
         with conn.cursor() as cur:
+            cursor = sync.marca(cur)
+            filtro = " AND pc.updated_at >= %s" if desde is not None else ""
+            extra = [desde] if desde is not None else []
             auth = request.headers.get("Authorization") or ""
             role = None
             cm_token = None
@@ -1706,15 +2134,15 @@ def list_programacao_cultivares():
                 except Exception:
                     role = None
             if role == "consultor" and cm_token:
-                cur.execute("SELECT pc.*, (SELECT s.ano_inicio || '/' || s.ano_fim FROM public.safras s WHERE s.id = pc.safra LIMIT 1) as safra_nome FROM public.programacao_cultivares pc WHERE pc.numerocm_consultor = %s ORDER BY pc.created_at DESC", [cm_token])
+                cur.execute("SELECT pc.*, (SELECT s.ano_inicio || '/' || s.ano_fim FROM public.safras s WHERE s.id = pc.safra LIMIT 1) as safra_nome FROM public.programacao_cultivares pc WHERE pc.numerocm_consultor = %s" + filtro + " ORDER BY pc.created_at DESC", [cm_token] + extra)
             elif role == "consultor":
                 cur.execute("SELECT pc.*, (SELECT s.ano_inicio || '/' || s.ano_fim FROM public.safras s WHERE s.id = pc.safra LIMIT 1) as safra_nome FROM public.programacao_cultivares pc WHERE 1=0")
             else:
-                cur.execute("SELECT pc.*, (SELECT s.ano_inicio || '/' || s.ano_fim FROM public.safras s WHERE s.id = pc.safra LIMIT 1) as safra_nome FROM public.programacao_cultivares pc ORDER BY pc.created_at DESC")
-            cols = [d[0] for d in cur.description]
+                cur.execute("SELECT pc.*, (SELECT s.ano_inicio || '/' || s.ano_fim FROM public.safras s WHERE s.id = pc.safra LIMIT 1) as safra_nome FROM public.programacao_cultivares pc WHERE TRUE" + filtro + " ORDER BY pc.created_at DESC", extra)
             rows = cur.fetchall()
-            items = [dict(zip(cols, r)) for r in rows]
-            ids = [it.get("id") for it in items if it.get("id")]
+            items = serializacao.Linhas.do_cursor(cur, rows)
+            i_id = items.indice("id")
+            ids = [r[i_id] for r in rows if r[i_id]]
             tratamentos_map = {}
             defensivos_map = {}
             if ids:
@@ -1741,13 +2169,11 @@ def list_programacao_cultivares():
                 for r in def_rows:
                     d = dict(zip(def_cols, r))
                     defensivos_map.setdefault(d["programacao_cultivar_id"], []).append(d)
-            enriched = []
-            for it in items:
-                it2 = dict(it)
-                it2["tratamento_ids"] = tratamentos_map.get(it.get("id"), [])
-                it2["defensivos_fazenda"] = defensivos_map.get(it.get("id"), [])
-                enriched.append(it2)
-            return jsonify({"items": enriched, "count": len(enriched)})
+            items.extras = {
+                "tratamento_ids": lambda r: tratamentos_map.get(r[i_id], []),
+                "defensivos_fazenda": lambda r: defensivos_map.get(r[i_id], []),
+            }
+            return jsonify(sync.completar(cur, {"items": items, "count": len(items)}, "programacao_cultivares", desde, reset, cursor))
     finally:
         pool.putconn(conn)
 
@@ -1856,6 +2282,7 @@ def create_programacao_cultivar():
                         [str(uuid.uuid4()), id_val, d.get("classe"), d.get("aplicacao"), d.get("defensivo"),
                          d.get("dose"), d.get("cobertura"), d.get("total"), bool(d.get("produto_salvo"))]
                     )
+                eventos.publicar(cur, "programacao_cultivares", "insert", id_val)
         return jsonify({"id": id_val})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
@@ -1939,6 +2366,7 @@ def update_programacao_cultivar(id: str):
                         [str(uuid.uuid4()), id, d.get("classe"), d.get("aplicacao"), d.get("defensivo"),
                          d.get("dose"), d.get("cobertura"), d.get("total"), bool(d.get("produto_salvo"))]
                     )
+                eventos.publicar(cur, "programacao_cultivares", "update", id)
         return jsonify({"ok": True, "id": id})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
@@ -1966,6 +2394,7 @@ def delete_programacao_cultivar(id: str):
                 if row:
                     check_cutoff_permission(cur, row[0], cm_token)
                 
+                eventos.publicar(cur, "programacao_cultivares", "delete", id)
                 cur.execute("DELETE FROM public.programacao_cultivares WHERE id = %s", [id])
         return jsonify({"ok": True})
     except Exception as e:
@@ -2129,6 +2558,7 @@ def update_programacao_adub(id: str):
         pool.putconn(conn)
 
 @app.route("/safras", methods=["GET"])
+@conditional_cache("safras")
 def get_safras():
     ensure_safras_schema()
     pool = get_pool()
@@ -2239,49 +2669,39 @@ def delete_safra(id: str):
         pool.putconn(conn)
 
 @app.route("/defensivos")
-def get_defensivos():
-    ensure_defensivos_schema()
-    session = get_session()
-    items = session.execute(select(DefensivoCatalog).order_by(DefensivoCatalog.item.nulls_last(), DefensivoCatalog.cod_item)).scalars().all()
-    return jsonify({
-        "items": [
-            {
-                "cod_item": it.cod_item,
-                "item": it.item,
-                "grupo": it.grupo,
-                "marca": it.marca,
-                "principio_ativo": it.principio_ativo,
-                "saldo": float(it.saldo) if it.saldo is not None else None,
-                "created_at": it.created_at.isoformat() if it.created_at else None,
-                "updated_at": it.updated_at.isoformat() if it.updated_at else None,
-            } for it in items
-        ],
-        "count": len(items),
-    })
+@conditional_cache("defensivos_catalog")
+def get_defensivos():
+    ensure_defensivos_schema()
+    try:
+        desde, reset = sync.parametro()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(leitura.itens(
+        "SELECT cod_item, item, grupo, marca, principio_ativo, saldo, created_at, updated_at"
+        " FROM public.defensivos_catalog" + (" WHERE updated_at >= %s" if desde is not None else "") + " ORDER BY item NULLS LAST, cod_item",
+        [desde] if desde is not None else None,
+        incremental=("defensivos_catalog", desde, reset),
+    ))
 
 @app.route("/cultivares_catalog", methods=["GET"])
+@conditional_cache("cultivares_catalog")
 def get_cultivares_catalog():
     ensure_cultivares_catalog_schema()
-    session = get_session()
-    items = session.execute(select(CultivarCatalog).order_by(CultivarCatalog.cultivar)).scalars().all()
-    out = jsonify({
-        "items": [
-            {
-                "cultivar": it.cultivar,
-                "cultura": it.cultura,
-                "nome_cientifico": it.nome_cientifico,
-                "rnc": it.rnc,
-                "created_at": it.created_at.isoformat() if it.created_at else None,
-                "updated_at": it.updated_at.isoformat() if it.updated_at else None,
-            } for it in items
-        ],
-        "count": len(items),
-    })
-    session.close()
-    return out
+    try:
+        desde, reset = sync.parametro()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(leitura.itens(
+        "SELECT cultivar, cultura, nome_cientifico, rnc, created_at, updated_at"
+        " FROM public.cultivares_catalog" + (" WHERE updated_at >= %s" if desde is not None else "") + " ORDER BY cultivar",
+        [desde] if desde is not None else None,
+        incremental=("cultivares_catalog", desde, reset),
+    ))
 
 @app.route("/cultivares_catalog/bulk", methods=["POST"])
 def import_cultivares_catalog():
+    if _is_planilha_upload():
+        return _importar_planilha("cultivares_catalog")
     ensure_cultivares_catalog_schema()
     ensure_import_history_schema()
     payload = request.get_json(silent=True) or {}
@@ -2308,12 +2728,10 @@ def import_cultivares_catalog():
         seen.add(key)
         to_insert.append({"cultivar": cultivar, "cultura": cultura, "nome_cientifico": nome_cientifico, "rnc": rnc})
     if to_insert:
-        stmt = _pg_insert(CultivarCatalog.__table__).values(to_insert)
-        upsert_stmt = stmt.on_conflict_do_update(
-            index_elements=[CultivarCatalog.cultivar, CultivarCatalog.cultura],
-            set_={"nome_cientifico": stmt.excluded.nome_cientifico, "rnc": stmt.excluded.rnc, "updated_at": text("now()")},
+        bulk.upsert(
+            bulk.cursor_sessao(session), "cultivares_catalog", ["cultivar", "cultura", "nome_cientifico", "rnc"], to_insert,
+            conflito=["cultivar", "cultura"],
         )
-        session.execute(upsert_stmt)
         imported = len(to_insert)
     session.add(ImportHistory(id=str(uuid.uuid4()), user_id=user_id, tabela_nome="cultivares_catalog", registros_importados=imported, registros_deletados=0, arquivo_nome=arquivo_nome, limpar_antes=False))
     session.commit()
@@ -2373,31 +2791,32 @@ def update_cultivares_by_key():
         return jsonify({"error": str(e)}), 400
 
 @app.route("/tratamentos_sementes", methods=["GET"])
+@conditional_cache("tratamentos_sementes")
 def list_tratamentos_sementes():
     ensure_tratamentos_sementes_schema()
     cultura = request.args.get("cultura")
     ativo = request.args.get("ativo")
-    session = get_session()
-    q = select(TratamentoSemente)
+    where = []
+    params = []
     if cultura:
-        q = q.where(TratamentoSemente.cultura == (str(cultura).upper()))
+        where.append("cultura = %s")
+        params.append(str(cultura).upper())
     if ativo is not None:
-        val = str(ativo).strip().lower() in ("1","true","yes","on")
-        q = q.where(TratamentoSemente.ativo == val)
-    items = session.execute(q.order_by(TratamentoSemente.nome)).scalars().all()
-    return jsonify({
-        "items": [
-            {
-                "id": it.id,
-                "nome": it.nome,
-                "cultura": it.cultura,
-                "ativo": bool(it.ativo),
-                "created_at": it.created_at.isoformat() if it.created_at else None,
-                "updated_at": it.updated_at.isoformat() if it.updated_at else None,
-            } for it in items
-        ],
-        "count": len(items),
-    })
+        where.append("ativo = %s")
+        params.append(str(ativo).strip().lower() in ("1","true","yes","on"))
+    try:
+        desde, reset = sync.parametro()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if desde is not None:
+        where.append("updated_at >= %s")
+        params.append(desde)
+    return jsonify(leitura.itens(
+        "SELECT id, nome, cultura, ativo, created_at, updated_at FROM public.tratamentos_sementes"
+        + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY nome",
+        params,
+        incremental=("tratamentos_sementes", desde, reset),
+    ))
 
 @app.route("/tratamentos_sementes", methods=["POST"])
 def create_tratamento_semente():
@@ -2508,10 +2927,7 @@ def save_cultivares_tratamentos_bulk():
             seen.add(val)
             to_insert.append({"cultivar": val, "tratamento_id": tratamento_id})
         if to_insert:
-            stmt = _pg_insert(CultivarTratamento.__table__).values(to_insert)
-            session.execute(
-                stmt.on_conflict_do_nothing(index_elements=[CultivarTratamento.cultivar, CultivarTratamento.tratamento_id])
-            )
+            bulk.upsert(bulk.cursor_sessao(session), "cultivares_tratamentos", ["cultivar", "tratamento_id"], to_insert, conflito=["cultivar", "tratamento_id"], atualizar=[])
         session.commit()
         return jsonify({"ok": True, "count": len(to_insert)})
     except Exception as e:
@@ -2537,33 +2953,24 @@ def set_tratamentos_for_cultivar():
         seen.add(val)
         to_insert.append({"cultivar": cultivar, "tratamento_id": val})
     if to_insert:
-        stmt = _pg_insert(CultivarTratamento.__table__).values(to_insert)
-        session.execute(stmt.on_conflict_do_nothing(index_elements=[CultivarTratamento.cultivar, CultivarTratamento.tratamento_id]))
+        bulk.upsert(bulk.cursor_sessao(session), "cultivares_tratamentos", ["cultivar", "tratamento_id"], to_insert, conflito=["cultivar", "tratamento_id"], atualizar=[])
     session.commit()
     return jsonify({"ok": True, "count": len(to_insert)})
 
 @app.route("/fertilizantes")
+@conditional_cache("fertilizantes_catalog")
 def get_fertilizantes():
     ensure_fertilizantes_schema()
-    session = get_session()
-    items = session.execute(select(FertilizanteCatalog).order_by(FertilizanteCatalog.item.nulls_last(), FertilizanteCatalog.cod_item)).scalars().all()
-    out = jsonify({
-        "items": [
-            {
-                "cod_item": it.cod_item,
-                "item": it.item,
-                "grupo": it.grupo,
-                "marca": it.marca,
-                "principio_ativo": it.principio_ativo,
-                "saldo": float(it.saldo) if it.saldo is not None else None,
-                "created_at": it.created_at.isoformat() if it.created_at else None,
-                "updated_at": it.updated_at.isoformat() if it.updated_at else None,
-            } for it in items
-        ],
-        "count": len(items),
-    })
-    session.close()
-    return out
+    try:
+        desde, reset = sync.parametro()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(leitura.itens(
+        "SELECT cod_item, item, grupo, marca, principio_ativo, saldo, created_at, updated_at"
+        " FROM public.fertilizantes_catalog" + (" WHERE updated_at >= %s" if desde is not None else "") + " ORDER BY item NULLS LAST, cod_item",
+        [desde] if desde is not None else None,
+        incremental=("fertilizantes_catalog", desde, reset),
+    ))
 
 @app.route("/debug/fertilizante_row/<cod_item>", methods=["GET"])
 def debug_fertilizante_row(cod_item: str):
@@ -2637,6 +3044,8 @@ def update_fertilizante_grupo():
 
 @app.route("/fertilizantes/bulk", methods=["POST"])
 def upsert_fertilizantes_bulk():
+    if _is_planilha_upload():
+        return _importar_planilha("fertilizantes")
     def _pick(obj, keys):
         for k in keys:
             if k in obj and obj[k] not in (None, ""):
@@ -2673,19 +3082,10 @@ def upsert_fertilizantes_bulk():
         })
     if not to_insert:
         return jsonify({"error": "items sem cod_item válido"}), 400
-    stmt = _pg_insert(FertilizanteCatalog.__table__).values(to_insert)
-    upsert_stmt = stmt.on_conflict_do_update(
-        index_elements=[FertilizanteCatalog.cod_item],
-        set_={
-            "item": stmt.excluded.item,
-            "grupo": stmt.excluded.grupo,
-            "marca": stmt.excluded.marca,
-            "principio_ativo": stmt.excluded.principio_ativo,
-            "saldo": stmt.excluded.saldo,
-            "updated_at": text("now()"),
-        },
+    bulk.upsert(
+        bulk.cursor_sessao(session), "fertilizantes_catalog", ["cod_item", "item", "grupo", "marca", "principio_ativo", "saldo"], to_insert,
+        conflito=["cod_item"],
     )
-    session.execute(upsert_stmt)
     session.commit()
     return jsonify({"ok": True, "imported": len(to_insert)})
 
@@ -2774,25 +3174,16 @@ def sync_fertilizantes():
     stage = "db"
     pool = get_pool()
     conn = pool.getconn()
+    pendentes = []
     try:
         with conn:
             with conn.cursor() as cur:
-                if limpar:
-                    cur.execute("DELETE FROM public.fertilizantes_catalog")
+                alvo = swap.criar_sombra(cur, "fertilizantes_catalog") if limpar else "fertilizantes_catalog"
                 if normalized:
-                    execute_values(
+                    bulk.upsert(
                         cur,
-                        """
-                        INSERT INTO public.fertilizantes_catalog (cod_item, item, grupo, marca, principio_ativo, saldo)
-                        VALUES %s
-                        ON CONFLICT (cod_item) DO UPDATE SET
-                          item = EXCLUDED.item,
-                          grupo = EXCLUDED.grupo,
-                          marca = EXCLUDED.marca,
-                          principio_ativo = EXCLUDED.principio_ativo,
-                          saldo = EXCLUDED.saldo,
-                          updated_at = now()
-                        """,
+                        alvo,
+                        ["cod_item", "item", "grupo", "marca", "principio_ativo", "saldo"],
                         [
                             [
                                 (str(r[0]) if r[0] is not None else None),
@@ -2804,8 +3195,15 @@ def sync_fertilizantes():
                             ]
                             for r in normalized
                         ],
+                        conflito=["cod_item"],
                     )
+                if limpar:
+                    swap.preservar(cur, "fertilizantes_catalog", alvo, ["cod_item"], ["item", "grupo", "marca", "principio_ativo", "saldo"])
+                    _, pendentes = swap.trocar(cur, "fertilizantes_catalog", alvo, ["cod_item"])
+        swap.validar_fks(conn, pendentes)
         return jsonify({"ok": True, "imported": len(normalized), "ignored": ignored})
+    except swap.SubstituicaoRecusada as e:
+        return jsonify({"error": str(e)}), 409
     except Exception as e:
         import traceback
         return jsonify({
@@ -2883,17 +3281,66 @@ def debug_pg_stat_activity():
                 """
             )
             rows = cur.fetchall()
-            cols = [d[0] for d in cur.description]
-            items = [dict(zip(cols, r)) for r in rows]
+            items = serializacao.Linhas.do_cursor(cur, rows)
             return jsonify({"items": items, "count": len(items)})
     finally:
         pool.putconn(conn)
 
+def _require_admin():
+    auth = request.headers.get("Authorization") or ""
+    if auth.lower().startswith("bearer "):
+        try:
+            payload = verify_jwt(auth.split(" ", 1)[1])
+            if (payload.get("role") or "").lower() == "admin":
+                return None
+        except Exception:
+            pass
+    return jsonify({"error": "não autorizado"}), 401
+
+@app.route("/debug/slow_queries", methods=["GET"])
+def debug_slow_queries():
+    # Queries acima do limite agrupadas por fingerprint (dados deste worker)
+    denied = _require_admin()
+    if denied:
+        return denied
+    try:
+        limit = max(1, min(int(request.args.get("limit") or 20), 200))
+    except Exception:
+        limit = 20
+    order = (request.args.get("order") or "total").strip().lower()
+    out = {"threshold_ms": slowlog.get_threshold_ms(), "items": slowlog.top(limit, order)}
+    if str(request.args.get("recent") or "").lower() in ("1", "true"):
+        out["recent"] = slowlog.recent(100)
+    return jsonify(out)
+
+@app.route("/debug/slow_queries", methods=["PUT"])
+def debug_slow_queries_config():
+    denied = _require_admin()
+    if denied:
+        return denied
+    payload = request.get_json(silent=True) or {}
+    try:
+        threshold = float(payload.get("threshold_ms"))
+    except Exception:
+        return jsonify({"error": "threshold_ms inválido"}), 400
+    # Persistido em system_config; os demais workers leem no próximo ciclo
+    upsert_config_items([{"config_key": "slow_query_threshold_ms", "config_value": str(threshold), "description": "Limite (ms) do log de queries lentas"}])
+    slowlog.set_threshold_ms(threshold)
+    return jsonify({"ok": True, "threshold_ms": threshold})
+
+@app.route("/debug/slow_queries", methods=["DELETE"])
+def debug_slow_queries_reset():
+    denied = _require_admin()
+    if denied:
+        return denied
+    slowlog.reset()
+    return jsonify({"ok": True})
+
 @app.route("/debug/fert_sync_version", methods=["GET"])
 def debug_fert_sync_version():
     # Marker to verify deployed code path
     return jsonify({
-        "sync_impl": "psycopg_execute_values",
+        "sync_impl": "bulk_upsert",
         "pick_strategy": "exact_keys_only",
         "has_dberror_literal": False
     })
@@ -2912,25 +3359,50 @@ def update_defensivo(cod_item: str):
     session.commit()
     return jsonify({"ok": True, "cod_item": cod_item})
 
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    # Métricas deste worker no formato texto do Prometheus
+    return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/debug/list_cache", methods=["GET"])
+def debug_list_cache_stats():
+    # Ocupação do cache de listagens deste worker + acertos/invalidações
+    out = cache_listas.estatisticas()
+    out["contadores"] = metrics.snapshot("list_cache_")
+    return jsonify(out)
+
+@app.route("/debug/eventos", methods=["GET"])
+def debug_eventos_stats():
+    # Loop SSE deste worker: assinantes abertos, bytes pendentes, LISTEN
+    out = eventos.estatisticas()
+    out["contadores"] = metrics.snapshot("sse_")
+    return jsonify(out)
+
+@app.route("/debug/admissao", methods=["GET"])
+def debug_admissao_stats():
+    # Vagas por classe (ocupação no host) e contadores/fila deste worker
+    out = admissao.estatisticas()
+    out["contadores"] = metrics.snapshot("admission_")
+    return jsonify(out)
+
+@app.route("/debug/compression", methods=["GET"])
+def debug_compression_stats():
+    # Razão de compressão e tempo gasto por encoding (contadores deste worker)
+    by_enc = {}
+    for m in metrics.snapshot("http_compression_"):
+        enc = m["labels"].get("encoding", "-")
+        by_enc.setdefault(enc, {})[m["name"].replace("http_compression_", "")] = m["value"]
+    for enc, v in by_enc.items():
+        if v.get("bytes_out_total"):
+            v["ratio"] = round(v.get("bytes_in_total", 0) / v["bytes_out_total"], 2)
+    return jsonify({"encodings": by_enc})
+
 @app.route("/config", methods=["GET"])
 def list_config():
     ensure_system_config_schema()
-    session = get_session()
-    items = (
-        session.execute(select(SystemConfig).order_by(SystemConfig.config_key)).scalars().all()
-    )
-    return jsonify({
-        "items": [
-            {
-                "config_key": it.config_key,
-                "config_value": it.config_value,
-                "description": it.description,
-                "created_at": it.created_at.isoformat() if it.created_at else None,
-                "updated_at": it.updated_at.isoformat() if it.updated_at else None,
-            } for it in items
-        ],
-        "count": len(items),
-    })
+    return jsonify(leitura.itens(
+        "SELECT config_key, config_value, description, created_at, updated_at FROM public.system_config ORDER BY config_key"
+    ))
 
 @app.route("/config/bulk", methods=["POST"])
 def upsert_config_bulk():
@@ -2971,23 +3443,9 @@ def upsert_config_bulk():
 def app_versions():
     ensure_app_versions_schema()
     if request.method == "GET":
-        session = get_session()
-        items = session.execute(select(AppVersion).order_by(AppVersion.created_at.desc())).scalars().all()
-        out = jsonify({
-            "items": [
-                {
-                    "id": it.id,
-                    "version": it.version,
-                    "build": it.build,
-                    "environment": it.environment,
-                    "notes": it.notes,
-                    "created_at": it.created_at.isoformat() if it.created_at else None,
-                } for it in items
-            ],
-            "count": len(items),
-        })
-        session.close()
-        return out
+        return jsonify(leitura.itens(
+            "SELECT id, version, build, environment, notes, created_at FROM public.app_versions ORDER BY created_at DESC"
+        ))
     else:
         payload = request.get_json(silent=True)
         if not isinstance(payload, dict):
@@ -3040,6 +3498,14 @@ def sync_defensivos():
     ensure_defensivos_schema()
     payload = request.get_json(silent=True) or {}
     limpar = bool(payload.get("limparAntes"))
+    if _wants_async(payload):
+        return _job_accepted(jobs.submit("sync", {"alvo": "defensivos", "limpar": limpar}, user_id=_usuario_token()))
+    if limpar:
+        # Substituição completa passa pela tabela sombra de run_sync_defensivos
+        res = run_sync_defensivos(True)
+        if "error" in res:
+            return jsonify(res), res.get("status", 500)
+        return jsonify(res)
     cfg = get_config_map([
         "api_defensivos_client_id",
         "api_defensivos_secret",
@@ -3108,8 +3574,6 @@ def sync_defensivos():
         normalized.append([cod_item, item_val, grupo_val, marca_val, princ_val, saldo_val])
 
     session = get_session()
-    if limpar:
-        session.execute(delete(DefensivoCatalog))
     to_insert = []
     for r in normalized:
         to_insert.append({
@@ -3121,19 +3585,10 @@ def sync_defensivos():
             "saldo": r[5],
         })
     if to_insert:
-        stmt = _pg_insert(DefensivoCatalog.__table__).values(to_insert)
-        upsert_stmt = stmt.on_conflict_do_update(
-            index_elements=[DefensivoCatalog.cod_item],
-            set_={
-                "item": stmt.excluded.item,
-                "grupo": stmt.excluded.grupo,
-                "marca": stmt.excluded.marca,
-                "principio_ativo": stmt.excluded.principio_ativo,
-                "saldo": stmt.excluded.saldo,
-                "updated_at": text("now()"),
-            },
+        bulk.upsert(
+            bulk.cursor_sessao(session), "defensivos_catalog", ["cod_item", "item", "grupo", "marca", "principio_ativo", "saldo"], to_insert,
+            conflito=["cod_item"],
         )
-        session.execute(upsert_stmt)
     session.commit()
     return jsonify({"ok": True, "imported": len(to_insert), "ignored": ignored})
 
@@ -3165,7 +3620,7 @@ def sync_defensivos_test():
         details = str(getattr(e, 'reason', e))
         return jsonify({"error": "URLError", "details": details}), 502
 
-def run_sync_defensivos(limpar: bool = False):
+def run_sync_defensivos(limpar: bool = False, progresso=None):
     ensure_system_config_schema()
     ensure_defensivos_schema()
     cfg = get_config_map([
@@ -3217,32 +3672,27 @@ def run_sync_defensivos(limpar: bool = False):
 
     pool = get_pool()
     conn = pool.getconn()
+    pendentes = []
     try:
         with conn:
             with conn.cursor() as cur:
-                if limpar:
-                    cur.execute("DELETE FROM public.defensivos_catalog")
+                alvo = swap.criar_sombra(cur, "defensivos_catalog") if limpar else "defensivos_catalog"
                 if normalized:
-                    execute_values(
-                        cur,
-                        """
-                        INSERT INTO public.defensivos_catalog (cod_item, item, grupo, marca, principio_ativo, saldo)
-                        VALUES %s
-                        ON CONFLICT (cod_item) DO UPDATE SET
-                          item = EXCLUDED.item,
-                          grupo = EXCLUDED.grupo,
-                          marca = EXCLUDED.marca,
-                          principio_ativo = EXCLUDED.principio_ativo,
-                          saldo = EXCLUDED.saldo,
-                          updated_at = now()
-                        """,
-                        normalized,
-                    )
+                    bulk.upsert(cur, alvo, ["cod_item", "item", "grupo", "marca", "principio_ativo", "saldo"], normalized, conflito=["cod_item"])
+                if limpar:
+                    swap.preservar(cur, "defensivos_catalog", alvo, ["cod_item"], ["item", "grupo", "marca", "principio_ativo", "saldo"])
+                    _, pendentes = swap.trocar(cur, "defensivos_catalog", alvo, ["cod_item"])
+                if progresso is not None:
+                    # Última verificação antes do commit: se a tarefa foi perdida, desfaz tudo
+                    progresso("gravando", processados=len(normalized))
+        swap.validar_fks(conn, pendentes)
         return {"ok": True, "imported": len(normalized), "ignored": ignored}
+    except swap.SubstituicaoRecusada as e:
+        return {"error": str(e), "status": 409}
     finally:
         pool.putconn(conn)
 
-def run_sync_produtores(limpar: bool = False):
+def run_sync_produtores(limpar: bool = False, progresso=None):
     ensure_system_config_schema()
     ensure_produtores_schema()
     cfg = get_config_map([
@@ -3303,6 +3753,7 @@ def run_sync_produtores(limpar: bool = False):
     conn = pool.getconn()
     imported = 0
     ignored = 0
+    pendentes = []
     try:
         with conn:
             with conn.cursor() as cur:
@@ -3312,8 +3763,7 @@ def run_sync_produtores(limpar: bool = False):
                 cur.execute("SELECT MIN(numerocm_consultor) FROM public.consultores")
                 default_cm_row = cur.fetchone()
                 default_cm = default_cm_row[0] if default_cm_row and default_cm_row[0] else None
-                if limpar:
-                    cur.execute("DELETE FROM public.produtores")
+                alvo = swap.criar_sombra(cur, "produtores") if limpar else "produtores"
                 values = []
                 seen = set()
                 for d in items:
@@ -3345,28 +3795,26 @@ def run_sync_produtores(limpar: bool = False):
                     seen.add(key)
                     values.append([str(uuid.uuid4()), numerocm, nome, cm_cons, consultor, tipocooperado, assistencia, cod_empresa])
                 if values:
-                    execute_values(
-                        cur,
-                        """
-                        INSERT INTO public.produtores (id, numerocm, nome, numerocm_consultor, consultor, tipocooperado, assistencia, cod_empresa)
-                        VALUES %s
-                        ON CONFLICT (numerocm) DO UPDATE SET
-                          nome = EXCLUDED.nome,
-                          numerocm_consultor = EXCLUDED.numerocm_consultor,
-                          consultor = EXCLUDED.consultor,
-                          tipocooperado = EXCLUDED.tipocooperado,
-                          assistencia = EXCLUDED.assistencia,
-                          cod_empresa = EXCLUDED.cod_empresa,
-                          updated_at = now()
-                        """,
-                        values,
+                    bulk.upsert(
+                        cur, alvo, ["id", "numerocm", "nome", "numerocm_consultor", "consultor", "tipocooperado", "assistencia", "cod_empresa"], values,
+                        conflito=["numerocm"], atualizar=["nome", "numerocm_consultor", "consultor", "tipocooperado", "assistencia", "cod_empresa"],
                     )
                     imported = len(values)
+                if limpar:
+                    # id e flags editadas no app (compra_insumos, observacao_flags...) seguem o numerocm
+                    swap.preservar(cur, "produtores", alvo, ["numerocm"], ["nome", "numerocm_consultor", "consultor", "tipocooperado", "assistencia", "cod_empresa"])
+                    _, pendentes = swap.trocar(cur, "produtores", alvo, ["id"])
+                if progresso is not None:
+                    # Última verificação antes do commit: se a tarefa foi perdida, desfaz tudo
+                    progresso("gravando", processados=imported)
+        swap.validar_fks(conn, pendentes)
         return {"ok": True, "imported": imported, "ignored": ignored}
+    except swap.SubstituicaoRecusada as e:
+        return {"error": str(e), "status": 409}
     finally:
         pool.putconn(conn)
 
-def run_sync_fazendas(limpar: bool = False):
+def run_sync_fazendas(limpar: bool = False, progresso=None):
     ensure_system_config_schema()
     ensure_fazendas_schema()
     cfg = get_config_map([
@@ -3427,14 +3875,14 @@ def run_sync_fazendas(limpar: bool = False):
     conn = pool.getconn()
     imported = 0
     ignored = 0
+    pendentes = []
     try:
         with conn:
             with conn.cursor() as cur:
                 cur.execute("SELECT numerocm, numerocm_consultor FROM public.produtores")
                 produtor_cm_map = {row[0]: row[1] for row in cur.fetchall()}
 
-                if limpar:
-                    cur.execute("DELETE FROM public.fazendas")
+                alvo = swap.criar_sombra(cur, "fazendas") if limpar else "fazendas"
                 values = []
                 seen = set()
                 for d in items:
@@ -3468,26 +3916,26 @@ def run_sync_fazendas(limpar: bool = False):
                     seen.add(key)
                     values.append([str(uuid.uuid4()), numerocm, idfazenda, nomefazenda, cm_cons, cadpro, cod_imovel])
                 if values:
-                    execute_values(
-                        cur,
-                        """
-                        INSERT INTO public.fazendas (id, numerocm, idfazenda, nomefazenda, numerocm_consultor, cadpro, cod_imovel)
-                        VALUES %s
-                        ON CONFLICT (numerocm, idfazenda) DO UPDATE SET
-                          nomefazenda = EXCLUDED.nomefazenda,
-                          numerocm_consultor = EXCLUDED.numerocm_consultor,
-                          cadpro = EXCLUDED.cadpro,
-                          cod_imovel = EXCLUDED.cod_imovel,
-                          updated_at = now()
-                        """,
-                        values,
+                    bulk.upsert(
+                        cur, alvo, ["id", "numerocm", "idfazenda", "nomefazenda", "numerocm_consultor", "cadpro", "cod_imovel"], values,
+                        conflito=["numerocm", "idfazenda"], atualizar=["nomefazenda", "numerocm_consultor", "cadpro", "cod_imovel"],
                     )
                     imported = len(values)
+                if limpar:
+                    # O id da fazenda é referenciado por talhoes.fazenda_id: mantém pelo (numerocm, idfazenda)
+                    swap.preservar(cur, "fazendas", alvo, ["numerocm", "idfazenda"], ["nomefazenda", "numerocm_consultor", "cadpro", "cod_imovel"])
+                    _, pendentes = swap.trocar(cur, "fazendas", alvo, ["id"])
+                if progresso is not None:
+                    # Última verificação antes do commit: se a tarefa foi perdida, desfaz tudo
+                    progresso("gravando", processados=imported)
+        swap.validar_fks(conn, pendentes)
         return {"ok": True, "imported": imported, "ignored": ignored}
+    except swap.SubstituicaoRecusada as e:
+        return {"error": str(e), "status": 409}
     finally:
         pool.putconn(conn)
 
-def run_sync_consultores(limpar: bool = False):
+def run_sync_consultores(limpar: bool = False, progresso=None):
     ensure_system_config_schema()
     ensure_consultores_schema()
     cfg = get_config_map([
@@ -3548,11 +3996,11 @@ def run_sync_consultores(limpar: bool = False):
     conn = pool.getconn()
     imported = 0
     ignored = 0
+    pendentes = []
     try:
         with conn:
             with conn.cursor() as cur:
-                if limpar:
-                    cur.execute("DELETE FROM public.consultores")
+                alvo = swap.criar_sombra(cur, "consultores") if limpar else "consultores"
                 values = []
                 seen = set()
                 for d in items:
@@ -3578,23 +4026,37 @@ def run_sync_consultores(limpar: bool = False):
                     values.append([str(uuid.uuid4()), numerocm_consultor, consultor, email, 'consultor', True, False])
                 
                 if values:
-                    execute_values(
-                        cur,
-                        """
-                        INSERT INTO public.consultores (id, numerocm_consultor, consultor, email, role, ativo, pode_editar_programacao)
-                        VALUES %s
-                        ON CONFLICT (email) DO UPDATE SET
-                          numerocm_consultor = EXCLUDED.numerocm_consultor,
-                          consultor = EXCLUDED.consultor,
-                          updated_at = now()
-                        """,
-                        values,
+                    bulk.upsert(
+                        cur, alvo, ["id", "numerocm_consultor", "consultor", "email", "role", "ativo", "pode_editar_programacao"], values,
+                        conflito=["email"], atualizar=["numerocm_consultor", "consultor"],
                     )
                     imported = len(values)
+                if limpar:
+                    # Senha, perfil e permissões seguem o e-mail; admins fora da API externa bloqueiam a troca
+                    swap.preservar(cur, "consultores", alvo, ["email"], ["numerocm_consultor", "consultor"])
+                    _, pendentes = swap.trocar(cur, "consultores", alvo, ["id"], validar=_validar_substituicao_consultores)
+                if progresso is not None:
+                    # Última verificação antes do commit: se a tarefa foi perdida, desfaz tudo
+                    progresso("gravando", processados=imported)
+        swap.validar_fks(conn, pendentes)
         return {"ok": True, "imported": imported, "ignored": ignored}
+    except swap.SubstituicaoRecusada as e:
+        return {"error": str(e), "status": 409}
     finally:
         pool.putconn(conn)
 
+def _validar_substituicao_consultores(cur, sombra):
+    cur.execute(
+        f"""
+        SELECT c.email FROM public.consultores c
+        WHERE c.role = 'admin' AND NOT EXISTS (SELECT 1 FROM public.{sombra} s WHERE s.id = c.id)
+        ORDER BY c.email
+        """
+    )
+    admins = [r[0] for r in cur.fetchall()]
+    if admins:
+        raise swap.SubstituicaoRecusada("substituição removeria administradores: " + ", ".join(admins))
+
 def _start_sync_scheduler():
     def loop():
         last_run_def = 0
@@ -3667,6 +4129,46 @@ def _start_sync_scheduler():
     t.start()
 
 _start_sync_scheduler()
+
+_SYNC_JOBS = {
+    "defensivos": run_sync_defensivos,
+    "produtores": run_sync_produtores,
+    "fazendas": run_sync_fazendas,
+    "consultores": run_sync_consultores,
+}
+
+def _job_sync(payload, arquivo, progresso, job_id):
+    alvo = payload.get("alvo")
+    if alvo not in _SYNC_JOBS:
+        raise ValueError(f"sincronização desconhecida: {alvo}")
+    progresso("sincronizando")
+    # progresso é verificado antes do commit; depois dele não há mais checagem,
+    # para que um batimento perdido não descarte uma sincronização já gravada
+    return _SYNC_JOBS[alvo](bool(payload.get("limpar")), progresso)
+
+def _job_demanda(payload, arquivo, progresso, job_id):
+    progresso("recalculando demanda")
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        return demanda.atualizar(conn, completo=bool(payload.get("completo")))
+    finally:
+        pool.putconn(conn)
+
+def _job_geometry_audit(payload, arquivo, progresso, job_id):
+    progresso("recalculando geometrias")
+    return run_geometry_audit(payload.get("tolerancia_pct"))
+
+def _job_sobreposicoes(payload, arquivo, progresso, job_id):
+    progresso("analisando sobreposições")
+    return run_overlap_analysis()
+
+jobs.register("import", _job_import)
+jobs.register("sync", _job_sync)
+jobs.register("demanda", _job_demanda)
+jobs.register("geometry_audit", _job_geometry_audit)
+jobs.register("sobreposicoes", _job_sobreposicoes)
+jobs.start()
 @app.route("/defensivos", methods=["POST"])
 def upsert_defensivo():
     ensure_defensivos_schema()
@@ -3695,6 +4197,8 @@ def upsert_defensivo():
 
 @app.route("/defensivos/bulk", methods=["POST"])
 def upsert_defensivos_bulk():
+    if _is_planilha_upload():
+        return _importar_planilha("defensivos")
     ensure_defensivos_schema()
     payload = request.get_json(silent=True) or {}
     items = payload.get("items") or []
@@ -3716,23 +4220,15 @@ def upsert_defensivos_bulk():
         })
     if not to_insert:
         return jsonify({"error": "items sem cod_item válido"}), 400
-    stmt = _pg_insert(DefensivoCatalog.__table__).values(to_insert)
-    upsert_stmt = stmt.on_conflict_do_update(
-        index_elements=[DefensivoCatalog.cod_item],
-        set_={
-            "item": stmt.excluded.item,
-            "grupo": stmt.excluded.grupo,
-            "marca": stmt.excluded.marca,
-            "principio_ativo": stmt.excluded.principio_ativo,
-            "saldo": stmt.excluded.saldo,
-            "updated_at": text("now()"),
-        },
+    bulk.upsert(
+        bulk.cursor_sessao(session), "defensivos_catalog", ["cod_item", "item", "grupo", "marca", "principio_ativo", "saldo"], to_insert,
+        conflito=["cod_item"],
     )
-    session.execute(upsert_stmt)
     session.commit()
     return jsonify({"ok": True, "imported": len(to_insert)})
 
 @app.route("/talhoes", methods=["GET"])
+@cache_escopo("talhoes", "talhao_safras", "programacao_talhoes", "epocas", "fazendas", "user_produtores")
 def list_talhoes():
     # Endpoint para listar talhões com filtros de safra e época
     ensure_talhoes_schema()
@@ -3755,10 +4251,15 @@ def list_talhoes():
             user_id = payload.get("user_id")
         except Exception:
             role = None
+    try:
+        desde, reset = sync.parametro()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     pool = get_pool()
     conn = pool.getconn()
     try:
         with conn.cursor() as cur:
+            cursor = sync.marca(cur)
             allowed_numerocm = []
             if user_id and role == "consultor":
                 cur.execute("SELECT produtor_numerocm FROM public.user_produtores WHERE user_id = %s", [user_id])
@@ -3784,6 +4285,8 @@ def list_talhoes():
                                 t.bbox_min_lng,
                                 t.bbox_max_lat,
                                 t.bbox_max_lng,
+                                t.area_poligono,
+                                t.area_divergente,
                                 t.created_at,
                                 t.updated_at,
                                 COALESCE(ARRAY_REMOVE(ARRAY_AGG(ts.safra_id), NULL), ARRAY[]::TEXT[]) AS allowed_safras,
@@ -3805,10 +4308,11 @@ def list_talhoes():
                         OR EXISTS (SELECT 1 FROM public.talhao_safras ts2 WHERE ts2.talhao_id = t.id AND ts2.safra_id = %s)
                         OR EXISTS (SELECT 1 FROM public.programacao_talhoes pt2 WHERE pt2.talhao_id = t.id AND pt2.safra_id = %s)
                       )
+                      AND (%s::timestamptz IS NULL OR t.updated_at >= %s)
                     GROUP BY t.id, t.fazenda_id, t.nome, t.area, t.arrendado, t.safras_todas, t.created_at, t.updated_at
                     ORDER BY t.nome
                     """,
-                    (safra_id, epoca_id, id_list, (cm_token if role == "consultor" else None), (cm_token if role == "consultor" else None), allowed_numerocm, safra_id, safra_id, safra_id)
+                    (safra_id, epoca_id, id_list, (cm_token if role == "consultor" else None), (cm_token if role == "consultor" else None), allowed_numerocm, safra_id, safra_id, safra_id, desde, desde)
                 )
             elif fazenda_id:
                 print(f"DEBUG: list_talhoes fazenda_id={fazenda_id} safra_id={safra_id} epoca_id={epoca_id}")
@@ -3830,6 +4334,8 @@ def list_talhoes():
                         t.bbox_min_lng,
                         t.bbox_max_lat,
                         t.bbox_max_lng,
+                        t.area_poligono,
+                        t.area_divergente,
                         t.created_at,
                         t.updated_at,
                         COALESCE(ARRAY_REMOVE(ARRAY_AGG(ts.safra_id), NULL), ARRAY[]::TEXT[]) AS allowed_safras,
@@ -3851,10 +4357,11 @@ def list_talhoes():
                         OR EXISTS (SELECT 1 FROM public.talhao_safras ts2 WHERE ts2.talhao_id = t.id AND ts2.safra_id = %s)
                         OR EXISTS (SELECT 1 FROM public.programacao_talhoes pt2 WHERE pt2.talhao_id = t.id AND pt2.safra_id = %s)
                       )
+                      AND (%s::timestamptz IS NULL OR t.updated_at >= %s)
                     GROUP BY t.id, t.fazenda_id, t.nome, t.area, t.arrendado, t.safras_todas, t.created_at, t.updated_at
                     ORDER BY t.nome
                     """,
-                    [safra_id, epoca_id, fazenda_id, (cm_token if role == "consultor" else None), (cm_token if role == "consultor" else None), allowed_numerocm, safra_id, safra_id, safra_id]
+                    [safra_id, epoca_id, fazenda_id, (cm_token if role == "consultor" else None), (cm_token if role == "consultor" else None), allowed_numerocm, safra_id, safra_id, safra_id, desde, desde]
                 )
                 # Debug output results
                 # rows_debug = cur.fetchall()
@@ -3867,9 +4374,8 @@ def list_talhoes():
                 # por padrão evitar retornar todos; retornar vazio
                 return jsonify({"items": [], "count": 0})
             rows = cur.fetchall()
-            cols = [d[0] for d in cur.description]
-            items = [dict(zip(cols, r)) for r in rows]
-            return jsonify({"items": items, "count": len(items)})
+            items = serializacao.Linhas.do_cursor(cur, rows)
+            return jsonify(sync.completar(cur, {"items": items, "count": len(items)}, "talhoes", desde, reset, cursor))
     finally:
         pool.putconn(conn)
 
@@ -3924,6 +4430,7 @@ def create_talhao():
                             """,
                             [sid, id_val, str(s)]
                         )
+                eventos.publicar(cur, "talhoes", "insert", id_val)
         return jsonify({"id": id_val})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
@@ -3982,6 +4489,8 @@ def update_talhao(id: str):
                     f"UPDATE public.talhoes SET {', '.join(set_parts)}, updated_at = now() WHERE id = %s",
                     values + [id]
                 )
+                if area is not None:
+                    refresh_divergencia(cur, [id], get_tolerancia_pct())
                 if safras_todas is not None:
                     if bool(safras_todas):
                         cur.execute("DELETE FROM public.talhao_safras WHERE talhao_id = %s", [id])
@@ -3997,6 +4506,7 @@ def update_talhao(id: str):
                                 """,
                                 [sid, id, str(s)]
                             )
+                eventos.publicar(cur, "talhoes", "update", id)
         return jsonify({"ok": True, "id": id})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
@@ -4021,7 +4531,11 @@ def delete_talhao(id: str):
                     return jsonify({
                         "error": "Talhão não pode ser excluído: existe programação vinculada (sementes/adubação)."
                     }), 400
+                eventos.publicar(cur, "talhoes", "delete", id)
+                antes = talhao_index.assinatura(cur)
                 cur.execute("DELETE FROM public.talhoes WHERE id = %s", [id])
+                depois = talhao_index.assinatura(cur)
+        talhao_index.remove(id, antes, depois)
         return jsonify({"ok": True})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
@@ -4094,15 +4608,22 @@ def _parse_kml_to_geojson(kml_text: str) -> dict:
     lats = [p[1] for p in all_points]
     min_lng = min(lons); max_lng = max(lons)
     min_lat = min(lats); max_lat = max(lats)
-    centroid_lng = sum(lons)/len(lons)
-    centroid_lat = sum(lats)/len(lats)
     geojson = {
         "type": "GeometryCollection",
         "geometries": geoms,
         "bbox": [min_lng, min_lat, max_lng, max_lat],
     }
+    # Centroide ponderado por área quando há polígono; média dos vértices só para linhas/pontos
+    metrics = polygon_metrics(geojson)
+    if metrics and metrics["centroid_lat"] is not None:
+        centroid_lng = metrics["centroid_lng"]
+        centroid_lat = metrics["centroid_lat"]
+    else:
+        centroid_lng = sum(lons)/len(lons)
+        centroid_lat = sum(lats)/len(lats)
     return {
         "geojson": geojson,
+        "metrics": metrics,
         "centroid": [centroid_lng, centroid_lat],
         "bbox": {
             "min_lng": min_lng,
@@ -4131,6 +4652,7 @@ def upload_talhao_kml(id: str):
     try:
         with conn:
             with conn.cursor() as cur:
+                antes = talhao_index.assinatura(cur)
                 cur.execute(
                     """
                     UPDATE public.talhoes
@@ -4160,9 +4682,36 @@ def upload_talhao_kml(id: str):
                         id,
                     ],
                 )
-                cur.execute("SELECT kml_text IS NOT NULL, kml_name FROM public.talhoes WHERE id = %s", [id])
-                row = cur.fetchone() or (False, None)
-                return jsonify({"ok": True, "id": id, "filename": filename, "has_kml": bool(row[0]), "kml_name": row[1]})
+                if cur.rowcount == 0:
+                    return jsonify({"error": "talhão não encontrado"}), 404
+                metrics = parsed.get("metrics")
+                if metrics:
+                    store_metrics(cur, [(id, round(metrics["area_ha"], 4), round(metrics["perimetro_m"], 2), metrics["centroid_lat"], metrics["centroid_lng"])], get_tolerancia_pct())
+                else:
+                    cur.execute("UPDATE public.talhoes SET area_poligono = NULL, perimetro_poligono = NULL, area_divergencia_pct = NULL, area_divergente = NULL, geometria_calculada_em = now() WHERE id = %s", [id])
+                cur.execute("SELECT kml_text IS NOT NULL, kml_name, area, area_poligono, perimetro_poligono, area_divergencia_pct, area_divergente, fazenda_id FROM public.talhoes WHERE id = %s", [id])
+                row = cur.fetchone() or (False, None, None, None, None, None, None, None)
+                b = parsed["bbox"]
+                bbox = (b["min_lat"], b["min_lng"], b["max_lat"], b["max_lng"])
+                sobreposicoes = check_talhao(cur, id, bbox, parsed["geojson"])
+                eventos.publicar(cur, "talhoes", "update", id)
+                depois = talhao_index.assinatura(cur)
+        # Índice só depois do commit
+        talhao_index.upsert(id, row[7], bbox, parsed["geojson"], antes, depois)
+        return jsonify({
+            "ok": True,
+            "id": id,
+            "filename": filename,
+            "has_kml": bool(row[0]),
+            "kml_name": row[1],
+            "area": row[2],
+            "area_poligono": row[3],
+            "perimetro_poligono": row[4],
+            "area_divergencia_pct": row[5],
+            "area_divergente": row[6],
+            "sobreposicoes": len(sobreposicoes),
+            "duplicado": any(r[5] for r in sobreposicoes),
+        })
     except Exception as e:
         return jsonify({"error": str(e)}), 400
     finally:
@@ -4176,13 +4725,13 @@ def get_talhao_geometry(id: str):
     try:
         with conn.cursor() as cur:
             cur.execute(
-                "SELECT geojson, centroid_lat, centroid_lng, bbox_min_lat, bbox_min_lng, bbox_max_lat, bbox_max_lng, kml_name, kml_uploaded_at FROM public.talhoes WHERE id = %s",
+                "SELECT geojson, centroid_lat, centroid_lng, bbox_min_lat, bbox_min_lng, bbox_max_lat, bbox_max_lng, kml_name, kml_uploaded_at, area_poligono, perimetro_poligono, area_divergencia_pct, area_divergente FROM public.talhoes WHERE id = %s",
                 [id],
             )
             row = cur.fetchone()
             if not row:
                 return jsonify({"error": "talhão não encontrado"}), 404
-            keys = ["geojson", "centroid_lat", "centroid_lng", "bbox_min_lat", "bbox_min_lng", "bbox_max_lat", "bbox_max_lng", "kml_name", "kml_uploaded_at"]
+            keys = ["geojson", "centroid_lat", "centroid_lng", "bbox_min_lat", "bbox_min_lng", "bbox_max_lat", "bbox_max_lng", "kml_name", "kml_uploaded_at", "area_poligono", "perimetro_poligono", "area_divergencia_pct", "area_divergente"]
             item = dict(zip(keys, row))
             try:
                 item["geojson"] = json.loads(item["geojson"]) if item["geojson"] else None
@@ -4192,6 +4741,216 @@ def get_talhao_geometry(id: str):
     finally:
         pool.putconn(conn)
 
+def _talhoes_scope(cur):
+    # Escopo do consultor (mesma regra de list_talhoes): fazendas onde é consultor ou de produtores vinculados
+    auth = request.headers.get("Authorization") or ""
+    role = None
+    cm_token = None
+    user_id = None
+    if auth.lower().startswith("bearer "):
+        try:
+            payload = verify_jwt(auth.split(" ", 1)[1])
+            role = (payload.get("role") or "consultor").lower()
+            cm_token = payload.get("numerocm_consultor")
+            user_id = payload.get("user_id")
+        except Exception:
+            role = None
+    allowed_numerocm = []
+    if user_id and role == "consultor":
+        cur.execute("SELECT produtor_numerocm FROM public.user_produtores WHERE user_id = %s", [user_id])
+        allowed_numerocm = [r[0] for r in cur.fetchall()]
+    return (cm_token if role == "consultor" else None), allowed_numerocm
+
+def _fetch_talhoes_by_ids(cur, ids, include_geojson=False, limit=None):
+    # limit é aplicado depois do escopo do consultor
+    cm_scope, allowed_numerocm = _talhoes_scope(cur)
+    cur.execute(
+        """
+        SELECT t.id, t.fazenda_id, f.nomefazenda, f.numerocm, t.nome, t.area, t.area_poligono,
+               t.centroid_lat, t.centroid_lng, t.bbox_min_lat, t.bbox_min_lng, t.bbox_max_lat, t.bbox_max_lng
+               """ + (", t.geojson" if include_geojson else "") + """
+        FROM public.talhoes t
+        LEFT JOIN public.fazendas f ON f.id = t.fazenda_id
+        WHERE t.id = ANY(%s)
+          AND (%s IS NULL OR f.numerocm_consultor = %s OR f.numerocm = ANY(%s))
+        ORDER BY t.nome
+        """ + (" LIMIT %s" if limit else ""),
+        [list(ids), cm_scope, cm_scope, allowed_numerocm] + ([limit] if limit else []),
+    )
+    cols = [d[0] for d in cur.description]
+    return [dict(zip(cols, r)) for r in cur.fetchall()]
+
+@app.route("/talhoes/at", methods=["GET"])
+def talhoes_at_point():
+    # Talhão que contém o ponto GPS (índice em grade + ponto-em-polígono)
+    ensure_talhoes_schema()
+    try:
+        lat = float(request.args.get("lat"))
+        lng = float(request.args.get("lng"))
+    except Exception:
+        return jsonify({"error": "lat e lng obrigatórios"}), 400
+    include_geojson = str(request.args.get("geojson") or "").lower() in ("1", "true")
+    try:
+        ids = talhao_index.at(lat, lng)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+    if not ids:
+        return jsonify({"items": [], "count": 0})
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            items = _fetch_talhoes_by_ids(cur, ids, include_geojson)
+            return jsonify({"items": items, "count": len(items)})
+    finally:
+        pool.putconn(conn)
+
+@app.route("/talhoes/in_bbox", methods=["GET"])
+def talhoes_in_bbox():
+    # Talhões cujo bbox intersecta o viewport do mapa
+    ensure_talhoes_schema()
+    try:
+        min_lat = float(request.args.get("min_lat"))
+        min_lng = float(request.args.get("min_lng"))
+        max_lat = float(request.args.get("max_lat"))
+        max_lng = float(request.args.get("max_lng"))
+    except Exception:
+        return jsonify({"error": "min_lat, min_lng, max_lat e max_lng obrigatórios"}), 400
+    if min_lat > max_lat or min_lng > max_lng:
+        return jsonify({"error": "bbox inválido"}), 400
+    try:
+        limit = max(1, min(int(request.args.get("limit") or 2000), 10000))
+    except Exception:
+        limit = 2000
+    include_geojson = str(request.args.get("geojson") or "").lower() in ("1", "true")
+    try:
+        ids = talhao_index.in_bbox(min_lat, min_lng, max_lat, max_lng)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+    if not ids:
+        return jsonify({"items": [], "count": 0, "truncated": False})
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            # Uma linha a mais que o limite indica que há mais talhões visíveis ao usuário
+            items = _fetch_talhoes_by_ids(cur, ids, include_geojson, limit=limit + 1)
+            truncated = len(items) > limit
+            items = items[:limit]
+            return jsonify({"items": items, "count": len(items), "truncated": truncated})
+    finally:
+        pool.putconn(conn)
+
+@app.route("/talhoes/sobreposicoes", methods=["POST"])
+def talhoes_overlap_analysis():
+    # Análise completa (todos os pares) sempre como tarefa em /jobs
+    denied = _require_admin()
+    if denied:
+        return denied
+    ensure_talhoes_schema()
+    return _job_accepted(jobs.submit("sobreposicoes", {}, user_id=_usuario_token()))
+
+@app.route("/talhoes/sobreposicoes", methods=["GET"])
+def list_talhoes_sobreposicoes():
+    # Pares sobrepostos envolvendo talhões de uma fazenda ou de um produtor
+    ensure_talhoes_schema()
+    fazenda_id = request.args.get("fazenda_id")
+    numerocm = request.args.get("numerocm")
+    if not fazenda_id and not numerocm:
+        return jsonify({"error": "fazenda_id ou numerocm obrigatório"}), 400
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            cm_scope, allowed_numerocm = _talhoes_scope(cur)
+            cur.execute(
+                """
+                SELECT s.talhao_a_id, ta.nome AS talhao_a_nome, ta.fazenda_id AS fazenda_a_id, fa.nomefazenda AS fazenda_a_nome,
+                       s.talhao_b_id, tb.nome AS talhao_b_nome, tb.fazenda_id AS fazenda_b_id, fb.nomefazenda AS fazenda_b_nome,
+                       s.area_intersecao, s.pct_a, s.pct_b, s.duplicado, s.detectado_em
+                FROM public.talhao_sobreposicoes s
+                JOIN public.talhoes ta ON ta.id = s.talhao_a_id
+                JOIN public.talhoes tb ON tb.id = s.talhao_b_id
+                LEFT JOIN public.fazendas fa ON fa.id = ta.fazenda_id
+                LEFT JOIN public.fazendas fb ON fb.id = tb.fazenda_id
+                WHERE (
+                    (%s IS NOT NULL AND (ta.fazenda_id = %s OR tb.fazenda_id = %s))
+                    OR (%s IS NOT NULL AND (fa.numerocm = %s OR fb.numerocm = %s))
+                  )
+                  AND (%s IS NULL OR fa.numerocm_consultor = %s OR fa.numerocm = ANY(%s)
+                       OR fb.numerocm_consultor = %s OR fb.numerocm = ANY(%s))
+                ORDER BY s.duplicado DESC, s.area_intersecao DESC
+                """,
+                [
+                    fazenda_id, fazenda_id, fazenda_id,
+                    numerocm, numerocm, numerocm,
+                    cm_scope, cm_scope, allowed_numerocm, cm_scope, allowed_numerocm,
+                ],
+            )
+            cols = [d[0] for d in cur.description]
+            items = [dict(zip(cols, r)) for r in cur.fetchall()]
+            area_total = sum(float(i["area_intersecao"] or 0) for i in items)
+            return jsonify({"items": items, "count": len(items), "area_intersecao_total": round(area_total, 4)})
+    finally:
+        pool.putconn(conn)
+
+@app.route("/talhoes/geometry_audit", methods=["POST"])
+def talhoes_geometry_audit():
+    # Recalcula as métricas de todos os talhões; aceita async
+    denied = _require_admin()
+    if denied:
+        return denied
+    ensure_talhoes_schema()
+    payload = request.get_json(silent=True) or {}
+    tolerancia = payload.get("tolerancia_pct")
+    try:
+        tolerancia = float(tolerancia) if tolerancia is not None else None
+    except Exception:
+        return jsonify({"error": "tolerancia_pct inválida"}), 400
+    if _wants_async(payload):
+        return _job_accepted(jobs.submit("geometry_audit", {"tolerancia_pct": tolerancia}, user_id=_usuario_token()))
+    try:
+        return jsonify(run_geometry_audit(tolerancia))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route("/talhoes/geometry_audit", methods=["GET"])
+def list_talhoes_area_divergente():
+    if _escopo_jwt() is None:
+        return jsonify({"error": "sem token"}), 401
+    ensure_talhoes_schema()
+    fazenda_id = request.args.get("fazenda_id")
+    numerocm = request.args.get("numerocm")
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            cm_scope, allowed_numerocm = _talhoes_scope(cur)
+            where = ["t.area_divergente", "(%s IS NULL OR f.numerocm_consultor = %s OR f.numerocm = ANY(%s))"]
+            params = [cm_scope, cm_scope, allowed_numerocm]
+            if fazenda_id:
+                where.append("t.fazenda_id = %s")
+                params.append(fazenda_id)
+            if numerocm:
+                where.append("f.numerocm = %s")
+                params.append(numerocm)
+            cur.execute(
+                """
+                SELECT t.id, t.fazenda_id, f.nomefazenda, f.numerocm, t.nome, t.area, t.area_poligono,
+                       t.perimetro_poligono, t.area_divergencia_pct, t.geometria_calculada_em
+                FROM public.talhoes t
+                LEFT JOIN public.fazendas f ON f.id = t.fazenda_id
+                WHERE """ + " AND ".join(where) + """
+                ORDER BY t.area_divergencia_pct DESC NULLS LAST, t.nome
+                """,
+                params,
+            )
+            rows = cur.fetchall()
+            items = serializacao.Linhas.do_cursor(cur, rows)
+            return jsonify({"items": items, "count": len(items), "tolerancia_pct": get_tolerancia_pct()})
+    finally:
+        pool.putconn(conn)
+
 @app.route("/talhoes/<id>/kml", methods=["GET"])
 def download_talhao_kml(id: str):
     ensure_talhoes_schema()
@@ -4376,6 +5135,7 @@ def create_aplicacao_defensivos():
                         """,
                         [str(uuid.uuid4()), id_val, user_id, d.get("classe"), d.get("defensivo"), cod_val, d.get("dose"), d.get("unidade"), d.get("alvo"), d.get("produto_salvo"), d.get("deve_faturar"), d.get("porcentagem_salva"), d.get("area_hectares"), d.get("safra_id"), cm_token]
                     )
+                eventos.publicar(cur, "aplicacoes_defensivos", "insert", id_val)
         return jsonify({"id": id_val})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
@@ -4470,6 +5230,7 @@ def update_aplicacao_defensivos(id: str):
                         """,
                         [str(uuid.uuid4()), id, user_id, d.get("classe"), d.get("defensivo"), cod_val, d.get("dose"), d.get("unidade"), d.get("alvo"), d.get("produto_salvo"), d.get("deve_faturar"), d.get("porcentagem_salva"), d.get("area_hectares"), d.get("safra_id"), cm_token]
                     )
+                eventos.publicar(cur, "aplicacoes_defensivos", "update", id)
         return jsonify({"ok": True, "id": id})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
@@ -4484,6 +5245,7 @@ def delete_aplicacao_defensivos(id: str):
     try:
         with conn:
             with conn.cursor() as cur:
+                eventos.publicar(cur, "aplicacoes_defensivos", "delete", id)
                 cur.execute("DELETE FROM public.aplicacoes_defensivos WHERE id = %s", [id])
         return jsonify({"ok": True})
     except Exception as e:
@@ -4529,6 +5291,9 @@ def create_jwt(payload: Dict[str, Any], exp_seconds: Optional[int] = None) -> st
 
 
 def verify_jwt(token: str) -> dict:
+    em_lote = multiplex.token_verificado(token)
+    if em_lote is not None:
+        return dict(em_lote)
     try:
         parts = (token or "").split(".")
         if len(parts) != 3:
@@ -4545,6 +5310,9 @@ def verify_jwt(token: str) -> dict:
     except Exception as e:
         raise ValueError(str(e))
 
+eventos.start(verify_jwt)
+admissao.configurar_token(verify_jwt)
+
 def _hash_password(password: str) -> str:
     salt = os.urandom(16)
     iterations = 100_000
@@ -4677,8 +5445,7 @@ def list_users():
         with conn.cursor() as cur:
             cur.execute("SELECT id, numerocm_consultor, consultor, email, role, ativo, created_at, updated_at FROM public.consultores ORDER BY consultor")
             rows = cur.fetchall()
-            cols = [d[0] for d in cur.description]
-            items = [dict(zip(cols, r)) for r in rows]
+            items = serializacao.Linhas.do_cursor(cur, rows)
             return jsonify({"items": items, "count": len(items)})
     finally:
         pool.putconn(conn)
@@ -4823,41 +5590,34 @@ def remove_user_produtor(id: str):
         pool.putconn(conn)
 
 @app.route("/embalagens", methods=["GET"])
+@conditional_cache("embalagens")
 def list_embalagens():
     ensure_embalagens_schema()
     scope = (request.args.get("scope") or "").strip().lower()
     cultura = (request.args.get("cultura") or "").strip()
     only_active = True if (request.args.get("ativo") or "true").strip().lower() in ("true", "1") else False
-    session = get_session()
-    q = select(Embalagem)
+    where = []
+    params = []
     if only_active:
-        q = q.where(Embalagem.ativo == True)
+        where.append("ativo")
     if scope in ("cultivar", "fertilizante", "defensivo"):
-        col = {
-            "cultivar": Embalagem.scope_cultivar,
-            "fertilizante": Embalagem.scope_fertilizante,
-            "defensivo": Embalagem.scope_defensivo,
-        }[scope]
-        q = q.where(col == True)
+        where.append(f"scope_{scope}")
     if cultura:
-        q = q.where((Embalagem.cultura.is_(None)) | (Embalagem.cultura == cultura))
-    items = session.execute(q.order_by(Embalagem.nome)).scalars().all()
-    return jsonify({
-        "items": [
-            {
-                "id": it.id,
-                "nome": it.nome,
-                "ativo": bool(it.ativo),
-                "scope_cultivar": bool(it.scope_cultivar),
-                "scope_fertilizante": bool(it.scope_fertilizante),
-                "scope_defensivo": bool(it.scope_defensivo),
-                "cultura": it.cultura,
-                "created_at": it.created_at.isoformat() if it.created_at else None,
-                "updated_at": it.updated_at.isoformat() if it.updated_at else None,
-            } for it in items
-        ],
-        "count": len(items),
-    })
+        where.append("(cultura IS NULL OR cultura = %s)")
+        params.append(cultura)
+    try:
+        desde, reset = sync.parametro()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if desde is not None:
+        where.append("updated_at >= %s")
+        params.append(desde)
+    return jsonify(leitura.itens(
+        "SELECT id, nome, ativo, scope_cultivar, scope_fertilizante, scope_defensivo, cultura, created_at, updated_at"
+        " FROM public.embalagens" + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY nome",
+        params,
+        incremental=("embalagens", desde, reset),
+    ))
 
 @app.route("/embalagens/bulk", methods=["POST"])
 def upsert_embalagens_bulk():
@@ -4889,20 +5649,10 @@ def upsert_embalagens_bulk():
         })
     if not to_insert:
         return jsonify({"error": "items vazios"}), 400
-    stmt = _pg_insert(Embalagem.__table__).values(to_insert)
-    upsert_stmt = stmt.on_conflict_do_update(
-        index_elements=[Embalagem.id],
-        set_={
-            "nome": stmt.excluded.nome,
-            "ativo": stmt.excluded.ativo,
-            "scope_cultivar": stmt.excluded.scope_cultivar,
-            "scope_fertilizante": stmt.excluded.scope_fertilizante,
-            "scope_defensivo": stmt.excluded.scope_defensivo,
-            "cultura": stmt.excluded.cultura,
-            "updated_at": text("now()"),
-        },
+    bulk.upsert(
+        bulk.cursor_sessao(session), "embalagens", ["id", "nome", "ativo", "scope_cultivar", "scope_fertilizante", "scope_defensivo", "cultura"], to_insert,
+        conflito=["id"],
     )
-    session.execute(upsert_stmt)
     session.commit()
     return jsonify({"ok": True, "processed": len(to_insert)})
 
@@ -4997,6 +5747,8 @@ def sync_produtores():
         return ("", 204)
     payload = request.get_json(silent=True) or {}
     limpar = bool(payload.get("limparAntes"))
+    if _wants_async(payload):
+        return _job_accepted(jobs.submit("sync", {"alvo": "produtores", "limpar": limpar}, user_id=_usuario_token()))
     res = run_sync_produtores(limpar)
     status = res.get("status", 200)
     if "error" in res:
@@ -5046,6 +5798,8 @@ def sync_fazendas():
         return ("", 204)
     payload = request.get_json(silent=True) or {}
     limpar = bool(payload.get("limparAntes"))
+    if _wants_async(payload):
+        return _job_accepted(jobs.submit("sync", {"alvo": "fazendas", "limpar": limpar}, user_id=_usuario_token()))
     res = run_sync_fazendas(limpar)
     status = res.get("status", 200)
     if "error" in res:
@@ -5095,6 +5849,8 @@ def sync_consultores():
         return ("", 204)
     payload = request.get_json(silent=True) or {}
     limpar = bool(payload.get("limparAntes"))
+    if _wants_async(payload):
+        return _job_accepted(jobs.submit("sync", {"alvo": "consultores", "limpar": limpar}, user_id=_usuario_token()))
     res = run_sync_consultores(limpar)
     status = res.get("status", 200)
     if "error" in res:
@@ -5364,6 +6120,59 @@ def report_programacao_safra():
     finally:
         session.close()
 
+@app.route("/demanda", methods=["GET"])
+def get_demanda():
+    """
+    Demanda de insumos agregada (quantidade, área e embalagens).
+    Agrupa por insumo, safra, época, cultura, cod_item, unidade fabril e consultor
+    (ou pelos campos de ?agrupar=a,b). Filtros: insumo, tipo (padrão PROGRAMACAO;
+    "todos" desliga), safra_id, epoca_id, cultura, cod_item, cod_unidade_fabril,
+    numerocm_consultor. As alterações pendentes são recalculadas antes da leitura.
+    """
+    filtros = {k: request.args.get(k) for k in demanda.FILTROS}
+    tipo = (request.args.get("tipo") or "PROGRAMACAO").strip().upper()
+    filtros["tipo"] = None if tipo == "TODOS" else tipo
+    auth = request.headers.get("Authorization") or ""
+    if auth.lower().startswith("bearer "):
+        try:
+            payload_jwt = verify_jwt(auth.split(" ", 1)[1])
+            if (payload_jwt.get("role") or "consultor").lower() == "consultor" and payload_jwt.get("numerocm_consultor"):
+                filtros["numerocm_consultor"] = payload_jwt.get("numerocm_consultor")
+        except Exception:
+            pass
+    grupo = [g.strip() for g in (request.args.get("agrupar") or "").split(",") if g.strip()] or None
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        resumo = demanda.atualizar(conn)
+        with conn:
+            with conn.cursor() as cur:
+                items = demanda.consultar(cur, filtros, grupo)
+        return jsonify({"items": items, "count": len(items), "atualizacao": resumo})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+    finally:
+        pool.putconn(conn)
+
+@app.route("/demanda/refresh", methods=["POST"])
+def refresh_demanda():
+    # Recalcula a demanda; ?completo=1 refaz tudo em vez de só as pendências
+    denied = _require_admin()
+    if denied:
+        return denied
+    payload = request.get_json(silent=True) or {}
+    completo = str(request.args.get("completo") or payload.get("completo") or "").strip().lower() in ("1", "true", "yes", "on")
+    if _wants_async(payload):
+        return _job_accepted(jobs.submit("demanda", {"completo": completo}, user_id=_usuario_token()))
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        return jsonify(demanda.atualizar(conn, completo=completo))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+    finally:
+        pool.putconn(conn)
+
 @app.route("/reports/consolidated", methods=["GET"])
 def report_consolidated():
     """
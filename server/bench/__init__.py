@@ -0,0 +1,2 @@
+# Benchmarks da API: gerador de dados sintéticos (bench.generator) e
+# harness de medição por endpoint (bench.harness).
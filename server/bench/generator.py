@@ -0,0 +1,289 @@
+"""
+Gerador determinístico de dados sintéticos para benchmark.
+
+Uso (a partir de server/):
+    python -m bench.generator --scale medium --truncate
+
+Os dados são gerados com semente fixa (mesmos ids e valores a cada execução) e
+carregados com COPY. --truncate apaga as tabelas de negócio antes da carga:
+use apenas em um banco local de benchmark.
+"""
+import argparse
+import base64
+import csv
+import hashlib
+import io
+import json
+import math
+import random
+import time
+import uuid
+from db import (
+    get_pool,
+    ensure_system_config_schema,
+    ensure_consultores_schema,
+    ensure_produtores_schema,
+    ensure_fazendas_schema,
+    ensure_talhoes_schema,
+    ensure_safras_schema,
+    ensure_epocas_schema,
+    ensure_defensivos_schema,
+    ensure_fertilizantes_schema,
+    ensure_cultivares_catalog_schema,
+    ensure_programacao_schema,
+    ensure_aplicacoes_defensivos_schema,
+    ensure_gestor_consultores_schema,
+)
+
+SCALES = {
+    "small": {"consultores": 5, "produtores": 100, "fazendas": 2, "talhoes": 5, "catalogo": 2000, "cultivares": 300},
+    "medium": {"consultores": 20, "produtores": 1000, "fazendas": 3, "talhoes": 8, "catalogo": 20000, "cultivares": 2000},
+    "large": {"consultores": 60, "produtores": 5000, "fazendas": 3, "talhoes": 10, "catalogo": 20000, "cultivares": 4000},
+}
+
+EPOCA_NORMAL = "2e667834-eac8-415e-98d0-ec63ba150e2c"
+CULTURAS = ["SOJA", "MILHO", "TRIGO", "FEIJAO", "AVEIA"]
+CLASSES = ["HERBICIDA", "FUNGICIDA", "INSETICIDA", "ADJUVANTE", "TS"]
+GRUPOS = ["FERTILIZANTES", "CORRETIVOS", "FOLIARES"]
+BENCH_PASSWORD = "bench123"
+
+# Ordem de limpeza respeita as FKs (filhos antes dos pais)
+TABLES = [
+    "aplicacao_defensivos_talhoes",
+    "programacao_defensivos",
+    "aplicacoes_defensivos",
+    "programacao_talhoes",
+    "programacao_adubacao",
+    "programacao_cultivares_defensivos",
+    "programacao_cultivares_tratamentos",
+    "programacao_cultivares",
+    "programacoes",
+    "talhao_sobreposicoes",
+    "talhao_safras",
+    "talhoes",
+    "fazendas",
+    "produtores",
+    "gestor_consultores",
+    "consultores",
+    "safras",
+    "defensivos_catalog",
+    "fertilizantes_catalog",
+    "cultivares_catalog",
+]
+
+
+class Gen:
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+
+    def uid(self):
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def choice(self, seq):
+        return self.rng.choice(seq)
+
+    def num(self, lo, hi, nd=2):
+        return round(self.rng.uniform(lo, hi), nd)
+
+
+def _polygon(g, lat0, lng0, ha):
+    # Polígono irregular (8-16 vértices) com área aproximada em hectares
+    r_m = math.sqrt(ha * 10000.0 / math.pi)
+    n = g.rng.randint(8, 16)
+    pts = []
+    for i in range(n):
+        ang = 2 * math.pi * i / n
+        rr = r_m * g.rng.uniform(0.8, 1.2)
+        dlat = (rr * math.sin(ang)) / 111320.0
+        dlng = (rr * math.cos(ang)) / (111320.0 * math.cos(math.radians(lat0)))
+        pts.append([round(lng0 + dlng, 7), round(lat0 + dlat, 7)])
+    pts.append(pts[0])
+    lons = [p[0] for p in pts]
+    lats = [p[1] for p in pts]
+    geo = {"type": "GeometryCollection", "geometries": [{"type": "Polygon", "coordinates": [pts]}],
+           "bbox": [min(lons), min(lats), max(lons), max(lats)]}
+    return geo, (min(lats), min(lons), max(lats), max(lons))
+
+
+def _copy(cur, table, cols, rows):
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    for r in rows:
+        w.writerow(["\\N" if v is None else v for v in r])
+    buf.seek(0)
+    cur.copy_expert(
+        f"COPY public.{table} ({', '.join(cols)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+        buf,
+    )
+    return len(rows)
+
+
+def generate(scale="medium", seed=42):
+    cfg = SCALES[scale]
+    g = Gen(seed)
+    data = {}
+
+    safras = []
+    for i, ano in enumerate((2023, 2024, 2025)):
+        safras.append((g.uid(), f"{ano}/{ano + 1}", ano == 2025, True, ano, ano + 1))
+    data["safras"] = (["id", "nome", "is_default", "ativa", "ano_inicio", "ano_fim"], safras)
+    safra_ids = [s[0] for s in safras]
+
+    # Senha fixa para todos os usuários de benchmark (login pelo harness em modo HTTP);
+    # mesmo formato de _hash_password em app.py, com sal determinístico
+    salt = bytes(g.rng.getrandbits(8) for _ in range(16))
+    dk = hashlib.pbkdf2_hmac("sha256", BENCH_PASSWORD.encode("utf-8"), salt, 100_000)
+    digest = f"pbkdf2_sha256$100000${base64.b64encode(salt).decode()}${base64.b64encode(dk).decode()}"
+    consultores = []
+    for i in range(cfg["consultores"]):
+        role = "admin" if i == 0 else "consultor"
+        consultores.append((g.uid(), f"{9000 + i}", f"Consultor {i}", f"bench{i}@example.com", role, True, digest))
+    cms_consultor = [c[1] for c in consultores]
+    # Gestores supervisionam grupos de consultores (gestor_consultores)
+    gestor_links = []
+    for i in range(max(1, cfg["consultores"] // 5)):
+        gid = g.uid()
+        consultores.append((gid, f"{8000 + i}", f"Gestor {i}", f"gestor{i}@example.com", "gestor", True, digest))
+        for cm in cms_consultor[1 + i * 5:1 + (i + 1) * 5]:
+            gestor_links.append((g.uid(), gid, cm))
+    data["consultores"] = (["id", "numerocm_consultor", "consultor", "email", "role", "ativo", "password_digest"], consultores)
+    data["gestor_consultores"] = (["id", "user_id", "numerocm_consultor"], gestor_links)
+
+    defensivos = [(f"D{i:06d}", f"DEFENSIVO {i}", g.choice(CLASSES), f"MARCA {i % 300}", f"PRINCIPIO {i % 800}", g.num(0, 5000))
+                  for i in range(cfg["catalogo"])]
+    fertilizantes = [(f"F{i:06d}", f"FERTILIZANTE {i}", g.choice(GRUPOS), f"MARCA {i % 200}", None, g.num(0, 5000))
+                     for i in range(cfg["catalogo"])]
+    cultivares = [(f"CULTIVAR {i}", CULTURAS[i % len(CULTURAS)], f"RNC{i:05d}") for i in range(cfg["cultivares"])]
+    data["defensivos_catalog"] = (["cod_item", "item", "grupo", "marca", "principio_ativo", "saldo"], defensivos)
+    data["fertilizantes_catalog"] = (["cod_item", "item", "grupo", "marca", "principio_ativo", "saldo"], fertilizantes)
+    data["cultivares_catalog"] = (["cultivar", "cultura", "rnc"], cultivares)
+
+    produtores, fazendas, talhoes = [], [], []
+    programacoes, prog_cult, prog_adub, prog_talhoes = [], [], [], []
+    aplicacoes, prog_def, aplic_talhoes = [], [], []
+    for p in range(cfg["produtores"]):
+        numerocm = f"{100000 + p}"
+        cm_cons = cms_consultor[p % len(cms_consultor)]
+        produtores.append((g.uid(), numerocm, f"Produtor {p}", cm_cons, f"Consultor {p % len(cms_consultor)}"))
+        # Região base por produtor (oeste do Paraná); fazendas e talhões ao redor
+        lat_base = -25.5 + g.num(-1.5, 1.5, 5)
+        lng_base = -53.5 + g.num(-1.5, 1.5, 5)
+        for f in range(cfg["fazendas"]):
+            faz_id = g.uid()
+            idfazenda = str(f + 1)
+            fazendas.append((faz_id, numerocm, idfazenda, f"Fazenda {p}-{f}", cm_cons))
+            faz_talhoes = []
+            for t in range(cfg["talhoes"]):
+                area = g.num(5, 120)
+                lat0 = lat_base + f * 0.05 + (t // 4) * 0.012
+                lng0 = lng_base + (t % 4) * 0.012
+                geo, bbox = _polygon(g, lat0, lng0, area)
+                tid = g.uid()
+                faz_talhoes.append((tid, area))
+                talhoes.append((tid, faz_id, f"T{t + 1}", area, False, True, json.dumps(geo, separators=(",", ":")),
+                                lat0, lng0, bbox[0], bbox[1], bbox[2], bbox[3]))
+            for safra_id in safra_ids:
+                prog_id = g.uid()
+                area_total = round(sum(a for _, a in faz_talhoes), 2)
+                programacoes.append((prog_id, numerocm, idfazenda, f"Fazenda {p}-{f}", area_total, safra_id, "PROGRAMACAO"))
+                for tid, _ in faz_talhoes:
+                    prog_talhoes.append((g.uid(), prog_id, tid, safra_id, idfazenda, EPOCA_NORMAL))
+                for _ in range(g.rng.randint(1, 3)):
+                    cv = g.choice(cultivares)
+                    prog_cult.append((g.uid(), prog_id, numerocm, f"Fazenda {p}-{f}", area_total, cm_cons, cv[1], cv[0],
+                                      g.num(10, 80), "SC", 100, safra_id, EPOCA_NORMAL))
+                for _ in range(g.rng.randint(1, 2)):
+                    fe = g.choice(fertilizantes)
+                    prog_adub.append((g.uid(), prog_id, numerocm, f"Fazenda {p}-{f}", cm_cons, fe[1], fe[0], g.num(100, 500), 100, safra_id))
+                aplic_id = g.uid()
+                aplicacoes.append((aplic_id, numerocm, f"Fazenda {p}-{f}", safra_id, "PROGRAMACAO", EPOCA_NORMAL, g.choice(CULTURAS)))
+                for tid, _ in faz_talhoes:
+                    aplic_talhoes.append((g.uid(), aplic_id, tid, safra_id))
+                for _ in range(g.rng.randint(2, 6)):
+                    d = g.choice(defensivos)
+                    prog_def.append((g.uid(), aplic_id, d[2], d[1], g.num(0.1, 3), "L/HA", area_total, safra_id, cm_cons))
+
+    data["produtores"] = (["id", "numerocm", "nome", "numerocm_consultor", "consultor"], produtores)
+    data["fazendas"] = (["id", "numerocm", "idfazenda", "nomefazenda", "numerocm_consultor"], fazendas)
+    data["talhoes"] = (["id", "fazenda_id", "nome", "area", "arrendado", "safras_todas", "geojson", "centroid_lat", "centroid_lng",
+                        "bbox_min_lat", "bbox_min_lng", "bbox_max_lat", "bbox_max_lng"], talhoes)
+    data["programacoes"] = (["id", "produtor_numerocm", "fazenda_idfazenda", "area", "area_hectares", "safra_id", "tipo"], programacoes)
+    data["programacao_talhoes"] = (["id", "programacao_id", "talhao_id", "safra_id", "fazenda_idfazenda", "epoca_id"], prog_talhoes)
+    data["programacao_cultivares"] = (["id", "programacao_id", "produtor_numerocm", "area", "area_hectares", "numerocm_consultor", "cultura",
+                                       "cultivar", "quantidade", "unidade", "percentual_cobertura", "safra", "epoca_id"], prog_cult)
+    data["programacao_adubacao"] = (["id", "programacao_id", "produtor_numerocm", "area", "numerocm_consultor", "formulacao", "cod_item",
+                                     "dose", "percentual_cobertura", "safra_id"], prog_adub)
+    data["aplicacoes_defensivos"] = (["id", "produtor_numerocm", "area", "safra_id", "tipo", "epoca_id", "cultura"], aplicacoes)
+    data["aplicacao_defensivos_talhoes"] = (["id", "aplicacao_id", "talhao_id", "safra_id"], aplic_talhoes)
+    data["programacao_defensivos"] = (["id", "aplicacao_id", "classe", "defensivo", "dose", "unidade", "area_hectares", "safra_id",
+                                       "numerocm_consultor"], prog_def)
+    return data
+
+
+LOAD_ORDER = [
+    "safras", "consultores", "gestor_consultores", "defensivos_catalog", "fertilizantes_catalog", "cultivares_catalog",
+    "produtores", "fazendas", "talhoes", "programacoes", "programacao_talhoes", "programacao_cultivares",
+    "programacao_adubacao", "aplicacoes_defensivos", "aplicacao_defensivos_talhoes", "programacao_defensivos",
+]
+
+
+def ensure_schema():
+    for fn in (
+        ensure_system_config_schema, ensure_consultores_schema, ensure_produtores_schema, ensure_fazendas_schema,
+        ensure_talhoes_schema, ensure_safras_schema, ensure_epocas_schema, ensure_defensivos_schema,
+        ensure_fertilizantes_schema, ensure_cultivares_catalog_schema, ensure_programacao_schema,
+        ensure_aplicacoes_defensivos_schema, ensure_gestor_consultores_schema,
+    ):
+        fn()
+    # password_digest não é criado pelos ensure_* (vem de bases já existentes)
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("ALTER TABLE public.consultores ADD COLUMN IF NOT EXISTS password_digest TEXT")
+    finally:
+        pool.putconn(conn)
+
+
+def load(data, truncate=False):
+    ensure_schema()
+    pool = get_pool()
+    conn = pool.getconn()
+    counts = {}
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                if truncate:
+                    cur.execute("TRUNCATE " + ", ".join(f"public.{t}" for t in TABLES))
+                for table in LOAD_ORDER:
+                    cols, rows = data[table]
+                    t0 = time.time()
+                    counts[table] = {"rows": _copy(cur, table, cols, rows), "ms": int((time.time() - t0) * 1000)}
+                cur.execute("ANALYZE")
+    finally:
+        pool.putconn(conn)
+    return counts
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Carga de dados sintéticos para benchmark")
+    ap.add_argument("--scale", choices=sorted(SCALES), default="medium")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--truncate", action="store_true", help="apaga as tabelas de negócio antes da carga")
+    args = ap.parse_args(argv)
+    t0 = time.time()
+    data = generate(args.scale, args.seed)
+    t_gen = time.time()
+    counts = load(data, truncate=args.truncate)
+    print(json.dumps({
+        "scale": args.scale,
+        "seed": args.seed,
+        "generate_ms": int((t_gen - t0) * 1000),
+        "load_ms": int((time.time() - t_gen) * 1000),
+        "tables": counts,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""
+Harness de benchmark por endpoint.
+
+Uso (a partir de server/):
+    python -m bench.harness --out antes.json                 # test client do Flask
+    python -m bench.harness --url http://127.0.0.1:5000 --out depois.json
+    python -m bench.harness --compare antes.json depois.json
+
+Para cada endpoint mede latência (p50/p95/p99), quantidade de queries e tempo
+de banco (lidos do header Server-Timing), bytes da resposta e o pico de RSS.
+Os parâmetros (safra, produtor, fazenda...) são amostrados do próprio banco,
+então rode depois de bench.generator.
+"""
+import argparse
+import json
+import os
+import re
+import resource
+import subprocess
+import sys
+import time
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from db import get_pool
+
+_RE_TIMING = re.compile(r'(\w+);dur=([\d.]+)(?:;desc="(\d+) queries")?')
+
+
+def _percentile(sorted_vals, pct):
+    if not sorted_vals:
+        return None
+    k = (len(sorted_vals) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_vals) - 1)
+    return sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (k - lo)
+
+
+def _parse_server_timing(header):
+    out = {}
+    for name, dur, queries in _RE_TIMING.findall(header or ""):
+        out[name] = float(dur)
+        if queries:
+            out["queries"] = int(queries)
+    return out
+
+
+def sample_params():
+    # Amostra ids reais do banco para montar as URLs
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id FROM public.safras ORDER BY is_default DESC, nome DESC LIMIT 1")
+            safra_id = (cur.fetchone() or [None])[0]
+            cur.execute(
+                """
+                SELECT f.id, f.numerocm, f.numerocm_consultor, f.idfazenda
+                FROM public.fazendas f
+                WHERE EXISTS (SELECT 1 FROM public.talhoes t WHERE t.fazenda_id = f.id)
+                ORDER BY f.numerocm, f.idfazenda
+                LIMIT 1
+                """
+            )
+            faz = cur.fetchone() or (None, None, None, None)
+            cur.execute("SELECT id, centroid_lat, centroid_lng FROM public.talhoes WHERE centroid_lat IS NOT NULL ORDER BY id LIMIT 1")
+            tal = cur.fetchone() or (None, None, None)
+            cur.execute("SELECT id, numerocm_consultor, email FROM public.consultores WHERE role = 'admin' ORDER BY email LIMIT 1")
+            admin = cur.fetchone() or (None, None, None)
+    finally:
+        pool.putconn(conn)
+    return {
+        "safra_id": safra_id,
+        "fazenda_id": faz[0],
+        "numerocm": faz[1],
+        "numerocm_consultor": faz[2],
+        "talhao_id": tal[0],
+        "lat": float(tal[1]) if tal[1] is not None else None,
+        "lng": float(tal[2]) if tal[2] is not None else None,
+        "admin_id": admin[0],
+        "admin_cm": admin[1],
+        "admin_email": admin[2],
+    }
+
+
+def endpoints(p):
+    eps = [
+        ("safras", "/safras", {}),
+        ("epocas", "/epocas", {}),
+        ("defensivos", "/defensivos", {}),
+        ("fertilizantes", "/fertilizantes", {}),
+        ("cultivares_catalog", "/cultivares_catalog", {}),
+        ("embalagens", "/embalagens", {}),
+        ("produtores", "/produtores", {"numerocm_consultor": p["numerocm_consultor"]}),
+        ("fazendas", "/fazendas", {"numerocm": p["numerocm"], "safra_id": p["safra_id"]}),
+        ("talhoes", "/talhoes", {"fazenda_id": p["fazenda_id"], "safra_id": p["safra_id"]}),
+        ("programacoes", "/programacoes", {"safra_id": p["safra_id"]}),
+        ("aplicacoes_defensivos", "/aplicacoes_defensivos", {}),
+        ("reports_programacao_safra", "/reports/programacao_safra", {"safra_id": p["safra_id"], "produtor_numerocm": p["numerocm"]}),
+        ("reports_consolidated", "/reports/consolidated", {"safra_id": p["safra_id"]}),
+        ("reports_mapa_fazendas", "/reports/mapa_fazendas", {"produtor_numerocm": p["numerocm"]}),
+    ]
+    if p["lat"] is not None:
+        eps.append(("talhoes_at", "/talhoes/at", {"lat": p["lat"], "lng": p["lng"]}))
+        eps.append(("talhoes_in_bbox", "/talhoes/in_bbox", {
+            "min_lat": p["lat"] - 0.05, "min_lng": p["lng"] - 0.05, "max_lat": p["lat"] + 0.05, "max_lng": p["lng"] + 0.05,
+        }))
+    return [(name, path + ("?" + urlencode({k: v for k, v in q.items() if v is not None}) if q else "")) for name, path, q in eps]
+
+
+class TestClientDriver:
+    mode = "test_client"
+
+    def __init__(self, params):
+        from app import app, create_jwt
+        self.client = app.test_client()
+        token = create_jwt({"user_id": params["admin_id"], "role": "admin", "numerocm_consultor": params["admin_cm"]})
+        self.headers = {"Authorization": f"Bearer {token}", "Accept-Encoding": "gzip"}
+
+    def get(self, path):
+        r = self.client.get(path, headers=self.headers)
+        return r.status_code, r.headers.get("Server-Timing"), len(r.get_data())
+
+    def peak_rss_kb(self):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class HttpDriver:
+    mode = "http"
+
+    def __init__(self, base_url, params, token=None, password=None, pid=None):
+        self.base = base_url.rstrip("/")
+        self.pid = pid
+        if not token:
+            body = json.dumps({"email": params["admin_email"], "password": password or "bench123"}).encode("utf-8")
+            req = Request(self.base + "/auth/login", data=body, headers={"Content-Type": "application/json"})
+            with urlopen(req, timeout=30) as resp:
+                token = json.loads(resp.read().decode("utf-8")).get("token")
+        self.headers = {"Authorization": f"Bearer {token}", "Accept-Encoding": "gzip"}
+
+    def get(self, path):
+        req = Request(self.base + path, headers=self.headers)
+        try:
+            with urlopen(req, timeout=120) as resp:
+                data = resp.read()
+                return resp.status, resp.headers.get("Server-Timing"), len(data)
+        except HTTPError as e:
+            return e.code, e.headers.get("Server-Timing"), len(e.read() or b"")
+
+    def peak_rss_kb(self):
+        # VmHWM do processo do servidor (gunicorn: passar o pid do worker)
+        if not self.pid:
+            return None
+        try:
+            with open(f"/proc/{self.pid}/status") as fh:
+                for line in fh:
+                    if line.startswith("VmHWM:"):
+                        return int(line.split()[1])
+        except OSError:
+            return None
+        return None
+
+
+def run(driver, eps, iterations=20, warmup=2):
+    results = {}
+    for name, path in eps:
+        for _ in range(warmup):
+            driver.get(path)
+        lat, queries, db_ms, sizes, errors = [], [], [], [], 0
+        for _ in range(iterations):
+            t0 = time.perf_counter()
+            status, timing, size = driver.get(path)
+            lat.append((time.perf_counter() - t0) * 1000.0)
+            if status >= 400:
+                errors += 1
+            st = _parse_server_timing(timing)
+            if "queries" in st:
+                queries.append(st["queries"])
+            if "db" in st:
+                db_ms.append(st["db"])
+            sizes.append(size)
+        lat.sort()
+        results[name] = {
+            "path": path,
+            "n": iterations,
+            "errors": errors,
+            "p50_ms": round(_percentile(lat, 50), 2),
+            "p95_ms": round(_percentile(lat, 95), 2),
+            "p99_ms": round(_percentile(lat, 99), 2),
+            "mean_ms": round(sum(lat) / len(lat), 2),
+            "max_ms": round(lat[-1], 2),
+            "queries": max(queries) if queries else None,
+            "db_ms_mean": round(sum(db_ms) / len(db_ms), 2) if db_ms else None,
+            "bytes": max(sizes) if sizes else None,
+        }
+        print(f"{name:32s} p50={results[name]['p50_ms']:>9.2f}ms p95={results[name]['p95_ms']:>9.2f}ms "
+              f"q={results[name]['queries']} err={errors}", file=sys.stderr)
+    return results
+
+
+def _git_rev():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(before_path, after_path):
+    with open(before_path) as fh:
+        a = json.load(fh)
+    with open(after_path) as fh:
+        b = json.load(fh)
+    print(f"{'endpoint':32s} {'p50 antes':>10s} {'p50 depois':>10s} {'Δ%':>7s} {'p95 antes':>10s} {'p95 depois':>10s} {'Δ%':>7s} {'queries':>11s}")
+    for name in sorted(set(a["endpoints"]) | set(b["endpoints"])):
+        ea = a["endpoints"].get(name)
+        eb = b["endpoints"].get(name)
+        if not ea or not eb:
+            print(f"{name:32s} {'(só em um dos arquivos)':>40s}")
+            continue
+        d50 = (eb["p50_ms"] - ea["p50_ms"]) / ea["p50_ms"] * 100 if ea["p50_ms"] else 0.0
+        d95 = (eb["p95_ms"] - ea["p95_ms"]) / ea["p95_ms"] * 100 if ea["p95_ms"] else 0.0
+        q = f"{ea.get('queries')}->{eb.get('queries')}"
+        print(f"{name:32s} {ea['p50_ms']:>10.2f} {eb['p50_ms']:>10.2f} {d50:>+7.1f} {ea['p95_ms']:>10.2f} {eb['p95_ms']:>10.2f} {d95:>+7.1f} {q:>11s}")
+    ra = a["meta"].get("peak_rss_kb")
+    rb = b["meta"].get("peak_rss_kb")
+    if ra and rb:
+        print(f"peak RSS: {ra} KB -> {rb} KB")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark dos endpoints da API")
+    ap.add_argument("--url", help="base da API (gunicorn/flask em execução); sem isso usa o test client")
+    ap.add_argument("--token", help="JWT para o modo HTTP (padrão: login do admin de benchmark)")
+    ap.add_argument("--password", help="senha do admin de benchmark no modo HTTP")
+    ap.add_argument("--pid", type=int, help="pid do servidor para medir pico de RSS no modo HTTP")
+    ap.add_argument("--iterations", type=int, default=20)
+    ap.add_argument("--warmup", type=int, default=2)
+    ap.add_argument("--only", help="lista de endpoints separados por vírgula")
+    ap.add_argument("--out", help="arquivo JSON de saída")
+    ap.add_argument("--compare", nargs=2, metavar=("ANTES", "DEPOIS"))
+    args = ap.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    params = sample_params()
+    eps = endpoints(params)
+    if args.only:
+        wanted = {s.strip() for s in args.only.split(",") if s.strip()}
+        eps = [e for e in eps if e[0] in wanted]
+    if args.url:
+        driver = HttpDriver(args.url, params, token=args.token, password=args.password, pid=args.pid)
+    else:
+        driver = TestClientDriver(params)
+    started = time.time()
+    results = run(driver, eps, iterations=args.iterations, warmup=args.warmup)
+    report = {
+        "meta": {
+            "git_rev": _git_rev(),
+            "mode": driver.mode,
+            "iterations": args.iterations,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(started)),
+            "elapsed_s": round(time.time() - started, 2),
+            "peak_rss_kb": driver.peak_rss_kb(),
+            "pid": os.getpid(),
+        },
+        "endpoints": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as fh:
+            fh.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Micro-benchmark da leitura de catálogos: ORM (entidades mapeadas) x cursor direto.
+
+Uso (a partir de server/, com dados de bench.generator):
+    python -m bench.leitura --iterations 20
+
+Para cada endpoint de catálogo/configuração executa a consulta das duas formas
+e mede só o trecho consulta -> lista de dicts pronta para JSON (sem Flask),
+reportando mediana em ms, linhas e o ganho relativo.
+"""
+import argparse
+import json
+import statistics
+import time
+from sqlalchemy import select
+from sa import get_session
+from models import (
+    DefensivoCatalog, FertilizanteCatalog, CultivarCatalog, Embalagem,
+    TratamentoSemente, SystemConfig, AppVersion, ImportHistory,
+)
+import leitura
+
+
+def _iso(v):
+    return v.isoformat() if v else None
+
+
+def _orm(model, order, campos, limit=None):
+    # Caminho anterior: select(Model).scalars() + dict campo a campo
+    def run():
+        session = get_session()
+        try:
+            q = select(model).order_by(*order)
+            if limit:
+                q = q.limit(limit)
+            items = session.execute(q).scalars().all()
+            out = []
+            for it in items:
+                d = {}
+                for c in campos:
+                    v = getattr(it, c)
+                    if c in ("created_at", "updated_at"):
+                        v = _iso(v)
+                    elif c == "saldo":
+                        v = float(v) if v is not None else None
+                    d[c] = v
+                out.append(d)
+            return out
+        finally:
+            session.close()
+    return run
+
+
+def _direto(sql):
+    return lambda: leitura.consultar(sql)
+
+
+def casos():
+    cat = ["cod_item", "item", "grupo", "marca", "principio_ativo", "saldo", "created_at", "updated_at"]
+    emb = ["id", "nome", "ativo", "scope_cultivar", "scope_fertilizante", "scope_defensivo", "cultura", "created_at", "updated_at"]
+    hist = ["id", "user_id", "tabela_nome", "registros_importados", "registros_deletados", "registros_rejeitados", "duracao_ms", "arquivo_nome", "limpar_antes", "created_at"]
+    return [
+        ("defensivos",
+         _orm(DefensivoCatalog, [DefensivoCatalog.item.nulls_last(), DefensivoCatalog.cod_item], cat),
+         _direto(f"SELECT {', '.join(cat)} FROM public.defensivos_catalog ORDER BY item NULLS LAST, cod_item")),
+        ("fertilizantes",
+         _orm(FertilizanteCatalog, [FertilizanteCatalog.item.nulls_last(), FertilizanteCatalog.cod_item], cat),
+         _direto(f"SELECT {', '.join(cat)} FROM public.fertilizantes_catalog ORDER BY item NULLS LAST, cod_item")),
+        ("cultivares_catalog",
+         _orm(CultivarCatalog, [CultivarCatalog.cultivar], ["cultivar", "cultura", "nome_cientifico", "rnc", "created_at", "updated_at"]),
+         _direto("SELECT cultivar, cultura, nome_cientifico, rnc, created_at, updated_at FROM public.cultivares_catalog ORDER BY cultivar")),
+        ("embalagens",
+         _orm(Embalagem, [Embalagem.nome], emb),
+         _direto(f"SELECT {', '.join(emb)} FROM public.embalagens ORDER BY nome")),
+        ("tratamentos_sementes",
+         _orm(TratamentoSemente, [TratamentoSemente.nome], ["id", "nome", "cultura", "ativo", "created_at", "updated_at"]),
+         _direto("SELECT id, nome, cultura, ativo, created_at, updated_at FROM public.tratamentos_sementes ORDER BY nome")),
+        ("config",
+         _orm(SystemConfig, [SystemConfig.config_key], ["config_key", "config_value", "description", "created_at", "updated_at"]),
+         _direto("SELECT config_key, config_value, description, created_at, updated_at FROM public.system_config ORDER BY config_key")),
+        ("versions",
+         _orm(AppVersion, [AppVersion.created_at.desc()], ["id", "version", "build", "environment", "notes", "created_at"]),
+         _direto("SELECT id, version, build, environment, notes, created_at FROM public.app_versions ORDER BY created_at DESC")),
+        ("import_history",
+         _orm(ImportHistory, [ImportHistory.created_at.desc()], hist, limit=100),
+         _direto(f"SELECT {', '.join(hist)} FROM public.import_history ORDER BY created_at DESC LIMIT 100")),
+    ]
+
+
+def _medir(fn, iterations, warmup):
+    for _ in range(warmup):
+        fn()
+    tempos = []
+    linhas = 0
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        linhas = len(fn())
+        tempos.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(tempos), linhas
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Micro-benchmark ORM x cursor direto nos catálogos")
+    ap.add_argument("--iterations", type=int, default=20)
+    ap.add_argument("--warmup", type=int, default=2)
+    ap.add_argument("--out", help="arquivo JSON de saída")
+    args = ap.parse_args(argv)
+
+    resultados = []
+    print(f"{'endpoint':<22}{'linhas':>8}{'orm ms':>10}{'direto ms':>11}{'ganho':>8}")
+    for nome, orm, direto in casos():
+        t_orm, n = _medir(orm, args.iterations, args.warmup)
+        t_dir, _ = _medir(direto, args.iterations, args.warmup)
+        ganho = t_orm / t_dir if t_dir > 0 else None
+        resultados.append({"endpoint": nome, "linhas": n, "orm_ms": round(t_orm, 2), "direto_ms": round(t_dir, 2), "ganho": round(ganho, 2) if ganho else None})
+        print(f"{nome:<22}{n:>8}{t_orm:>10.2f}{t_dir:>11.2f}{(f'{ganho:.1f}x' if ganho else '-'):>8}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+"""
+Teste de carga com sessões realistas por perfil (somente biblioteca padrão).
+
+Uso (a partir de server/, com a API rodando e dados de bench.generator):
+    python -m bench.loadtest --url http://127.0.0.1:5000 --levels 1,4,8,16,32 --duration 30 --out carga.json
+
+Cada usuário virtual faz login com um usuário de benchmark do seu perfil
+(consultor, gestor ou admin) e repete a sessão:
+    /auth/me -> /produtores -> /fazendas?safra_id -> /talhoes?fazenda_id
+    -> /programacoes -> cria, altera e remove uma programação
+Para cada nível de concorrência são medidos vazão, taxa de erro e latência por
+passo; o tempo de espera no pool de conexões vem da diferença de /metrics
+antes/depois do nível (com vários workers do gunicorn, /metrics reflete apenas
+o worker que atendeu a coleta).
+"""
+import argparse
+import gzip
+import http.client
+import json
+import random
+import re
+import sys
+import threading
+import time
+from urllib.parse import urlsplit, urlencode
+
+BENCH_PASSWORD = "bench123"
+DEFAULT_MIX = "consultor=0.7,gestor=0.2,admin=0.1"
+
+
+def _percentile(sorted_vals, pct):
+    if not sorted_vals:
+        return None
+    k = (len(sorted_vals) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_vals) - 1)
+    return sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (k - lo)
+
+
+class Client:
+    # Uma conexão keep-alive por usuário virtual
+    def __init__(self, base_url, timeout=60):
+        u = urlsplit(base_url)
+        self.prefix = u.path.rstrip("/")
+        cls = http.client.HTTPSConnection if u.scheme == "https" else http.client.HTTPConnection
+        self.conn = cls(u.hostname, u.port or (443 if u.scheme == "https" else 80), timeout=timeout)
+        self.token = None
+        self.cm = None
+
+    def request(self, method, path, body=None):
+        headers = {"Accept-Encoding": "gzip"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        try:
+            self.conn.request(method, self.prefix + path, body=data, headers=headers)
+            resp = self.conn.getresponse()
+            raw = resp.read()
+        except (http.client.HTTPException, OSError):
+            self.conn.close()
+            raise
+        payload = None
+        if resp.getheader("Content-Encoding") == "gzip":
+            raw = gzip.decompress(raw)
+        if raw and (resp.getheader("Content-Type") or "").startswith("application/json"):
+            try:
+                payload = json.loads(raw.decode("utf-8"))
+            except ValueError:
+                payload = None
+        return resp.status, payload
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.steps = {}
+        self.sessions = 0
+        self.errors = {}
+
+    def add(self, step, ms, ok, detail=None):
+        with self.lock:
+            self.steps.setdefault(step, {"lat": [], "errors": 0})
+            self.steps[step]["lat"].append(ms)
+            if not ok:
+                self.steps[step]["errors"] += 1
+                key = f"{step}: {detail}"
+                self.errors[key] = self.errors.get(key, 0) + 1
+
+    def session_done(self):
+        with self.lock:
+            self.sessions += 1
+
+
+def _timed(rec, client, step, method, path, body=None):
+    t0 = time.perf_counter()
+    try:
+        status, payload = client.request(method, path, body)
+        ok = status < 400
+        detail = None if ok else str(status)
+    except Exception as e:
+        status, payload, ok, detail = None, None, False, type(e).__name__
+    rec.add(step, (time.perf_counter() - t0) * 1000.0, ok, detail)
+    return status, payload
+
+
+def session(rec, client, user, ctx, rng):
+    if not client.token:
+        status, payload = _timed(rec, client, "login", "POST", "/auth/login", {"email": user, "password": BENCH_PASSWORD})
+        if not payload or not payload.get("token"):
+            return False
+        client.token = payload["token"]
+        me = payload.get("user") or {}
+        client.cm = me.get("numerocm_consultor")
+    _timed(rec, client, "auth_me", "GET", "/auth/me")
+    q = {"numerocm_consultor": client.cm} if client.cm else {}
+    _, prods = _timed(rec, client, "produtores", "GET", "/produtores?" + urlencode(q))
+    items = (prods or {}).get("items") or []
+    numerocm = rng.choice(items).get("numerocm") if items else ctx["numerocm"]
+    _, fazs = _timed(rec, client, "fazendas", "GET", "/fazendas?" + urlencode({"numerocm": numerocm, "safra_id": ctx["safra_id"]}))
+    fitems = (fazs or {}).get("items") or []
+    faz = rng.choice(fitems) if fitems else None
+    if faz:
+        _timed(rec, client, "talhoes", "GET", "/talhoes?" + urlencode({"fazenda_id": faz.get("id"), "safra_id": ctx["safra_id"]}))
+    _timed(rec, client, "programacoes", "GET", "/programacoes?" + urlencode({"safra_id": ctx["safra_id"]}))
+    if faz:
+        # Programação sem talhões/safra: não conflita com os dados carregados e é removida ao final
+        body = {
+            "produtor_numerocm": numerocm,
+            "fazenda_idfazenda": faz.get("idfazenda"),
+            "area": faz.get("nomefazenda") or "carga",
+            "area_hectares": 10,
+        }
+        status, created = _timed(rec, client, "programacao_create", "POST", "/programacoes", body)
+        prog_id = (created or {}).get("id") if status and status < 400 else None
+        if prog_id:
+            body["area_hectares"] = 12
+            _timed(rec, client, "programacao_update", "PUT", f"/programacoes/{prog_id}", body)
+            _timed(rec, client, "programacao_delete", "DELETE", f"/programacoes/{prog_id}")
+    rec.session_done()
+    return True
+
+
+def _parse_mix(text):
+    mix = []
+    for part in (text or DEFAULT_MIX).split(","):
+        role, _, w = part.partition("=")
+        if role.strip():
+            mix.append((role.strip(), float(w or 1)))
+    return mix
+
+
+def _users_for(role, n):
+    if role == "admin":
+        return ["bench0@example.com"]
+    if role == "gestor":
+        return [f"gestor{i}@example.com" for i in range(max(1, n))]
+    return [f"bench{i}@example.com" for i in range(1, max(2, n + 1))]
+
+
+_RE_METRIC = re.compile(r'^(db_pool_getconn_seconds_sum|db_pool_getconn_seconds_count|db_pool_exhausted_total)(?:\{[^}]*\})? ([\d.eE+-]+)$', re.M)
+
+
+def scrape_pool_metrics(base_url):
+    c = Client(base_url, timeout=10)
+    try:
+        c.conn.request("GET", c.prefix + "/metrics")
+        text = c.conn.getresponse().read().decode("utf-8", errors="ignore")
+    except Exception:
+        return None
+    out = {}
+    for name, val in _RE_METRIC.findall(text):
+        out[name] = out.get(name, 0.0) + float(val)
+    return out
+
+
+def run_level(base_url, concurrency, duration, ctx, mix, seed):
+    rec = Recorder()
+    stop = time.time() + duration
+    roles = [r for r, _ in mix]
+    weights = [w for _, w in mix]
+    rng_master = random.Random(seed + concurrency)
+
+    def vu(idx):
+        rng = random.Random(rng_master.random() + idx)
+        role = rng.choices(roles, weights)[0]
+        users = _users_for(role, ctx["users_per_role"])
+        client = Client(base_url)
+        user = users[idx % len(users)]
+        while time.time() < stop:
+            try:
+                if not session(rec, client, user, ctx, rng):
+                    time.sleep(0.5)
+            except Exception:
+                client = Client(base_url)
+
+    before = scrape_pool_metrics(base_url)
+    t0 = time.time()
+    threads = [threading.Thread(target=vu, args=(i,), daemon=True) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - t0
+    after = scrape_pool_metrics(base_url)
+
+    total = sum(len(s["lat"]) for s in rec.steps.values())
+    errors = sum(s["errors"] for s in rec.steps.values())
+    steps = {}
+    for name, s in sorted(rec.steps.items()):
+        lat = sorted(s["lat"])
+        steps[name] = {
+            "n": len(lat),
+            "errors": s["errors"],
+            "p50_ms": round(_percentile(lat, 50), 2),
+            "p95_ms": round(_percentile(lat, 95), 2),
+            "p99_ms": round(_percentile(lat, 99), 2),
+        }
+    pool = None
+    if before is not None and after is not None:
+        n = after.get("db_pool_getconn_seconds_count", 0) - before.get("db_pool_getconn_seconds_count", 0)
+        wait = after.get("db_pool_getconn_seconds_sum", 0) - before.get("db_pool_getconn_seconds_sum", 0)
+        pool = {
+            "checkouts": int(n),
+            "wait_ms_total": round(wait * 1000, 2),
+            "wait_ms_mean": round(wait * 1000 / n, 3) if n else None,
+            "exhausted": int(after.get("db_pool_exhausted_total", 0) - before.get("db_pool_exhausted_total", 0)),
+        }
+    return {
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 2),
+        "requests": total,
+        "sessions": rec.sessions,
+        "throughput_rps": round(total / elapsed, 2) if elapsed else None,
+        "error_rate": round(errors / total, 4) if total else None,
+        "errors": dict(sorted(rec.errors.items(), key=lambda kv: -kv[1])[:20]),
+        "pool": pool,
+        "steps": steps,
+    }
+
+
+def discover_context(base_url):
+    # Safra padrão e um produtor de fallback, obtidos pela própria API como admin
+    c = Client(base_url)
+    _, payload = c.request("POST", "/auth/login", {"email": "bench0@example.com", "password": BENCH_PASSWORD})
+    c.token = (payload or {}).get("token")
+    _, safras = c.request("GET", "/safras")
+    items = (safras or {}).get("items") or []
+    default = next((s for s in items if s.get("is_default")), items[0] if items else {})
+    _, prods = c.request("GET", "/produtores")
+    pitems = (prods or {}).get("items") or []
+    return {"safra_id": default.get("id"), "numerocm": pitems[0].get("numerocm") if pitems else None}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Teste de carga por perfil com varredura de concorrência")
+    ap.add_argument("--url", required=True, help="base da API, ex.: http://127.0.0.1:5000")
+    ap.add_argument("--levels", default="1,2,4,8,16,32", help="níveis de concorrência")
+    ap.add_argument("--duration", type=float, default=30.0, help="segundos por nível")
+    ap.add_argument("--mix", default=DEFAULT_MIX, help="proporção de perfis, ex.: consultor=0.7,gestor=0.2,admin=0.1")
+    ap.add_argument("--users-per-role", type=int, default=4)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--out", help="arquivo JSON de saída")
+    args = ap.parse_args(argv)
+
+    ctx = discover_context(args.url)
+    ctx["users_per_role"] = args.users_per_role
+    mix = _parse_mix(args.mix)
+    levels = []
+    for c in [int(x) for x in args.levels.split(",") if x.strip()]:
+        res = run_level(args.url, c, args.duration, ctx, mix, args.seed)
+        levels.append(res)
+        pool = res["pool"] or {}
+        print(f"c={c:>3d} rps={res['throughput_rps']:>8} err={res['error_rate']} "
+              f"pool_wait_mean={pool.get('wait_ms_mean')}ms exhausted={pool.get('exhausted')}", file=sys.stderr)
+    report = {
+        "meta": {"url": args.url, "mix": args.mix, "duration_s": args.duration, "started_at": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "levels": levels,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as fh:
+            fh.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Benchmark de serialização JSON das listagens grandes.
+
+Uso (a partir de server/):
+    python -m bench.serializacao --linhas 100000              # linhas do banco (repetidas até --linhas)
+    python -m bench.serializacao --linhas 100000 --sintetico  # sem banco
+
+Mede só a serialização do resultado de /programacao_cultivares e /fazendas:
+dict(zip()) + DefaultJSONProvider do Flask (caminho anterior) contra
+serializacao.Linhas com o json padrão e, se instalado, com orjson, e o
+formato colunar (?format=columnar) para comparar o tamanho do payload.
+"""
+import argparse
+import datetime
+import json
+import statistics
+import time
+import uuid
+from decimal import Decimal
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+import serializacao
+
+CONSULTAS = {
+    "programacao_cultivares": (
+        "SELECT pc.*, (SELECT s.ano_inicio || '/' || s.ano_fim FROM public.safras s WHERE s.id = pc.safra LIMIT 1) AS safra_nome"
+        " FROM public.programacao_cultivares pc ORDER BY pc.created_at DESC LIMIT %s"
+    ),
+    "fazendas": (
+        "SELECT f.id, f.numerocm, f.idfazenda, f.nomefazenda, f.numerocm_consultor, f.cadpro, f.cod_imovel, f.created_at, f.updated_at,"
+        " COALESCE(SUM(t.area), 0) AS area_cultivavel"
+        " FROM public.fazendas f LEFT JOIN public.talhoes t ON t.fazenda_id = f.id GROUP BY f.id ORDER BY f.nomefazenda LIMIT %s"
+    ),
+}
+
+
+def _do_banco(nome, n):
+    from db import get_pool
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(CONSULTAS[nome], [n])
+            desc = cur.description
+            rows = cur.fetchall()
+    finally:
+        pool.putconn(conn)
+    return [d[0] for d in desc], [d[1] for d in desc], rows
+
+
+def _sintetico(nome, n):
+    agora = datetime.datetime.now(datetime.timezone.utc)
+    if nome == "fazendas":
+        cols = ["id", "numerocm", "idfazenda", "nomefazenda", "numerocm_consultor", "cadpro", "cod_imovel", "created_at", "updated_at", "area_cultivavel"]
+        tipos = [25, 25, 25, 25, 25, 25, 25, 1184, 1184, 1700]
+        gen = lambda i: (str(uuid.uuid4()), str(1000 + i % 900), str(i % 7), f"FAZENDA SÃO JOSÉ {i}", "123", None, f"SP-{i}", agora, agora, Decimal(f"{i % 500}.37"))
+    else:
+        cols = ["id", "produtor_numerocm", "fazenda_idfazenda", "area", "area_hectares", "cultivar", "quantidade", "unidade", "populacao_recomendada",
+                "semente_propria", "data_plantio", "safra", "epoca_id", "tipo_embalagem", "tipo_tratamento", "numerocm_consultor", "created_at", "updated_at", "safra_nome"]
+        tipos = [25, 25, 25, 25, 1700, 25, 1700, 25, 1700, 16, 1082, 25, 25, 25, 25, 25, 1184, 1184, 25]
+        gen = lambda i: (str(uuid.uuid4()), "1234", "2", f"Talhão {i}", Decimal("123.45"), "TMG 7062", Decimal("40"), "kg/ha", Decimal("300000"),
+                         i % 2 == 0, datetime.date(2025, 10, 1), "safra-1", "epoca-1", "BIG BAG", "INDUSTRIAL", "321", agora, agora, "2025/2026")
+    return cols, tipos, [gen(i) for i in range(n)]
+
+
+def _repetir(rows, n):
+    if not rows:
+        return rows
+    return (rows * (n // len(rows) + 1))[:n]
+
+
+def _medir(fn, iterations):
+    tempos = []
+    tamanho = 0
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        tamanho = len(fn())
+        tempos.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(tempos), tamanho
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark de serialização JSON das listagens")
+    ap.add_argument("--linhas", type=int, default=100000)
+    ap.add_argument("--iterations", type=int, default=5)
+    ap.add_argument("--sintetico", action="store_true", help="gera linhas em memória em vez de ler do banco")
+    ap.add_argument("--out", help="arquivo JSON de saída")
+    args = ap.parse_args(argv)
+
+    app = Flask("bench")
+    padrao = DefaultJSONProvider(app)
+    novo = serializacao.JSONProvider(app)
+    compacto = {"separators": (",", ":")}
+    backend_orjson = serializacao.orjson
+
+    resultados = []
+    print(f"{'endpoint':<24}{'variante':<22}{'ms':>10}{'MB':>8}")
+    for nome in CONSULTAS:
+        cols, tipos, rows = _sintetico(nome, args.linhas) if args.sintetico else _do_banco(nome, args.linhas)
+        rows = _repetir(rows, args.linhas)
+        variantes = [
+            ("dicts+flask", lambda: padrao.dumps({"items": [dict(zip(cols, r)) for r in rows], "count": len(rows)}, **compacto)),
+        ]
+
+        def linhas_json():
+            serializacao.orjson = None
+            try:
+                return novo.dumps({"items": serializacao.Linhas(cols, rows, tipos), "count": len(rows)}, **compacto)
+            finally:
+                serializacao.orjson = backend_orjson
+        variantes.append(("linhas+json", linhas_json))
+        if backend_orjson is not None:
+            variantes.append(("linhas+orjson", lambda: novo.dumps({"items": serializacao.Linhas(cols, rows, tipos), "count": len(rows)}, **compacto)))
+        variantes.append(("colunar", lambda: novo.dumps(serializacao.colunarizar({"items": serializacao.Linhas(cols, rows, tipos), "count": len(rows)}), **compacto)))
+
+        for variante, fn in variantes:
+            ms, tamanho = _medir(fn, args.iterations)
+            resultados.append({"endpoint": nome, "variante": variante, "linhas": len(rows), "ms": round(ms, 1), "bytes": tamanho})
+            print(f"{nome:<24}{variante:<22}{ms:>10.1f}{tamanho / 1e6:>8.1f}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
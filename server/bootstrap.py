@@ -0,0 +1,99 @@
+import json
+import hashlib
+import metrics
+from db import ensure_table_versions_schema
+
+# Pacote de início de sessão (/bootstrap): tudo o que o SPA busca depois do
+# login (usuário, perfil, safras, épocas, catálogos, produtores, fazendas,
+# config) numa única conexão e num único snapshot REPEATABLE READ.
+#
+# Cada seção tem um ETag calculado das versões das suas tabelas
+# (public.table_versions_atuais, lidas dentro do mesmo snapshot) e, nas seções
+# filtradas por usuário, do escopo do token. O cliente devolve os ETags que já
+# tem (?etags=secao:etag,... ou cabeçalho X-Bootstrap-ETags) e as seções
+# inalteradas voltam só com {"etag", "not_modified": true}, sem consulta.
+# Seção com tabela ainda sem versão sai sempre completa e sem ETag.
+
+_secoes = {}  # nome -> (fn, tabelas, escopo, preparar)
+
+
+def secao(nome, tabelas=(), escopo=False, preparar=()):
+    """Registra uma seção: fn(cur, payload) -> dados (Linhas, dict...).
+
+    tabelas: de que tabelas o resultado depende; escopo: o resultado depende
+    do usuário; preparar: ensure_*_schema a executar antes do snapshot.
+    """
+    def decorator(fn):
+        _secoes[nome] = (fn, tuple(tabelas), escopo, tuple(preparar))
+        return fn
+    return decorator
+
+
+def nomes():
+    return list(_secoes)
+
+
+def tokens(bruto):
+    """"secao:etag,secao:etag" -> {secao: etag}"""
+    out = {}
+    for parte in (bruto or "").split(","):
+        nome, _, etag = parte.strip().partition(":")
+        if nome and etag:
+            out[nome.strip()] = etag.strip().strip('"')
+    return out
+
+
+def _escopo(payload):
+    return {k: v for k, v in payload.items() if k not in ("exp", "iat", "nbf")}
+
+
+def _etag(nome, tabelas, versoes, escopo):
+    partes = [nome]
+    for t in tabelas:
+        if t not in versoes:
+            return None
+        partes.append(f"{t}:{versoes[t]}")
+    if escopo is not None:
+        partes.append(json.dumps(escopo, sort_keys=True, default=str))
+    return hashlib.sha1("|".join(partes).encode("utf-8")).hexdigest()
+
+
+def montar(conn, payload, pedidas=None, etags=None):
+    """{"sections": {nome: {"etag", "data"} | {"etag", "not_modified": true}}}
+
+    payload: token verificado; pedidas: nomes das seções (None = todas);
+    etags: {nome: etag} que o cliente já tem.
+    """
+    pedidas = list(pedidas or _secoes)
+    etags = etags or {}
+    escopo = _escopo(payload)
+    vistos = set()
+    for nome in pedidas:
+        for fn in _secoes[nome][3]:
+            if fn not in vistos:
+                vistos.add(fn)
+                fn()
+    todas = sorted({t for nome in pedidas for t in _secoes[nome][1]})
+    if todas:
+        ensure_table_versions_schema(todas)
+    out = {}
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+            versoes = {}
+            if todas:
+                cur.execute(
+                    "SELECT table_name, version FROM public.table_versions_atuais WHERE table_name = ANY(%s)",
+                    [todas],
+                )
+                versoes = dict(cur.fetchall())
+            for nome in pedidas:
+                fn, tabelas, por_usuario, _ = _secoes[nome]
+                etag = _etag(nome, tabelas, versoes, escopo if por_usuario else None)
+                if etag is not None and etags.get(nome) == etag:
+                    metrics.inc("bootstrap_sections_total", 1, {"secao": nome, "result": "not_modified"})
+                    out[nome] = {"etag": etag, "not_modified": True}
+                    continue
+                metrics.inc("bootstrap_sections_total", 1, {"secao": nome, "result": "full"})
+                out[nome] = {"etag": etag, "data": fn(cur, payload)}
+    return {"sections": out}
@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import datetime
+from functools import lru_cache
+from psycopg2.extras import execute_values
+import metrics
+
+# Upsert em massa usado pelas importações e sincronizações.
+# Até COPY_MIN_LINHAS linhas: INSERT ... VALUES multi-linha em lotes limitados
+# por PARAMS_POR_LOTE (linhas x colunas), com o SQL e o template montados uma
+# vez por tabela/colunas. Acima disso: COPY para uma tabela temporária e um
+# único INSERT ... SELECT ... ON CONFLICT. Linhas com a mesma chave de conflito
+# são reduzidas à última antes de gravar (o ON CONFLICT não aceita a mesma
+# linha duas vezes no mesmo comando).
+
+PARAMS_POR_LOTE = int(os.environ.get("AGROPLAN_BULK_PARAMS", "20000"))
+MAX_LINHAS_LOTE = 5000
+COPY_MIN_LINHAS = int(os.environ.get("AGROPLAN_BULK_COPY_MIN", "5000"))
+_STG = "_bulk_stg"
+
+
+def copy_campo(v):
+    # Valor no formato texto do COPY
+    if v is None:
+        return "\\N"
+    if isinstance(v, bool):
+        return "t" if v else "f"
+    if isinstance(v, (datetime.date, datetime.datetime)):
+        v = v.isoformat()
+    elif isinstance(v, (dict, list)):
+        v = json.dumps(v, default=str)
+    elif not isinstance(v, str):
+        v = str(v)
+    return v.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+class CopyStream:
+    # Arquivo somente-leitura sobre um gerador de linhas no formato texto do COPY
+    def __init__(self, gen):
+        self._gen = gen
+        self._buf = bytearray()
+
+    def read(self, size=-1):
+        while self._gen is not None and (size is None or size < 0 or len(self._buf) < size):
+            try:
+                self._buf += next(self._gen)
+            except StopIteration:
+                self._gen = None
+        if size is None or size < 0 or size >= len(self._buf):
+            out = bytes(self._buf)
+            self._buf.clear()
+        else:
+            out = bytes(self._buf[:size])
+            del self._buf[:size]
+        return out
+
+
+def cursor_sessao(session):
+    # Cursor DB-API na mesma conexão/transação de uma sessão SQLAlchemy
+    return session.connection().connection.cursor()
+
+
+@lru_cache(maxsize=128)
+def _conflito_sql(colunas, conflito, atualizar, carimbo):
+    if not conflito:
+        return ""
+    sets = [f"{c} = EXCLUDED.{c}" for c in atualizar]
+    if not sets:
+        return f" ON CONFLICT ({', '.join(conflito)}) DO NOTHING"
+    if carimbo:
+        sets.append(f"{carimbo} = now()")
+    return f" ON CONFLICT ({', '.join(conflito)}) DO UPDATE SET {', '.join(sets)}"
+
+
+@lru_cache(maxsize=128)
+def _sql_values(tabela, colunas, conflito, atualizar, carimbo):
+    sql = f"INSERT INTO public.{tabela} ({', '.join(colunas)}) VALUES %s" + _conflito_sql(colunas, conflito, atualizar, carimbo)
+    template = "(" + ", ".join(["%s"] * len(colunas)) + ")"
+    return sql, template
+
+
+@lru_cache(maxsize=128)
+def _sql_copy(tabela, colunas, conflito, atualizar, carimbo):
+    cols = ", ".join(colunas)
+    return (
+        f"CREATE TEMP TABLE {_STG} ON COMMIT DROP AS SELECT {cols} FROM public.{tabela} WITH NO DATA",
+        f"COPY {_STG} ({cols}) FROM STDIN",
+        f"INSERT INTO public.{tabela} ({cols}) SELECT {cols} FROM {_STG}" + _conflito_sql(colunas, conflito, atualizar, carimbo),
+    )
+
+
+def _deduplicar(linhas, colunas, conflito):
+    idx = [colunas.index(c) for c in conflito]
+    ultimas = {}
+    for row in linhas:
+        ultimas[tuple(row[i] for i in idx)] = row
+    return list(ultimas.values()) if len(ultimas) < len(linhas) else linhas
+
+
+def _gerar_copy(linhas):
+    for row in linhas:
+        yield ("\t".join(copy_campo(v) for v in row) + "\n").encode("utf-8")
+
+
+def upsert(cur, tabela, colunas, linhas, conflito=None, atualizar=None, carimbo="updated_at", metodo=None):
+    """Grava `linhas` (sequências na ordem de `colunas`, ou dicts) em public.`tabela`.
+
+    conflito: colunas do ON CONFLICT (None = INSERT simples); atualizar: colunas
+    copiadas de EXCLUDED (padrão: as que não são chave; [] = DO NOTHING);
+    carimbo: coluna marcada com now() na atualização. metodo força "values" ou
+    "copy". Retorna linhas, método, lotes, duração e linhas/s.
+    """
+    colunas = tuple(colunas)
+    conflito = tuple(conflito or ())
+    atualizar = tuple(c for c in colunas if c not in conflito) if atualizar is None else tuple(atualizar)
+    linhas = [tuple(r.get(c) for c in colunas) if isinstance(r, dict) else tuple(r) for r in linhas]
+    if conflito:
+        linhas = _deduplicar(linhas, colunas, conflito)
+    t0 = time.perf_counter()
+    metodo = metodo or ("copy" if len(linhas) >= COPY_MIN_LINHAS else "values")
+    gravadas = 0
+    lotes = 0
+    if linhas and metodo == "copy":
+        criar, copiar, inserir = _sql_copy(tabela, colunas, conflito, atualizar, carimbo)
+        cur.execute(f"DROP TABLE IF EXISTS pg_temp.{_STG}")
+        cur.execute(criar)
+        cur.copy_expert(copiar, CopyStream(_gerar_copy(linhas)))
+        cur.execute(inserir)
+        gravadas = cur.rowcount
+        cur.execute(f"DROP TABLE {_STG}")
+        lotes = 1
+    elif linhas:
+        sql, template = _sql_values(tabela, colunas, conflito, atualizar, carimbo)
+        tam = max(1, min(MAX_LINHAS_LOTE, PARAMS_POR_LOTE // max(1, len(colunas))))
+        for i in range(0, len(linhas), tam):
+            lote = linhas[i:i + tam]
+            execute_values(cur, sql, lote, template=template, page_size=len(lote))
+            gravadas += max(cur.rowcount, 0)
+            lotes += 1
+    dur = time.perf_counter() - t0
+    rotulo = {"tabela": tabela.split("__")[0], "metodo": metodo}
+    metrics.inc("bulk_rows_total", len(linhas), rotulo)
+    metrics.observe("bulk_upsert_seconds", dur, rotulo, (0.01, 0.05, 0.1, 0.5, 1, 5, 30))
+    return {
+        "linhas": len(linhas),
+        "gravadas": gravadas,
+        "metodo": metodo,
+        "lotes": lotes,
+        "duracao_ms": round(dur * 1000, 1),
+        "linhas_por_seg": round(len(linhas) / dur, 1) if dur > 0 and linhas else None,
+    }
@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import select
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+from flask import request, make_response
+import metrics
+import serializacao
+from db import connect_dedicated, ensure_table_versions_schema, TABLE_CHANGES_CHANNEL
+
+# Cache das listagens por escopo (fazendas, produtores, talhões...).
+# Chave: (rota, hash do escopo do usuário, parâmetros, formato); o valor é o
+# corpo já serializado, num LRU limitado em bytes por worker. A invalidação é
+# compartilhada: o trigger de statement de table_versions faz pg_notify com o
+# nome da tabela e cada worker mantém uma thread em LISTEN que remove as
+# entradas que dependem dela. Sem a conexão de LISTEN o cache fica desligado
+# (não há como saber o que mudou); ao reconectar ele é esvaziado.
+#
+# Uma resposta só é guardada se nenhuma das suas tabelas foi invalidada entre
+# o início da consulta e o fim do handler (geração por tabela), para não
+# gravar um resultado lido antes de um commit cuja notificação já chegou.
+
+HABILITADO = os.environ.get("AGROPLAN_LIST_CACHE", "1") not in ("0", "false")
+MAX_BYTES = int(float(os.environ.get("AGROPLAN_LIST_CACHE_MB", "64")) * 1024 * 1024)
+MAX_ENTRADA = MAX_BYTES // 8
+
+_lock = threading.Lock()
+_entradas = OrderedDict()  # chave -> (corpo, mimetype, tabelas)
+_por_tabela = {}  # tabela -> set(chaves)
+_geracoes = {}
+_epoca = 0
+_bytes = 0
+_conn = None
+_pid = None
+
+
+def _remover(chave):
+    global _bytes
+    corpo, _, tabelas = _entradas.pop(chave)
+    _bytes -= len(corpo)
+    for t in tabelas:
+        chaves = _por_tabela.get(t)
+        if chaves is not None:
+            chaves.discard(chave)
+
+
+def invalidar(tabela):
+    with _lock:
+        _geracoes[tabela] = _geracoes.get(tabela, 0) + 1
+        chaves = _por_tabela.pop(tabela, None) or ()
+        for chave in list(chaves):
+            if chave in _entradas:
+                _remover(chave)
+    if chaves:
+        metrics.inc("list_cache_invalidations_total", len(chaves), {"tabela": tabela})
+
+
+def limpar():
+    global _epoca, _bytes
+    with _lock:
+        _epoca += 1
+        _entradas.clear()
+        _por_tabela.clear()
+        _bytes = 0
+
+
+def _geracao(tabelas):
+    return (_epoca,) + tuple(_geracoes.get(t, 0) for t in tabelas)
+
+
+def _guardar(chave, tabelas, geracao, corpo, mimetype):
+    global _bytes
+    if len(corpo) > MAX_ENTRADA:
+        return
+    with _lock:
+        if _geracao(tabelas) != geracao:
+            return
+        if chave in _entradas:
+            _remover(chave)
+        _entradas[chave] = (corpo, mimetype, tabelas)
+        _bytes += len(corpo)
+        for t in tabelas:
+            _por_tabela.setdefault(t, set()).add(chave)
+        while _bytes > MAX_BYTES and _entradas:
+            _remover(next(iter(_entradas)))
+            metrics.inc("list_cache_evictions_total")
+
+
+def _obter(chave):
+    with _lock:
+        item = _entradas.get(chave)
+        if item is not None:
+            _entradas.move_to_end(chave)
+        return item
+
+
+def _drenar():
+    # Processa notificações pendentes (thread de LISTEN e antes de cada leitura)
+    conn = _conn
+    if conn is None:
+        return
+    with _lock:
+        conn.poll()
+        tabelas = {n.payload for n in conn.notifies}
+        conn.notifies.clear()
+    for t in tabelas:
+        invalidar(t)
+
+
+def _ouvir():
+    global _conn
+    while True:
+        try:
+            conn = connect_dedicated()
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {TABLE_CHANGES_CHANNEL}")
+            limpar()  # o que mudou enquanto estava desconectado não foi notificado
+            _conn = conn
+            while True:
+                if select.select([conn], [], [], 30) != ([], [], []):
+                    _drenar()
+        except Exception as e:
+            _conn = None
+            limpar()
+            print(f"[cache] LISTEN indisponível: {e}")
+            time.sleep(5)
+
+
+def _iniciar():
+    # Uma thread por processo (após o fork do gunicorn)
+    global _pid, _conn
+    if _pid == os.getpid():
+        return
+    with _lock:
+        if _pid == os.getpid():
+            return
+        _pid = os.getpid()
+        _conn = None
+        threading.Thread(target=_ouvir, name="list-cache-listen", daemon=True).start()
+
+
+def _chave(escopo):
+    dados = json.dumps(escopo, sort_keys=True, default=str) if escopo is not None else ""
+    return (
+        request.path,
+        hashlib.sha1(dados.encode("utf-8")).hexdigest(),
+        tuple(sorted(request.args.items(multi=True))),
+        serializacao.formato() or "",
+        serializacao.MIME_COLUNAR in (request.headers.get("Accept") or ""),
+    )
+
+
+def por_escopo(tabelas, escopo):
+    """Decorator de listagem GET cujo resultado depende de `tabelas` e do escopo
+    do usuário (`escopo()` devolve algo serializável, ex. o payload do JWT)."""
+    tabelas = tuple(tabelas)
+
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not HABILITADO or request.method != "GET":
+                return fn(*args, **kwargs)
+            _iniciar()
+            if _conn is None:
+                return fn(*args, **kwargs)
+            rota = {"route": request.url_rule.rule}
+            try:
+                ensure_table_versions_schema(tabelas)
+                _drenar()
+            except Exception:
+                return fn(*args, **kwargs)
+            chave = _chave(escopo())
+            item = _obter(chave)
+            if item is not None:
+                metrics.inc("list_cache_requests_total", 1, {**rota, "result": "hit"})
+                resp = make_response(item[0])
+                resp.mimetype = item[1]
+                resp.vary.add("Accept")
+                resp.headers["X-Cache"] = "HIT"
+                return resp
+            metrics.inc("list_cache_requests_total", 1, {**rota, "result": "miss"})
+            with _lock:
+                geracao = _geracao(tabelas)
+            resp = make_response(fn(*args, **kwargs))
+            if resp.status_code == 200 and not resp.is_streamed:
+                _guardar(chave, tabelas, geracao, resp.get_data(), resp.mimetype)
+            resp.headers["X-Cache"] = "MISS"
+            return resp
+        return wrapper
+    return decorator
+
+
+def estatisticas():
+    with _lock:
+        return {"entradas": len(_entradas), "bytes": _bytes, "max_bytes": MAX_BYTES, "conectado": _conn is not None}
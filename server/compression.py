@@ -0,0 +1,158 @@
+import os
+import time
+import zlib
+import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Compressão de respostas na camada WSGI (o nginx não comprime application/json).
+# A decisão usa só os headers: com Content-Length abaixo do limite a resposta
+# passa direto; sem Content-Length (gerador) o corpo é comprimido em streaming,
+# com flush a cada FLUSH_BYTES de entrada para não segurar dados do cliente.
+
+MIN_BYTES = int(os.environ.get("AGROPLAN_COMPRESS_MIN_BYTES", "1024"))
+LEVEL = int(os.environ.get("AGROPLAN_COMPRESS_LEVEL", "6"))
+COMPRESSIBLE = ("application/json", "text/", "application/javascript", "application/xml", "image/svg+xml")
+SKIP_TYPES = ("text/event-stream",)
+FLUSH_BYTES = 64 * 1024
+
+
+def _choose_encoding(accept):
+    prefs = {}
+    for part in (accept or "").split(","):
+        bits = [b.strip() for b in part.split(";")]
+        token = bits[0].lower()
+        if not token:
+            continue
+        q = 1.0
+        for b in bits[1:]:
+            if b.startswith("q="):
+                try:
+                    q = float(b[2:])
+                except ValueError:
+                    q = 0.0
+        prefs[token] = q
+    order = (["br"] if brotli is not None else []) + ["gzip", "deflate"]
+    best = None
+    for enc in order:
+        q = prefs.get(enc, prefs.get("*", 0.0))
+        if q > 0 and (best is None or q > best[1]):
+            best = (enc, q)
+    return best[0] if best else None
+
+
+class _Compressor:
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == "br":
+            self._c = brotli.Compressor(quality=min(LEVEL, 11))
+        elif encoding == "gzip":
+            self._c = zlib.compressobj(LEVEL, zlib.DEFLATED, 31)
+        else:
+            self._c = zlib.compressobj(LEVEL, zlib.DEFLATED, 15)
+        self._pending = 0
+
+    def compress(self, data):
+        self._pending += len(data)
+        if self.encoding == "br":
+            out = self._c.process(data)
+            if self._pending >= FLUSH_BYTES:
+                out += self._c.flush()
+                self._pending = 0
+            return out
+        out = self._c.compress(data)
+        if self._pending >= FLUSH_BYTES:
+            out += self._c.flush(zlib.Z_SYNC_FLUSH)
+            self._pending = 0
+        return out
+
+    def finish(self):
+        if self.encoding == "br":
+            return self._c.finish()
+        return self._c.flush(zlib.Z_FINISH)
+
+
+class CompressionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        encoding = _choose_encoding(environ.get("HTTP_ACCEPT_ENCODING"))
+        if not encoding or environ.get("REQUEST_METHOD") == "HEAD":
+            return self.app(environ, start_response)
+        state = {"compressor": None}
+
+        def _start_response(status, headers, exc_info=None):
+            code = int(status.split(" ", 1)[0])
+            hmap = {k.lower(): v for k, v in headers}
+            ctype = (hmap.get("content-type") or "").lower()
+            length = hmap.get("content-length")
+            compress = (
+                200 <= code < 300 and code != 204
+                and "content-encoding" not in hmap
+                and ctype.startswith(COMPRESSIBLE)
+                and not ctype.startswith(SKIP_TYPES)
+                and (length is None or int(length) >= MIN_BYTES)
+            )
+            if not compress:
+                if ctype.startswith(COMPRESSIBLE):
+                    metrics.inc("http_compression_skipped_total")
+                return start_response(status, headers, exc_info)
+            state["compressor"] = _Compressor(encoding)
+            new_headers = []
+            for k, v in headers:
+                lk = k.lower()
+                if lk == "content-length":
+                    continue
+                if lk == "etag" and v.startswith('"'):
+                    # Representação comprimida: ETag fraco (If-None-Match compara de forma fraca)
+                    v = "W/" + v
+                if lk == "vary":
+                    continue
+                new_headers.append((k, v))
+            vary = hmap.get("vary")
+            new_headers.append(("Vary", (vary + ", Accept-Encoding") if vary else "Accept-Encoding"))
+            new_headers.append(("Content-Encoding", encoding))
+            write = start_response(status, new_headers, exc_info)
+
+            def _write(data):
+                write(state["compressor"].compress(data))
+            return _write
+
+        body = self.app(environ, _start_response)
+        if state["compressor"] is None:
+            return body
+        return self._stream(body, state["compressor"])
+
+    def _stream(self, body, compressor):
+        bytes_in = 0
+        bytes_out = 0
+        spent = 0.0
+        try:
+            for chunk in body:
+                if not chunk:
+                    continue
+                t0 = time.perf_counter()
+                out = compressor.compress(chunk)
+                spent += time.perf_counter() - t0
+                bytes_in += len(chunk)
+                bytes_out += len(out)
+                if out:
+                    yield out
+            t0 = time.perf_counter()
+            tail = compressor.finish()
+            spent += time.perf_counter() - t0
+            bytes_out += len(tail)
+            if tail:
+                yield tail
+        finally:
+            if hasattr(body, "close"):
+                body.close()
+            labels = {"encoding": compressor.encoding}
+            metrics.inc("http_compression_responses_total", 1, labels)
+            metrics.inc("http_compression_bytes_in_total", bytes_in, labels)
+            metrics.inc("http_compression_bytes_out_total", bytes_out, labels)
+            metrics.inc("http_compression_seconds_total", spent, labels)
@@ -1,26 +1,101 @@
 import os
-from psycopg2.pool import SimpleConnectionPool
+import time
+import threading
+from contextlib import contextmanager
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 import psycopg2
+from psycopg2 import extensions as _ext
+import metrics
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from instrumentation import TimedCursor, instrument_engine
 
 _pool = None
 _sa_engine = None
 _SessionLocal = None
 _ensured = set()
 Base = declarative_base()
+TABLE_CHANGES_CHANNEL = "agroplan_tabelas"
+
+_compartilhada = threading.local()
+
+class InstrumentedPool(ThreadedConnectionPool):
+    # Threaded: threads de tarefas (jobs), batimentos e requisições dividem o pool
+    # Mede o tempo de getconn (abrir conexão nova conta aqui) e conta esgotamentos do pool.
+    # Dentro de conexao_compartilhada() a mesma conexão é reaproveitada pelos
+    # getconn/putconn sequenciais da thread; um getconn com ela já em uso
+    # (chamada aninhada) recebe outra conexão do pool normalmente.
+    def getconn(self, key=None):
+        estado = getattr(_compartilhada, "estado", None)
+        if estado is not None and key is None and not estado["em_uso"]:
+            if estado["conn"] is None:
+                estado["conn"] = self._getconn_medido()
+            else:
+                metrics.inc("db_pool_shared_reuses_total")
+            estado["em_uso"] = True
+            return estado["conn"]
+        return self._getconn_medido(key)
+
+    def putconn(self, conn, key=None, close=False):
+        estado = getattr(_compartilhada, "estado", None)
+        if estado is not None and conn is estado["conn"]:
+            # Devolvida ao fim de conexao_compartilhada(); aqui só volta ao estado ocioso
+            estado["em_uso"] = False
+            status = _ext.TRANSACTION_STATUS_UNKNOWN if conn.closed else conn.info.transaction_status
+            if status == _ext.TRANSACTION_STATUS_UNKNOWN:
+                # Conexão perdida: descarta e a próxima vem do pool
+                estado["conn"] = None
+                super().putconn(conn, key, close=True)
+            elif status != _ext.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            return
+        super().putconn(conn, key, close)
+
+    def _getconn_medido(self, key=None):
+        t0 = time.perf_counter()
+        try:
+            conn = super().getconn(key)
+        except PoolError:
+            metrics.inc("db_pool_exhausted_total")
+            raise
+        metrics.observe("db_pool_getconn_seconds", time.perf_counter() - t0, None, (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0))
+        metrics.inc("db_pool_checkouts_total")
+        return conn
+
+def _conn_params():
+    return {
+        "dbname": os.environ.get("AGROPLAN_DB_NAME", "agroplan_assist"),
+        "user": os.environ.get("AGROPLAN_DB_USER", "agroplan_user"),
+        "password": os.environ.get("AGROPLAN_DB_PASS", "agroplan_pass"),
+        "host": os.environ.get("AGROPLAN_DB_HOST", "localhost"),
+        "port": int(os.environ.get("AGROPLAN_DB_PORT", "5432")),
+    }
 
 def get_pool():
     global _pool
     if _pool is None:
-        dbname = os.environ.get("AGROPLAN_DB_NAME", "agroplan_assist")
-        user = os.environ.get("AGROPLAN_DB_USER", "agroplan_user")
-        password = os.environ.get("AGROPLAN_DB_PASS", "agroplan_pass")
-        host = os.environ.get("AGROPLAN_DB_HOST", "localhost")
-        port = int(os.environ.get("AGROPLAN_DB_PORT", "5432"))
-        _pool = SimpleConnectionPool(1, 10, dbname=dbname, user=user, password=password, host=host, port=port)
+        maxconn = int(os.environ.get("AGROPLAN_DB_POOL_MAX", "10"))
+        _pool = InstrumentedPool(1, maxconn, cursor_factory=TimedCursor, **_conn_params())
     return _pool
 
+@contextmanager
+def conexao_compartilhada():
+    """Reaproveita uma única conexão do pool em todos os getconn da thread
+    dentro do bloco (ex. sub-requisições de /batch, executadas em sequência)."""
+    anterior = getattr(_compartilhada, "estado", None)
+    estado = {"conn": None, "em_uso": False}
+    _compartilhada.estado = estado
+    try:
+        yield
+    finally:
+        _compartilhada.estado = anterior
+        if estado["conn"] is not None:
+            get_pool().putconn(estado["conn"], close=estado["em_uso"])
+
+def connect_dedicated():
+    # Conexão fora do pool, para uso prolongado (LISTEN)
+    return psycopg2.connect(**_conn_params())
+
 def get_database_url() -> str:
     dbname = os.environ.get("AGROPLAN_DB_NAME", "agroplan_assist")
     user = os.environ.get("AGROPLAN_DB_USER", "agroplan_user")
@@ -33,7 +108,7 @@ def get_sa_engine():
     global _sa_engine, _SessionLocal
     if _sa_engine is None:
         url = get_database_url()
-        _sa_engine = create_engine(url, pool_pre_ping=True, future=True)
+        _sa_engine = instrument_engine(create_engine(url, pool_pre_ping=True, future=True))
         _SessionLocal = sessionmaker(bind=_sa_engine, autoflush=False, autocommit=False, expire_on_commit=False, future=True)
     return _sa_engine
 
@@ -493,6 +568,369 @@ def ensure_import_history_schema():
                     );
                     """
                 )
+                cur.execute("SELECT column_name FROM information_schema.columns WHERE table_schema = 'public' AND table_name = 'import_history'")
+                cols = {r[0] for r in cur.fetchall()}
+                if "registros_rejeitados" not in cols:
+                    cur.execute("ALTER TABLE public.import_history ADD COLUMN registros_rejeitados INT NOT NULL DEFAULT 0")
+                if "duracao_ms" not in cols:
+                    cur.execute("ALTER TABLE public.import_history ADD COLUMN duracao_ms INT")
+                if "job_id" not in cols:
+                    cur.execute("ALTER TABLE public.import_history ADD COLUMN job_id TEXT")
+                # Linhas recusadas na importação de planilhas (validação, duplicidade, referência)
+                cur.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS public.import_rejeicoes (
+                      id BIGSERIAL PRIMARY KEY,
+                      import_id TEXT NOT NULL REFERENCES public.import_history(id) ON DELETE CASCADE,
+                      linha INT NOT NULL,
+                      motivo TEXT NOT NULL,
+                      dados JSONB
+                    );
+                    """
+                )
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_import_rejeicoes_import ON public.import_rejeicoes (import_id, linha)")
+    finally:
+        pool.putconn(conn)
+
+def ensure_jobs_schema():
+    if 'jobs' in _ensured:
+        return
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                # Fila de tarefas em segundo plano (importações e sincronizações)
+                cur.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS public.jobs (
+                      id TEXT PRIMARY KEY,
+                      tipo TEXT NOT NULL,
+                      status TEXT NOT NULL DEFAULT 'pendente',
+                      fase TEXT,
+                      payload JSONB,
+                      arquivo_path TEXT,
+                      processados BIGINT NOT NULL DEFAULT 0,
+                      total BIGINT,
+                      resultado JSONB,
+                      erro TEXT,
+                      tentativas INT NOT NULL DEFAULT 0,
+                      worker TEXT,
+                      user_id TEXT,
+                      criado_em TIMESTAMPTZ DEFAULT now(),
+                      iniciado_em TIMESTAMPTZ,
+                      heartbeat_em TIMESTAMPTZ,
+                      concluido_em TIMESTAMPTZ
+                    );
+                    """
+                )
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_jobs_fila ON public.jobs (criado_em) WHERE status IN ('pendente', 'executando')")
+                _ensured.add('jobs')
+    finally:
+        pool.putconn(conn)
+
+# Tabelas de origem da demanda de insumos: (tabela, origem, coluna com o id da origem)
+DEMANDA_GATILHOS = [
+    ("programacoes", "programacao", "id"),
+    ("programacao_cultivares", "programacao", "programacao_id"),
+    ("programacao_adubacao", "programacao", "programacao_id"),
+    ("programacao_talhoes", "programacao", "programacao_id"),
+    ("programacao_cultivares_defensivos", "cultivar", "programacao_cultivar_id"),
+    ("aplicacoes_defensivos", "aplicacao", "id"),
+    ("programacao_defensivos", "aplicacao", "aplicacao_id"),
+]
+
+def ensure_demanda_schema():
+    if 'demanda' in _ensured:
+        return
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                # Demanda de insumos pré-calculada por programação/aplicação; triggers de linha
+                # marcam em demanda_pendentes o que mudou para o recálculo incremental.
+                # A marcação sobre uma pendência já existente é um UPDATE (não DO NOTHING):
+                # a linha fica travada até o commit de quem alterou e atualizar() a pula,
+                # em vez de consumi-la antes de a alteração ficar visível
+                cur.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS public.demanda_insumos (
+                      origem TEXT NOT NULL,
+                      origem_id TEXT NOT NULL,
+                      insumo TEXT NOT NULL,
+                      tipo TEXT,
+                      safra_id TEXT,
+                      epoca_id TEXT,
+                      cultura TEXT,
+                      cod_item TEXT,
+                      item TEXT,
+                      unidade TEXT,
+                      cod_unidade_fabril TEXT,
+                      numerocm_consultor TEXT,
+                      embalagem TEXT,
+                      tamanho_embalagem NUMERIC,
+                      propria BOOLEAN NOT NULL DEFAULT false,
+                      area_ha NUMERIC,
+                      quantidade NUMERIC
+                    );
+                    CREATE INDEX IF NOT EXISTS idx_demanda_insumos_origem ON public.demanda_insumos (origem, origem_id);
+                    CREATE INDEX IF NOT EXISTS idx_demanda_insumos_safra ON public.demanda_insumos (safra_id, insumo);
+
+                    CREATE TABLE IF NOT EXISTS public.demanda_pendentes (
+                      origem TEXT NOT NULL,
+                      origem_id TEXT NOT NULL,
+                      PRIMARY KEY (origem, origem_id)
+                    );
+
+                    CREATE TABLE IF NOT EXISTS public.demanda_estado (
+                      id INT PRIMARY KEY DEFAULT 1,
+                      talhoes_version BIGINT,
+                      atualizado_em TIMESTAMPTZ
+                    );
+
+                    CREATE OR REPLACE FUNCTION public.demanda_marcar() RETURNS trigger AS $$
+                    DECLARE
+                      novo TEXT;
+                      antigo TEXT;
+                    BEGIN
+                      IF TG_OP <> 'DELETE' THEN
+                        novo := to_jsonb(NEW) ->> TG_ARGV[1];
+                      END IF;
+                      IF TG_OP <> 'INSERT' THEN
+                        antigo := to_jsonb(OLD) ->> TG_ARGV[1];
+                      END IF;
+                      IF novo IS NOT NULL THEN
+                        INSERT INTO public.demanda_pendentes (origem, origem_id) VALUES (TG_ARGV[0], novo)
+                          ON CONFLICT (origem, origem_id) DO UPDATE SET origem_id = EXCLUDED.origem_id;
+                      END IF;
+                      IF antigo IS NOT NULL AND antigo IS DISTINCT FROM novo THEN
+                        INSERT INTO public.demanda_pendentes (origem, origem_id) VALUES (TG_ARGV[0], antigo)
+                          ON CONFLICT (origem, origem_id) DO UPDATE SET origem_id = EXCLUDED.origem_id;
+                      END IF;
+                      RETURN NULL;
+                    END;
+                    $$ LANGUAGE plpgsql;
+                    """
+                )
+                for tabela, origem, coluna in DEMANDA_GATILHOS:
+                    cur.execute("SELECT to_regclass(%s)", [f"public.{tabela}"])
+                    if cur.fetchone()[0] is None:
+                        continue
+                    cur.execute(
+                        "SELECT 1 FROM pg_trigger WHERE tgname = %s AND tgrelid = %s::regclass",
+                        [f"{tabela}_demanda", f"public.{tabela}"],
+                    )
+                    if not cur.fetchone():
+                        cur.execute(
+                            f"CREATE TRIGGER {tabela}_demanda AFTER INSERT OR UPDATE OR DELETE ON public.{tabela} "
+                            f"FOR EACH ROW EXECUTE FUNCTION public.demanda_marcar('{origem}', '{coluna}')"
+                        )
+                _ensured.add('demanda')
+    finally:
+        pool.putconn(conn)
+
+TABLE_VERSIONS_COMPACTAR_SEG = 60
+_table_versions_compactado = 0.0
+
+def ensure_table_versions_schema(tables):
+    # Contador de alterações por tabela, incrementado por trigger de statement.
+    # Usado para versionar respostas de catálogos (ETag) sem consultar os dados.
+    # O mesmo trigger publica o nome da tabela no canal TABLE_CHANGES_CHANNEL
+    # (entregue no commit) para invalidar os caches dos workers.
+    # O trigger só insere em table_version_deltas (sem conflito entre
+    # transações): atualizar uma linha por tabela seguraria o lock dela até o
+    # commit e enfileiraria todas as gravações concorrentes da tabela. A versão
+    # é a base em table_versions mais a contagem de deltas já confirmados (view
+    # table_versions_atuais); compactar_table_versions() consolida os deltas.
+    pending = [t for t in tables if f"table_versions:{t}" not in _ensured]
+    if not pending:
+        return
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS public.table_versions (
+                      table_name TEXT PRIMARY KEY,
+                      version BIGINT NOT NULL DEFAULT 0,
+                      updated_at TIMESTAMPTZ DEFAULT now()
+                    );
+                    """
+                )
+                cur.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS public.table_version_deltas (
+                      table_name TEXT NOT NULL,
+                      criado_em TIMESTAMPTZ NOT NULL DEFAULT now()
+                    );
+                    CREATE INDEX IF NOT EXISTS idx_table_version_deltas_table ON public.table_version_deltas (table_name);
+                    """
+                )
+                cur.execute(
+                    """
+                    CREATE OR REPLACE VIEW public.table_versions_atuais AS
+                    SELECT v.table_name,
+                           v.version + COALESCE(d.n, 0) AS version,
+                           GREATEST(v.updated_at, d.ultimo) AS updated_at
+                    FROM public.table_versions v
+                    LEFT JOIN (
+                      SELECT table_name, COUNT(*) AS n, MAX(criado_em) AS ultimo
+                      FROM public.table_version_deltas
+                      GROUP BY table_name
+                    ) d ON d.table_name = v.table_name;
+                    """
+                )
+                cur.execute(
+                    """
+                    CREATE OR REPLACE FUNCTION public.bump_table_version() RETURNS trigger AS $$
+                    BEGIN
+                      INSERT INTO public.table_version_deltas (table_name) VALUES (TG_TABLE_NAME);
+                      PERFORM pg_notify('agroplan_tabelas', TG_TABLE_NAME);
+                      RETURN NULL;
+                    END;
+                    $$ LANGUAGE plpgsql;
+                    """
+                )
+                for t in pending:
+                    cur.execute("SELECT to_regclass(%s)", [f"public.{t}"])
+                    if cur.fetchone()[0] is None:
+                        continue
+                    cur.execute(
+                        "SELECT 1 FROM pg_trigger WHERE tgname = %s AND tgrelid = %s::regclass",
+                        [f"{t}_bump_version", f"public.{t}"],
+                    )
+                    if not cur.fetchone():
+                        cur.execute(
+                            f"CREATE TRIGGER {t}_bump_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON public.{t} "
+                            "FOR EACH STATEMENT EXECUTE FUNCTION public.bump_table_version()"
+                        )
+                    cur.execute(
+                        "INSERT INTO public.table_versions (table_name) VALUES (%s) ON CONFLICT (table_name) DO NOTHING",
+                        [t],
+                    )
+                    _ensured.add(f"table_versions:{t}")
+    finally:
+        pool.putconn(conn)
+
+def compactar_table_versions(cur):
+    # Soma os deltas confirmados à base e os apaga, na mesma transação (a
+    # versão vista pelos leitores não muda). Os writers não tocam em
+    # table_versions, então só compactações concorrentes disputam as linhas.
+    global _table_versions_compactado
+    if time.time() - _table_versions_compactado < TABLE_VERSIONS_COMPACTAR_SEG:
+        return
+    _table_versions_compactado = time.time()
+    cur.execute("SELECT pg_try_advisory_xact_lock(hashtext('table_versions'))")
+    if not cur.fetchone()[0]:
+        return
+    cur.execute(
+        """
+        WITH d AS (
+          DELETE FROM public.table_version_deltas RETURNING table_name, criado_em
+        )
+        INSERT INTO public.table_versions (table_name, version, updated_at)
+        SELECT table_name, COUNT(*), MAX(criado_em) FROM d GROUP BY table_name
+        ON CONFLICT (table_name) DO UPDATE SET
+          version = public.table_versions.version + EXCLUDED.version,
+          updated_at = GREATEST(public.table_versions.updated_at, EXCLUDED.updated_at)
+        """
+    )
+
+def get_table_versions(tables):
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                compactar_table_versions(cur)
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT table_name, version, updated_at FROM public.table_versions_atuais WHERE table_name = ANY(%s)",
+                    (list(tables),),
+                )
+                return {r[0]: (r[1], r[2]) for r in cur.fetchall()}
+    finally:
+        pool.putconn(conn)
+
+def ensure_sync_schema(tables):
+    # Suporte à sincronização incremental (sync.py): updated_at carimbado pelo
+    # banco em todo INSERT/UPDATE e exclusões registradas em sync_tombstones
+    # com a chave primária da linha (jsonb).
+    pending = [t for t in tables if f"sync:{t}" not in _ensured]
+    if not pending:
+        return
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS public.sync_tombstones (
+                      seq BIGSERIAL PRIMARY KEY,
+                      tabela TEXT NOT NULL,
+                      chave JSONB NOT NULL,
+                      deleted_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                    );
+                    CREATE INDEX IF NOT EXISTS sync_tombstones_tabela_idx ON public.sync_tombstones(tabela, deleted_at);
+                    CREATE INDEX IF NOT EXISTS sync_tombstones_deleted_at_idx ON public.sync_tombstones(deleted_at);
+                    """
+                )
+                cur.execute(
+                    """
+                    CREATE OR REPLACE FUNCTION public.sync_touch() RETURNS trigger AS $$
+                    BEGIN
+                      NEW.updated_at := now();
+                      RETURN NEW;
+                    END;
+                    $$ LANGUAGE plpgsql;
+                    """
+                )
+                cur.execute(
+                    """
+                    CREATE OR REPLACE FUNCTION public.sync_tombstone() RETURNS trigger AS $$
+                    BEGIN
+                      INSERT INTO public.sync_tombstones (tabela, chave)
+                      SELECT TG_TABLE_NAME, jsonb_object_agg(k, to_jsonb(OLD) -> k) FROM unnest(TG_ARGV) AS k;
+                      RETURN NULL;
+                    END;
+                    $$ LANGUAGE plpgsql;
+                    """
+                )
+                for t in pending:
+                    cur.execute("SELECT to_regclass(%s)", [f"public.{t}"])
+                    if cur.fetchone()[0] is None:
+                        continue
+                    cur.execute(
+                        """
+                        SELECT a.attname FROM pg_index i
+                        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+                        WHERE i.indrelid = %s::regclass AND i.indisprimary
+                        ORDER BY array_position(i.indkey::int2[], a.attnum)
+                        """,
+                        [f"public.{t}"],
+                    )
+                    pk = [r[0] for r in cur.fetchall()]
+                    cur.execute(f"ALTER TABLE public.{t} ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ DEFAULT now()")
+                    cur.execute("SELECT tgname FROM pg_trigger WHERE tgrelid = %s::regclass", [f"public.{t}"])
+                    existentes = {r[0] for r in cur.fetchall()}
+                    if f"{t}_sync_touch" not in existentes:
+                        cur.execute(
+                            f"CREATE TRIGGER {t}_sync_touch BEFORE INSERT OR UPDATE ON public.{t} "
+                            "FOR EACH ROW EXECUTE FUNCTION public.sync_touch()"
+                        )
+                    if pk and f"{t}_sync_tombstone" not in existentes:
+                        args = ", ".join(f"'{c}'" for c in pk)
+                        cur.execute(
+                            f"CREATE TRIGGER {t}_sync_tombstone AFTER DELETE ON public.{t} "
+                            f"FOR EACH ROW EXECUTE FUNCTION public.sync_tombstone({args})"
+                        )
+                    cur.execute(f"CREATE INDEX IF NOT EXISTS {t}_updated_at_idx ON public.{t}(updated_at)")
+                    _ensured.add(f"sync:{t}")
     finally:
         pool.putconn(conn)
 
@@ -583,6 +1021,16 @@ def ensure_talhoes_schema():
                     cur.execute("ALTER TABLE public.talhoes ADD COLUMN bbox_max_lat NUMERIC")
                 if "bbox_max_lng" not in cols:
                     cur.execute("ALTER TABLE public.talhoes ADD COLUMN bbox_max_lng NUMERIC")
+                if "area_poligono" not in cols:
+                    cur.execute("ALTER TABLE public.talhoes ADD COLUMN area_poligono NUMERIC")
+                if "perimetro_poligono" not in cols:
+                    cur.execute("ALTER TABLE public.talhoes ADD COLUMN perimetro_poligono NUMERIC")
+                if "area_divergencia_pct" not in cols:
+                    cur.execute("ALTER TABLE public.talhoes ADD COLUMN area_divergencia_pct NUMERIC")
+                if "area_divergente" not in cols:
+                    cur.execute("ALTER TABLE public.talhoes ADD COLUMN area_divergente BOOLEAN")
+                if "geometria_calculada_em" not in cols:
+                    cur.execute("ALTER TABLE public.talhoes ADD COLUMN geometria_calculada_em TIMESTAMPTZ")
                 cur.execute(
                     """
                     CREATE TABLE IF NOT EXISTS public.talhao_safras (
@@ -594,6 +1042,22 @@ def ensure_talhoes_schema():
                     );
                     """
                 )
+                # Pares de talhões com polígonos sobrepostos (talhao_a_id < talhao_b_id)
+                cur.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS public.talhao_sobreposicoes (
+                      talhao_a_id TEXT NOT NULL REFERENCES public.talhoes(id) ON DELETE CASCADE,
+                      talhao_b_id TEXT NOT NULL REFERENCES public.talhoes(id) ON DELETE CASCADE,
+                      area_intersecao NUMERIC NOT NULL,
+                      pct_a NUMERIC,
+                      pct_b NUMERIC,
+                      duplicado BOOLEAN NOT NULL DEFAULT false,
+                      detectado_em TIMESTAMPTZ DEFAULT now(),
+                      PRIMARY KEY (talhao_a_id, talhao_b_id)
+                    );
+                    """
+                )
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_talhao_sobreposicoes_b ON public.talhao_sobreposicoes (talhao_b_id)")
     finally:
         pool.putconn(conn)
 
@@ -983,6 +1447,7 @@ if __name__ == "__main__":
     ensure_programacao_schema()
     ensure_consultores_schema()
     ensure_import_history_schema()
+    ensure_jobs_schema()
     ensure_calendario_aplicacoes_schema()
     ensure_epocas_schema()
     ensure_justificativas_adubacao_schema()
@@ -996,4 +1461,5 @@ if __name__ == "__main__":
     ensure_app_versions_schema()
     ensure_embalagens_schema()
     ensure_access_logs_schema()
+    ensure_demanda_schema()
     print("Verificação de schemas concluída com sucesso.")
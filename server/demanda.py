@@ -0,0 +1,233 @@
+import math
+import re
+import time
+import metrics
+
+# Demanda de insumos (sementes, fertilizantes, defensivos) para compras.
+# O cálculo é SQL set-based e fica materializado em public.demanda_insumos, uma
+# linha por item de programação/aplicação. Triggers de linha marcam em
+# public.demanda_pendentes as programações/aplicações alteradas; atualizar()
+# recalcula só essas. Mudança em talhões (área) invalida tudo, detectada pela
+# versão da tabela em table_versions. A leitura agrega a tabela materializada.
+#
+# Regras (as mesmas das telas e de /reports/consolidated):
+#   área da programação = soma das áreas dos talhões (ou area_hectares)
+#   sementes  tipo_lancamento 2: kg/ha x área coberta
+#             senão: plantas/m2 x 10.000 x área coberta (sementes); embalagem = sementes_por_saca
+#   adubação  dose x área x cobertura (sem justificativa de não adubação)
+#   defensivo dose x area_hectares x cobertura (porcentagem_salva, 1..100)
+#             tratamento na fazenda: total gravado no item
+
+GRUPO = ["insumo", "safra_id", "epoca_id", "cultura", "cod_item", "item", "unidade", "cod_unidade_fabril",
+         "numerocm_consultor", "embalagem", "tamanho_embalagem", "propria"]
+FILTROS = ["insumo", "tipo", "safra_id", "epoca_id", "cultura", "cod_item", "cod_unidade_fabril", "numerocm_consultor"]
+
+_COLS = ("origem, origem_id, insumo, tipo, safra_id, epoca_id, cultura, cod_item, item, unidade, cod_unidade_fabril, "
+         "numerocm_consultor, embalagem, tamanho_embalagem, propria, area_ha, quantidade")
+
+_SQL_PROGRAMACOES = f"""
+WITH prog AS (
+  SELECT p.id, p.safra_id, p.tipo, p.cod_unidade_fabril, ta.epoca_id,
+         COALESCE(NULLIF(ta.area, 0), p.area_hectares, 0) AS area
+  FROM public.programacoes p
+  LEFT JOIN LATERAL (
+    SELECT SUM(t.area) AS area, MIN(pt.epoca_id) AS epoca_id
+    FROM public.programacao_talhoes pt
+    LEFT JOIN public.talhoes t ON t.id = pt.talhao_id
+    WHERE pt.programacao_id = p.id
+  ) ta ON TRUE
+  WHERE %(todos)s OR p.id = ANY(%(programacoes)s)
+)
+INSERT INTO public.demanda_insumos ({_COLS})
+SELECT 'programacao', pr.id, 'semente', pr.tipo, pr.safra_id, COALESCE(pc.epoca_id, pr.epoca_id),
+       COALESCE(pc.cultura, cc.cultura), NULL, pc.cultivar,
+       CASE WHEN pc.tipo_lancamento = 2 THEN 'kg' ELSE 'sementes' END,
+       COALESCE(pc.cod_unidade_fabril, pr.cod_unidade_fabril), pc.numerocm_consultor, pc.tipo_embalagem,
+       CASE WHEN pc.tipo_lancamento = 2 THEN NULL ELSE NULLIF(pc.sementes_por_saca, 0) END,
+       COALESCE(pc.semente_propria, FALSE),
+       pr.area * COALESCE(pc.percentual_cobertura, 100) / 100.0,
+       CASE WHEN pc.tipo_lancamento = 2 THEN COALESCE(pc.quant_densidade, 0)
+            ELSE COALESCE(NULLIF(pc.quant_densidade, 0), pc.populacao_recomendada, 0) * 10000 END
+         * pr.area * COALESCE(pc.percentual_cobertura, 100) / 100.0
+FROM prog pr
+JOIN public.programacao_cultivares pc ON pc.programacao_id = pr.id
+LEFT JOIN LATERAL (
+  SELECT c.cultura FROM public.cultivares_catalog c WHERE c.cultivar = pc.cultivar LIMIT 1
+) cc ON pc.cultura IS NULL
+UNION ALL
+SELECT 'programacao', pr.id, 'defensivo', pr.tipo, pr.safra_id, COALESCE(pc.epoca_id, pr.epoca_id),
+       COALESCE(pc.cultura, cc.cultura), pcd.cod_item, pcd.defensivo, NULL,
+       COALESCE(pc.cod_unidade_fabril, pr.cod_unidade_fabril), pc.numerocm_consultor, NULL, NULL, FALSE,
+       pr.area * COALESCE(pc.percentual_cobertura, 100) / 100.0, COALESCE(pcd.total, 0)
+FROM prog pr
+JOIN public.programacao_cultivares pc ON pc.programacao_id = pr.id
+JOIN public.programacao_cultivares_defensivos pcd ON pcd.programacao_cultivar_id = pc.id
+LEFT JOIN LATERAL (
+  SELECT c.cultura FROM public.cultivares_catalog c WHERE c.cultivar = pc.cultivar LIMIT 1
+) cc ON pc.cultura IS NULL
+UNION ALL
+SELECT 'programacao', pr.id, 'fertilizante', pr.tipo, pr.safra_id, pr.epoca_id,
+       (SELECT MIN(pc2.cultura) FROM public.programacao_cultivares pc2 WHERE pc2.programacao_id = pr.id),
+       pa.cod_item, pa.formulacao, 'kg', pr.cod_unidade_fabril, pa.numerocm_consultor, pa.embalagem, NULL, FALSE,
+       pr.area * COALESCE(pa.percentual_cobertura, 100) / 100.0,
+       COALESCE(pa.dose, 0) * pr.area * COALESCE(pa.percentual_cobertura, 100) / 100.0
+FROM prog pr
+JOIN public.programacao_adubacao pa ON pa.programacao_id = pr.id
+WHERE pa.justificativa_nao_adubacao_id IS NULL
+"""
+
+_SQL_APLICACOES = f"""
+INSERT INTO public.demanda_insumos ({_COLS})
+SELECT 'aplicacao', ad.id, 'defensivo', ad.tipo, COALESCE(pd.safra_id, ad.safra_id), ad.epoca_id, ad.cultura,
+       pd.cod_item, pd.defensivo, NULLIF(lower(split_part(pd.unidade, '/', 1)), ''), NULL, pd.numerocm_consultor,
+       NULL, NULL, FALSE,
+       COALESCE(pd.area_hectares, 0) * LEAST(GREATEST(COALESCE(pd.porcentagem_salva, 100), 1), 100) / 100.0,
+       COALESCE(pd.dose, 0) * COALESCE(pd.area_hectares, 0) * LEAST(GREATEST(COALESCE(pd.porcentagem_salva, 100), 1), 100) / 100.0
+FROM public.aplicacoes_defensivos ad
+JOIN public.programacao_defensivos pd ON pd.aplicacao_id = ad.id
+WHERE %(todos)s OR ad.id = ANY(%(aplicacoes)s)
+"""
+
+
+def atualizar(conn, completo=False):
+    """Processa as pendências (ou recalcula tudo); retorna um resumo."""
+    from db import ensure_demanda_schema, ensure_table_versions_schema
+    ensure_demanda_schema()
+    ensure_table_versions_schema(["talhoes"])
+    t0 = time.perf_counter()
+    with conn:
+        with conn.cursor() as cur:
+            # Um recálculo por vez; quem chega depois espera e encontra a fila vazia
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext('demanda_insumos'))")
+            cur.execute("SELECT talhoes_version FROM public.demanda_estado WHERE id = 1")
+            estado = cur.fetchone()
+            cur.execute("SELECT version FROM public.table_versions_atuais WHERE table_name = 'talhoes'")
+            r = cur.fetchone()
+            versao_talhoes = r[0] if r else None
+            completo = completo or estado is None or estado[0] != versao_talhoes
+
+            # Reivindica as pendências já confirmadas; as travadas por uma transação em
+            # andamento (remarcadas por ela) e o que chegar depois ficam para a próxima vez
+            cur.execute(
+                """
+                DELETE FROM public.demanda_pendentes
+                WHERE (origem, origem_id) IN (
+                  SELECT origem, origem_id FROM public.demanda_pendentes FOR UPDATE SKIP LOCKED
+                )
+                RETURNING origem, origem_id
+                """
+            )
+            pendentes = cur.fetchall()
+            programacoes = sorted({i for o, i in pendentes if o == "programacao"})
+            aplicacoes = sorted({i for o, i in pendentes if o == "aplicacao"})
+            cultivares = [i for o, i in pendentes if o == "cultivar"]
+            if cultivares and not completo:
+                cur.execute("SELECT DISTINCT programacao_id FROM public.programacao_cultivares WHERE id = ANY(%s)", [cultivares])
+                programacoes = sorted(set(programacoes) | {r[0] for r in cur.fetchall() if r[0]})
+
+            if completo:
+                cur.execute("TRUNCATE public.demanda_insumos")
+            elif programacoes or aplicacoes:
+                cur.execute(
+                    """
+                    DELETE FROM public.demanda_insumos
+                    WHERE (origem = 'programacao' AND origem_id = ANY(%s)) OR (origem = 'aplicacao' AND origem_id = ANY(%s))
+                    """,
+                    [programacoes, aplicacoes],
+                )
+            linhas = 0
+            params = {"todos": completo, "programacoes": programacoes, "aplicacoes": aplicacoes}
+            if completo or programacoes:
+                cur.execute(_SQL_PROGRAMACOES, params)
+                linhas += cur.rowcount
+            if completo or aplicacoes:
+                cur.execute(_SQL_APLICACOES, params)
+                linhas += cur.rowcount
+            if completo:
+                cur.execute("ANALYZE public.demanda_insumos")
+            cur.execute(
+                """
+                INSERT INTO public.demanda_estado (id, talhoes_version, atualizado_em) VALUES (1, %s, now())
+                ON CONFLICT (id) DO UPDATE SET talhoes_version = EXCLUDED.talhoes_version, atualizado_em = EXCLUDED.atualizado_em
+                RETURNING atualizado_em
+                """,
+                [versao_talhoes],
+            )
+            atualizado_em = cur.fetchone()[0]
+    dur = time.perf_counter() - t0
+    modo = "completo" if completo else "incremental"
+    metrics.observe("demanda_refresh_seconds", dur, {"modo": modo}, (0.01, 0.05, 0.1, 0.5, 1, 5, 30))
+    return {
+        "modo": modo,
+        "programacoes": None if completo else len(programacoes),
+        "aplicacoes": None if completo else len(aplicacoes),
+        "linhas": linhas,
+        "duracao_ms": round(dur * 1000, 1),
+        "atualizado_em": atualizado_em.isoformat() if atualizado_em else None,
+    }
+
+
+# Unidade base e fator: quantidades e tamanhos de embalagem são comparados em kg ou L
+_UNIDADES = {"kg": ("kg", 1), "g": ("kg", 0.001), "t": ("kg", 1000), "ton": ("kg", 1000),
+             "l": ("l", 1), "lt": ("l", 1), "litro": ("l", 1), "litros": ("l", 1), "ml": ("l", 0.001)}
+_RE_EMBALAGEM = re.compile(r"(\d+(?:[.,]\d+)?)\s*(kg|g|ton|t|litros|litro|lt|l|ml)\b", re.I)
+
+
+def _base(unidade):
+    return _UNIDADES.get((unidade or "").strip().lower())
+
+
+def embalagens(quantidade, unidade, embalagem, tamanho):
+    """Número de embalagens (arredondado para cima) ou None quando o tamanho é desconhecido.
+
+    `tamanho` vem do próprio item (sementes por saca); sem ele, o tamanho é lido
+    do nome da embalagem ("BIG BAG 1000 KG", "Galão 20 L").
+    """
+    if not quantidade or quantidade <= 0:
+        return 0 if quantidade == 0 else None
+    if tamanho:
+        return math.ceil(quantidade / float(tamanho))
+    m = _RE_EMBALAGEM.search(embalagem or "")
+    base_q = _base(unidade)
+    if not m or not base_q:
+        return None
+    base_e = _base(m.group(2))
+    tam = float(m.group(1).replace(",", ".")) * base_e[1]
+    if base_e[0] != base_q[0] or tam <= 0:
+        return None
+    return math.ceil(quantidade * base_q[1] / tam)
+
+
+def consultar(cur, filtros, grupo=None):
+    """Agrega demanda_insumos pelos campos de `grupo` (padrão: GRUPO) com os filtros informados."""
+    grupo = [g for g in (grupo or GRUPO) if g in GRUPO] or GRUPO
+    where, params = [], []
+    for k in FILTROS:
+        v = filtros.get(k)
+        if v:
+            where.append(f"{k} = %s")
+            params.append(v)
+    cols = ", ".join(grupo)
+    cur.execute(
+        f"""
+        SELECT {cols}, SUM(area_ha), SUM(quantidade), COUNT(DISTINCT origem_id)
+        FROM public.demanda_insumos
+        {"WHERE " + " AND ".join(where) if where else ""}
+        GROUP BY {cols}
+        ORDER BY {cols}
+        """,
+        params,
+    )
+    items = []
+    for row in cur.fetchall():
+        d = dict(zip(grupo, row))
+        area, qtd, n = row[len(grupo):]
+        d["area_ha"] = round(float(area or 0), 4)
+        d["quantidade"] = round(float(qtd or 0), 4)
+        d["origens"] = n
+        if "unidade" in d and "embalagem" in d:
+            d["embalagens"] = embalagens(d["quantidade"], d["unidade"], d["embalagem"], d.get("tamanho_embalagem"))
+        if d.get("tamanho_embalagem") is not None:
+            d["tamanho_embalagem"] = float(d["tamanho_embalagem"])
+        items.append(d)
+    return items
@@ -0,0 +1,186 @@
+import uuid
+
+# Duplicação de programação inteiramente no Postgres.
+# Cada tabela filha é copiada com um INSERT ... SELECT; as colunas vêm do
+# information_schema, então colunas novas são copiadas sem mexer aqui. Os ids
+# novos são md5(id_nova_programacao || id_origem)::uuid, o que permite ligar
+# tratamentos/defensivos às cultivares copiadas sem tabela de mapeamento.
+
+_TIMESTAMPS = ("created_at", "updated_at")
+
+
+class ConflitoTalhoes(ValueError):
+    def __init__(self, talhoes, talhoes_nomes):
+        super().__init__("talhao já possui programação nesta safra e época")
+        self.talhoes = talhoes
+        self.talhoes_nomes = talhoes_nomes
+
+
+def novos_ids(n):
+    # uuid4 como as filhas: faixas de epoch em ms colidiam com POST /programacoes
+    # e com outras duplicações/lotes concorrentes
+    return [str(uuid.uuid4()) for _ in range(n)]
+
+
+def _colunas(cur, tabela):
+    cur.execute(
+        "SELECT column_name FROM information_schema.columns WHERE table_schema = 'public' AND table_name = %s ORDER BY ordinal_position",
+        [tabela],
+    )
+    return [r[0] for r in cur.fetchall() if r[0] not in _TIMESTAMPS]
+
+
+def _copiar(cur, tabela, alias, origem_sql, sobrepor, params):
+    # sobrepor: coluna -> expressão SQL (com placeholders nomeados de params)
+    cols = _colunas(cur, tabela)
+    exprs = [sobrepor.get(c, f"{alias}.{c}") for c in cols]
+    cur.execute(
+        f"INSERT INTO public.{tabela} ({', '.join(cols)}) SELECT {', '.join(exprs)} {origem_sql}",
+        params,
+    )
+    return cur.rowcount
+
+
+def carregar_origem(cur, origem_id):
+    cur.execute(
+        """
+        SELECT p.produtor_numerocm, p.fazenda_idfazenda, p.area, p.area_hectares, p.safra_id,
+               (SELECT pt.epoca_id FROM public.programacao_talhoes pt WHERE pt.programacao_id = p.id LIMIT 1),
+               ARRAY(SELECT pt.talhao_id FROM public.programacao_talhoes pt WHERE pt.programacao_id = p.id AND pt.talhao_id IS NOT NULL)
+        FROM public.programacoes p WHERE p.id = %s
+        """,
+        [origem_id],
+    )
+    row = cur.fetchone()
+    if not row:
+        return None
+    return dict(zip(["produtor_numerocm", "fazenda_idfazenda", "area", "area_hectares", "safra_id", "epoca_id", "talhao_ids"], row))
+
+
+def _resolver_fazenda(cur, destino, origem):
+    if destino.get("fazenda_id"):
+        cur.execute("SELECT numerocm, idfazenda, nomefazenda, numerocm_consultor, id FROM public.fazendas WHERE id = %s", [destino["fazenda_id"]])
+    else:
+        cur.execute(
+            "SELECT numerocm, idfazenda, nomefazenda, numerocm_consultor, id FROM public.fazendas WHERE idfazenda = %s AND numerocm = %s",
+            [destino.get("fazenda_idfazenda") or origem["fazenda_idfazenda"], destino.get("produtor_numerocm") or origem["produtor_numerocm"]],
+        )
+    row = cur.fetchone()
+    if row:
+        return row
+    if destino.get("fazenda_id") or destino.get("fazenda_idfazenda") or destino.get("produtor_numerocm"):
+        raise ValueError("fazenda de destino não encontrada")
+    # Origem com fazenda que não está mais no cadastro: mantém os valores da programação
+    return (origem["produtor_numerocm"], origem["fazenda_idfazenda"], None, None, None)
+
+
+def duplicar(cur, origem, origem_id, destino, novo_id, user_id=None, cm_token=None):
+    """Copia a programação `origem_id` (carregada por carregar_origem) como `novo_id`.
+
+    destino pode sobrepor safra_id, epoca_id, fazenda (fazenda_id ou
+    fazenda_idfazenda + produtor_numerocm), talhao_ids, area e area_hectares.
+    """
+    numerocm, idfazenda, nomefazenda, cm_fazenda, fazenda_uuid = _resolver_fazenda(cur, destino, origem)
+    mesma_fazenda = (numerocm, idfazenda) == (origem["produtor_numerocm"], origem["fazenda_idfazenda"])
+    safra_id = destino["safra_id"] if "safra_id" in destino else origem["safra_id"]
+    epoca_id = destino["epoca_id"] if "epoca_id" in destino else origem["epoca_id"]
+
+    if destino.get("talhao_ids") is not None:
+        talhao_ids = list(dict.fromkeys(t for t in destino["talhao_ids"] if t))
+    else:
+        talhao_ids = list(origem["talhao_ids"] or []) if mesma_fazenda else []
+    area_hectares = destino.get("area_hectares")
+    if talhao_ids and fazenda_uuid:
+        cur.execute("SELECT id, area FROM public.talhoes WHERE id = ANY(%s) AND fazenda_id = %s", [talhao_ids, fazenda_uuid])
+        validos = dict(cur.fetchall())
+        invalidos = [t for t in talhao_ids if t not in validos]
+        if invalidos:
+            raise ValueError(f"talhões não pertencem à fazenda de destino: {', '.join(invalidos)}")
+        if area_hectares is None and destino.get("talhao_ids") is not None:
+            area_hectares = sum(float(a or 0) for a in validos.values())
+    if area_hectares is None:
+        area_hectares = origem["area_hectares"]
+    area = destino.get("area") or (origem["area"] if mesma_fazenda else (nomefazenda or origem["area"]))
+    cm_cons = None if mesma_fazenda else (cm_token or cm_fazenda)
+
+    if safra_id and talhao_ids:
+        cur.execute(
+            """
+            SELECT pt.talhao_id, t.nome
+            FROM public.programacoes p
+            JOIN public.programacao_talhoes pt ON pt.programacao_id = p.id
+            LEFT JOIN public.talhoes t ON t.id = pt.talhao_id
+            WHERE p.safra_id = %s AND p.fazenda_idfazenda = %s AND pt.talhao_id = ANY(%s)
+            AND pt.epoca_id IS NOT DISTINCT FROM %s
+            """,
+            [safra_id, idfazenda, talhao_ids, epoca_id],
+        )
+        rows_conf = cur.fetchall()
+        if rows_conf:
+            raise ConflitoTalhoes([r[0] for r in rows_conf], [r[1] for r in rows_conf if r[1] is not None])
+
+    # Datas de plantio/aplicação andam junto com a safra (ex.: 2024/2025 -> 2025/2026 soma 1 ano)
+    anos = 0
+    if safra_id != origem["safra_id"] and safra_id and origem["safra_id"]:
+        cur.execute(
+            "SELECT (SELECT ano_inicio FROM public.safras WHERE id = %s) - (SELECT ano_inicio FROM public.safras WHERE id = %s)",
+            [safra_id, origem["safra_id"]],
+        )
+        anos = (cur.fetchone() or [0])[0] or 0
+
+    p = {
+        "origem": origem_id, "novo": novo_id, "user_id": user_id, "numerocm": numerocm, "idfazenda": idfazenda,
+        "area": area, "area_hectares": area_hectares, "safra_id": safra_id, "epoca_id": epoca_id,
+        "cm": cm_cons, "anos": int(anos), "talhoes": talhao_ids,
+    }
+    _copiar(cur, "programacoes", "p", "FROM public.programacoes p WHERE p.id = %(origem)s", {
+        "id": "%(novo)s",
+        "user_id": "COALESCE(%(user_id)s, p.user_id)",
+        "produtor_numerocm": "%(numerocm)s",
+        "fazenda_idfazenda": "%(idfazenda)s",
+        "area": "%(area)s",
+        "area_hectares": "%(area_hectares)s",
+        "safra_id": "%(safra_id)s",
+        "revisada": "FALSE",
+    }, p)
+    cultivares = _copiar(cur, "programacao_cultivares", "pc", "FROM public.programacao_cultivares pc WHERE pc.programacao_id = %(origem)s", {
+        "id": "md5(%(novo)s || pc.id)::uuid::text",
+        "programacao_id": "%(novo)s",
+        "user_id": "COALESCE(%(user_id)s, pc.user_id)",
+        "produtor_numerocm": "%(numerocm)s",
+        "area": "%(area)s",
+        "area_hectares": "%(area_hectares)s",
+        "numerocm_consultor": "COALESCE(%(cm)s, pc.numerocm_consultor)",
+        "safra": "%(safra_id)s",
+        "epoca_id": "%(epoca_id)s",
+        "data_plantio": "pc.data_plantio + make_interval(years => %(anos)s)",
+    }, p)
+    if cultivares:
+        filhas = "JOIN public.programacao_cultivares pc ON pc.id = x.programacao_cultivar_id WHERE pc.programacao_id = %(origem)s"
+        for tabela in ("programacao_cultivares_tratamentos", "programacao_cultivares_defensivos"):
+            _copiar(cur, tabela, "x", f"FROM public.{tabela} x {filhas}", {
+                "id": "md5(%(novo)s || x.id)::uuid::text",
+                "programacao_cultivar_id": "md5(%(novo)s || x.programacao_cultivar_id)::uuid::text",
+            }, p)
+    adubacao = _copiar(cur, "programacao_adubacao", "pa", "FROM public.programacao_adubacao pa WHERE pa.programacao_id = %(origem)s", {
+        "id": "md5(%(novo)s || pa.id)::uuid::text",
+        "programacao_id": "%(novo)s",
+        "user_id": "COALESCE(%(user_id)s, pa.user_id)",
+        "produtor_numerocm": "%(numerocm)s",
+        "area": "%(area)s",
+        "numerocm_consultor": "COALESCE(%(cm)s, pa.numerocm_consultor)",
+        "safra_id": "%(safra_id)s",
+        "data_aplicacao": "pa.data_aplicacao + make_interval(years => %(anos)s)",
+    }, p)
+    talhoes = 0
+    if talhao_ids:
+        cur.execute(
+            """
+            INSERT INTO public.programacao_talhoes (id, programacao_id, talhao_id, safra_id, fazenda_idfazenda, epoca_id)
+            SELECT md5(%(novo)s || t)::uuid::text, %(novo)s, t, %(safra_id)s, %(idfazenda)s, %(epoca_id)s
+            FROM unnest(%(talhoes)s::text[]) AS t
+            """,
+            p,
+        )
+        talhoes = cur.rowcount
+    return {"id": novo_id, "cultivares": cultivares, "adubacao": adubacao, "talhoes": talhoes}
@@ -0,0 +1,402 @@
+import os
+import json
+import time
+import socket
+import selectors
+import threading
+from urllib.parse import urlsplit, parse_qs
+import metrics
+from db import connect_dedicated, TABLE_CHANGES_CHANNEL
+
+# Alterações em tempo real (Server-Sent Events) para as telas de programação.
+#
+# Os handlers de escrita chamam publicar(cur, tabela, op, ids) dentro da
+# transação: um pg_notify por linha no canal CANAL, entregue só no COMMIT,
+# com o mínimo para filtrar por escopo (produtor, fazenda, consultores).
+#
+# Cada worker do gunicorn roda uma thread com um loop de eventos próprio
+# (selectors) numa porta separada (AGROPLAN_SSE_PORT, SO_REUSEPORT entre os
+# workers): as conexões SSE ficam nesse loop e não ocupam o worker síncrono.
+# O loop mantém uma conexão dedicada em LISTEN e repassa a cada assinante os
+# eventos que o escopo do token permite (mesmas tabelas de vínculo das
+# listagens). Mudanças em user_produtores/user_fazendas/gestor_consultores
+# (canal de table_versions) recalculam os escopos.
+#
+# O evento só avisa o que mudou; o cliente busca os dados pelo endpoint de
+# listagem (ou /sync/changes). "ready" chega a cada (re)conexão e "reset"
+# quando o LISTEN caiu e eventos podem ter se perdido: nos dois casos o
+# cliente recarrega as listas abertas.
+
+CANAL = "agroplan_eventos"
+PORTA = int(os.environ.get("AGROPLAN_SSE_PORT", "5001"))
+HOST = os.environ.get("AGROPLAN_SSE_HOST", "127.0.0.1")
+ROTAS = ("/eventos", "/api/eventos")
+PING_SEG = 25
+RETRY_MS = 5000
+MAX_CABECALHO = 16 * 1024
+MAX_PENDENTE = 256 * 1024
+
+_TABELAS_ESCOPO = ("user_produtores", "user_fazendas", "gestor_consultores")
+
+# Escopo de cada linha publicada: id, produtor_numerocm, fazenda_id, consultores
+_SQL = {
+    "programacoes": """
+        SELECT p.id, p.produtor_numerocm, f.id AS fazenda_id,
+          ARRAY_REMOVE(ARRAY[f.numerocm_consultor]
+            || ARRAY(SELECT pc.numerocm_consultor FROM public.programacao_cultivares pc WHERE pc.programacao_id = p.id)
+            || ARRAY(SELECT pa.numerocm_consultor FROM public.programacao_adubacao pa WHERE pa.programacao_id = p.id), NULL) AS consultores
+        FROM public.programacoes p
+        LEFT JOIN public.fazendas f ON f.idfazenda = p.fazenda_idfazenda AND f.numerocm = p.produtor_numerocm
+        WHERE p.id = ANY(%s)
+    """,
+    "programacao_cultivares": """
+        SELECT pc.id, pc.produtor_numerocm, NULL::text AS fazenda_id, ARRAY_REMOVE(ARRAY[pc.numerocm_consultor], NULL) AS consultores
+        FROM public.programacao_cultivares pc
+        WHERE pc.id = ANY(%s)
+    """,
+    "talhoes": """
+        SELECT t.id, f.numerocm AS produtor_numerocm, t.fazenda_id, ARRAY_REMOVE(ARRAY[f.numerocm_consultor], NULL) AS consultores
+        FROM public.talhoes t
+        LEFT JOIN public.fazendas f ON f.id = t.fazenda_id
+        WHERE t.id = ANY(%s)
+    """,
+    "aplicacoes_defensivos": """
+        SELECT a.id, a.produtor_numerocm, NULL::text AS fazenda_id,
+          ARRAY(SELECT DISTINCT d.numerocm_consultor FROM public.programacao_defensivos d
+                WHERE d.aplicacao_id = a.id AND d.numerocm_consultor IS NOT NULL) AS consultores
+        FROM public.aplicacoes_defensivos a
+        WHERE a.id = ANY(%s)
+    """,
+}
+
+TABELAS = tuple(_SQL)
+
+_state = {"thread": None, "conectado": False}
+_assinantes = {}  # socket -> _Assinante (somente a thread do loop altera)
+
+
+def publicar(cur, tabela, op, ids):
+    """Notifica insert/update/delete de `ids` em `tabela` no COMMIT de `cur`.
+
+    Chamar depois do INSERT/UPDATE e antes do DELETE: o escopo do evento é
+    lido da própria linha.
+    """
+    ids = [i for i in ([ids] if isinstance(ids, str) else ids) if i]
+    if not ids:
+        return
+    cur.execute(
+        "SELECT pg_notify(%s, json_build_object('tabela', %s, 'op', %s, 'id', x.id, 'produtor_numerocm', x.produtor_numerocm,"
+        " 'fazenda_id', x.fazenda_id, 'consultores', x.consultores)::text) FROM (" + _SQL[tabela] + ") x",
+        [CANAL, tabela, op, ids],
+    )
+
+
+def recarregar(cur, tabela):
+    # Alteração em massa (importação): um único evento para todos os assinantes
+    cur.execute("SELECT pg_notify(%s, %s)", [CANAL, json.dumps({"tabela": tabela, "op": "reload"})])
+
+
+class _Assinante:
+    __slots__ = ("sock", "entrada", "saida", "payload", "escopo", "tabelas", "expira", "aberto", "fechar")
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.entrada = b""
+        self.saida = b""
+        self.payload = None
+        self.escopo = None
+        self.tabelas = None
+        self.expira = None
+        self.aberto = False  # cabeçalho SSE já enviado
+        self.fechar = False  # fechar depois de esvaziar a saída
+
+
+def _escopo(cur, payload):
+    # None = sem filtro (admin); senão (produtores, fazendas, consultores)
+    role = (payload.get("role") or "consultor").lower()
+    if role == "admin":
+        return None
+    uid = payload.get("user_id")
+    cm = payload.get("numerocm_consultor")
+    cur.execute("SELECT produtor_numerocm FROM public.user_produtores WHERE user_id = %s", [uid])
+    produtores = {r[0] for r in cur.fetchall()}
+    cur.execute("SELECT fazenda_id FROM public.user_fazendas WHERE user_id = %s", [uid])
+    fazendas = {r[0] for r in cur.fetchall()}
+    consultores = {cm} if cm else set()
+    if role == "gestor":
+        cur.execute("SELECT numerocm_consultor FROM public.gestor_consultores WHERE user_id = %s", [uid])
+        consultores.update(r[0] for r in cur.fetchall())
+    return produtores, fazendas, consultores
+
+
+def _permitido(ev, escopo):
+    if escopo is None or ev.get("op") == "reload":
+        return True
+    produtores, fazendas, consultores = escopo
+    return (
+        ev.get("produtor_numerocm") in produtores
+        or ev.get("fazenda_id") in fazendas
+        or any(c in consultores for c in ev.get("consultores") or ())
+    )
+
+
+def _fechar(sel, a):
+    _assinantes.pop(a.sock, None)
+    try:
+        sel.unregister(a.sock)
+    except (KeyError, ValueError):
+        pass
+    try:
+        a.sock.close()
+    except OSError:
+        pass
+
+
+def _escoar(sel, a):
+    try:
+        n = a.sock.send(a.saida)
+    except BlockingIOError:
+        n = 0
+    except OSError:
+        _fechar(sel, a)
+        return
+    a.saida = a.saida[n:]
+    if a.saida:
+        sel.modify(a.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, a)
+    elif a.fechar:
+        _fechar(sel, a)
+    else:
+        sel.modify(a.sock, selectors.EVENT_READ, a)
+
+
+def _enviar(sel, a, dados):
+    a.saida += dados
+    if len(a.saida) > MAX_PENDENTE:
+        # Cliente lento: desconecta (o EventSource reconecta e recebe "ready")
+        metrics.inc("sse_dropped_total", 1, {"motivo": "lento"})
+        _fechar(sel, a)
+        return
+    _escoar(sel, a)
+
+
+def _responder(sel, a, status, erro):
+    corpo = json.dumps({"error": erro}).encode("utf-8")
+    a.fechar = True
+    _enviar(sel, a, (
+        f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(corpo)}\r\n"
+        "Access-Control-Allow-Origin: *\r\nConnection: close\r\n\r\n"
+    ).encode("latin-1") + corpo)
+
+
+def _evento(nome, dados):
+    return f"event: {nome}\ndata: {dados}\n\n".encode("utf-8")
+
+
+def _abrir(sel, a, conn, verificar):
+    cabecalho = a.entrada.split(b"\r\n\r\n", 1)[0].decode("latin-1").split("\r\n")
+    partes = cabecalho[0].split(" ")
+    if len(partes) != 3 or partes[0] != "GET":
+        return _responder(sel, a, "405 Method Not Allowed", "método não suportado")
+    url = urlsplit(partes[1])
+    if url.path.rstrip("/") not in ROTAS:
+        return _responder(sel, a, "404 Not Found", "não encontrado")
+    headers = {}
+    for linha in cabecalho[1:]:
+        k, _, v = linha.partition(":")
+        headers[k.strip().lower()] = v.strip()
+    args = parse_qs(url.query)
+    # EventSource não envia Authorization: aceita também ?token=
+    auth = headers.get("authorization") or ""
+    token = auth.split(" ", 1)[1] if auth.lower().startswith("bearer ") else (args.get("token") or [""])[0]
+    if not token:
+        return _responder(sel, a, "401 Unauthorized", "sem token")
+    try:
+        a.payload = verificar(token)
+    except Exception as e:
+        return _responder(sel, a, "401 Unauthorized", str(e))
+    if conn is None:
+        return _responder(sel, a, "503 Service Unavailable", "eventos indisponíveis")
+    try:
+        with conn.cursor() as cur:
+            a.escopo = _escopo(cur, a.payload)
+    except Exception as e:
+        return _responder(sel, a, "503 Service Unavailable", str(e))
+    tabelas = {t.strip() for v in args.get("tabelas", []) for t in v.split(",") if t.strip()}
+    a.tabelas = tabelas or None
+    a.expira = a.payload.get("exp")
+    a.aberto = True
+    metrics.inc("sse_connections_total")
+    _enviar(sel, a, (
+        "HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+        "X-Accel-Buffering: no\r\nAccess-Control-Allow-Origin: *\r\nConnection: keep-alive\r\n\r\n"
+        f"retry: {RETRY_MS}\n\n"
+    ).encode("latin-1") + _evento("ready", "{}"))
+
+
+def _ler(sel, a, conn, verificar):
+    try:
+        dados = a.sock.recv(4096)
+    except BlockingIOError:
+        return
+    except OSError:
+        dados = b""
+    if not dados:
+        _fechar(sel, a)
+        return
+    if a.aberto or a.fechar:
+        return  # nada a ler depois do cabeçalho
+    a.entrada += dados
+    if b"\r\n\r\n" in a.entrada:
+        _abrir(sel, a, conn, verificar)
+    elif len(a.entrada) > MAX_CABECALHO:
+        _responder(sel, a, "431 Request Header Fields Too Large", "cabeçalho muito grande")
+
+
+def _aceitar(sel, srv):
+    while True:
+        try:
+            sock, _ = srv.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        sock.setblocking(False)
+        a = _Assinante(sock)
+        _assinantes[sock] = a
+        sel.register(sock, selectors.EVENT_READ, a)
+
+
+def _difundir(sel, dados, ev=None):
+    for a in list(_assinantes.values()):
+        if not a.aberto or a.fechar:
+            continue
+        if ev is not None:
+            if a.tabelas and ev.get("tabela") not in a.tabelas:
+                continue
+            if not _permitido(ev, a.escopo):
+                continue
+        _enviar(sel, a, dados)
+
+
+def _notificacoes(sel, conn):
+    conn.poll()
+    pendentes = list(conn.notifies)
+    conn.notifies.clear()
+    if any(n.channel == TABLE_CHANGES_CHANNEL and n.payload in _TABELAS_ESCOPO for n in pendentes):
+        with conn.cursor() as cur:
+            for a in list(_assinantes.values()):
+                if a.aberto:
+                    a.escopo = _escopo(cur, a.payload)
+    for n in pendentes:
+        if n.channel != CANAL:
+            continue
+        try:
+            ev = json.loads(n.payload)
+        except ValueError:
+            continue
+        metrics.inc("sse_events_total", 1, {"tabela": ev.get("tabela") or "-"})
+        _difundir(sel, _evento("change", n.payload), ev)
+
+
+def _conectar():
+    conn = connect_dedicated()
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f"LISTEN {CANAL}")
+        cur.execute(f"LISTEN {TABLE_CHANGES_CHANNEL}")
+    return conn
+
+
+def _ping(sel):
+    agora = time.time()
+    for a in list(_assinantes.values()):
+        if not a.aberto or a.fechar:
+            continue
+        if a.expira and int(a.expira) < agora:
+            a.fechar = True
+            _enviar(sel, a, _evento("expired", "{}"))
+        else:
+            _enviar(sel, a, b": ping\n\n")
+
+
+def _loop(srv, verificar):
+    sel = selectors.DefaultSelector()
+    sel.register(srv, selectors.EVENT_READ, None)
+    conn = None
+    reconectar = 0.0
+    proximo_ping = time.monotonic() + PING_SEG
+    while True:
+        if conn is None and time.monotonic() >= reconectar:
+            try:
+                conn = _conectar()
+                sel.register(conn, selectors.EVENT_READ, conn)
+                _state["conectado"] = True
+                # Eventos emitidos enquanto estava sem LISTEN se perderam
+                _difundir(sel, _evento("reset", "{}"))
+            except Exception as e:
+                conn = None
+                reconectar = time.monotonic() + 5
+                print(f"[eventos] LISTEN indisponível: {e}")
+        espera = 0 if conn is not None and conn.notifies else 1.0
+        for chave, mask in sel.select(timeout=espera):
+            if chave.data is None:
+                _aceitar(sel, srv)
+            elif chave.data is conn:
+                pass  # processado abaixo
+            elif chave.fileobj in _assinantes:
+                a = chave.data
+                if mask & selectors.EVENT_WRITE:
+                    _escoar(sel, a)
+                if mask & selectors.EVENT_READ and a.sock in _assinantes:
+                    _ler(sel, a, conn, verificar)
+        if conn is not None:
+            try:
+                _notificacoes(sel, conn)
+            except Exception as e:
+                print(f"[eventos] conexão de LISTEN perdida: {e}")
+                try:
+                    sel.unregister(conn)
+                    conn.close()
+                except Exception:
+                    pass
+                conn = None
+                _state["conectado"] = False
+                reconectar = time.monotonic() + 5
+        if time.monotonic() >= proximo_ping:
+            proximo_ping = time.monotonic() + PING_SEG
+            _ping(sel)
+
+
+def _servidor():
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, "SO_REUSEPORT"):
+        # Todos os workers escutam a mesma porta; o kernel distribui as conexões
+        srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    srv.bind((HOST, PORTA))
+    srv.listen(128)
+    srv.setblocking(False)
+    return srv
+
+
+def start(verificar):
+    """Sobe o loop de eventos deste processo. verificar(token) -> payload do JWT."""
+    if _state["thread"] or PORTA <= 0:
+        return
+    try:
+        srv = _servidor()
+    except OSError as e:
+        print(f"[eventos] porta {HOST}:{PORTA} indisponível: {e}")
+        return
+    t = threading.Thread(target=_loop, args=(srv, verificar), name="sse-eventos", daemon=True)
+    _state["thread"] = t
+    t.start()
+
+
+def estatisticas():
+    abertos = [a for a in list(_assinantes.values()) if a.aberto]
+    return {
+        "porta": PORTA,
+        "ativo": _state["thread"] is not None,
+        "conectado": _state["conectado"],
+        "assinantes": len(abertos),
+        "pendente_bytes": sum(len(a.saida) for a in abertos),
+    }
@@ -0,0 +1,283 @@
+import json
+import math
+import time
+import numpy as np
+from psycopg2.extras import execute_values
+from db import get_pool, get_config_map
+
+# Métricas de geometria dos talhões (área, centroide e perímetro).
+# A área é calculada na projeção cilíndrica equivalente de Lambert sobre o
+# elipsoide WGS84 (x = a*lon, y = a*q/2), que preserva áreas: o shoelace nessa
+# projeção dá a área no elipsoide. O centroide é ponderado por área nessa mesma
+# projeção e convertido de volta para lat/lng.
+
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_E2 = WGS84_F * (2 - WGS84_F)
+WGS84_E = math.sqrt(WGS84_E2)
+RAIO_MEDIO = 6371008.8
+TOLERANCIA_PADRAO_PCT = 5.0
+
+
+def _q(sin_lat):
+    # q(phi) da latitude autálica (Snyder, eq. 3-12)
+    e = WGS84_E
+    return (1 - WGS84_E2) * (
+        sin_lat / (1 - WGS84_E2 * sin_lat * sin_lat)
+        - (1 / (2 * e)) * np.log((1 - e * sin_lat) / (1 + e * sin_lat))
+    )
+
+
+_QP = float(_q(np.float64(1.0)))
+
+
+def project_equal_area(lon, lat):
+    lam = np.radians(lon)
+    phi = np.radians(lat)
+    return WGS84_A * lam, WGS84_A * _q(np.sin(phi)) / 2.0
+
+
+def _unproject(x, y):
+    e2 = WGS84_E2
+    e4 = e2 * e2
+    e6 = e4 * e2
+    beta = np.arcsin(np.clip((2.0 * y / WGS84_A) / _QP, -1.0, 1.0))
+    phi = (
+        beta
+        + (e2 / 3 + 31 * e4 / 180 + 517 * e6 / 5040) * np.sin(2 * beta)
+        + (23 * e4 / 360 + 251 * e6 / 3780) * np.sin(4 * beta)
+        + (761 * e6 / 45360) * np.sin(6 * beta)
+    )
+    return np.degrees(x / WGS84_A), np.degrees(phi)
+
+
+def polygons_from_geojson(geojson):
+    # Retorna lista de polígonos; cada polígono é uma lista de anéis [[lon, lat], ...]
+    # (o primeiro anel é o contorno externo, os demais são furos).
+    if isinstance(geojson, str):
+        try:
+            geojson = json.loads(geojson)
+        except Exception:
+            return []
+    if not isinstance(geojson, dict):
+        return []
+    t = geojson.get("type")
+    if t == "Feature":
+        return polygons_from_geojson(geojson.get("geometry"))
+    if t == "FeatureCollection":
+        out = []
+        for f in geojson.get("features") or []:
+            out.extend(polygons_from_geojson(f))
+        return out
+    if t == "GeometryCollection":
+        out = []
+        for g in geojson.get("geometries") or []:
+            out.extend(polygons_from_geojson(g))
+        return out
+    if t == "Polygon":
+        return [geojson.get("coordinates") or []]
+    if t == "MultiPolygon":
+        return list(geojson.get("coordinates") or [])
+    return []
+
+
+def compute_metrics_batch(polygon_sets):
+    """
+    Calcula área (ha), perímetro (m) e centroide para vários talhões de uma vez.
+    polygon_sets: lista (um item por talhão) de listas de polígonos no formato de
+    polygons_from_geojson. Todos os vértices são concatenados em arrays únicos e
+    as somas por anel/talhão são feitas com reduceat/bincount, sem laço por vértice.
+    Talhões sem polígono válido recebem NaN.
+    """
+    n = len(polygon_sets)
+    lons = []
+    lats = []
+    ring_sizes = []
+    ring_owner = []
+    ring_role = []
+    for idx, polys in enumerate(polygon_sets):
+        for poly in polys or []:
+            for ring_pos, ring in enumerate(poly or []):
+                pts = [p for p in (ring or []) if p is not None and len(p) >= 2]
+                if len(pts) > 1 and pts[0][0] == pts[-1][0] and pts[0][1] == pts[-1][1]:
+                    pts = pts[:-1]
+                if len(pts) < 3:
+                    continue
+                lons.extend(float(p[0]) for p in pts)
+                lats.extend(float(p[1]) for p in pts)
+                ring_sizes.append(len(pts))
+                ring_owner.append(idx)
+                ring_role.append(1.0 if ring_pos == 0 else -1.0)
+    nan = np.full(n, np.nan)
+    if not ring_sizes:
+        return {"area_ha": nan, "perimetro_m": nan.copy(), "centroid_lat": nan.copy(), "centroid_lng": nan.copy()}
+
+    lon = np.asarray(lons, dtype=np.float64)
+    lat = np.asarray(lats, dtype=np.float64)
+    sizes = np.asarray(ring_sizes, dtype=np.int64)
+    owner = np.asarray(ring_owner, dtype=np.int64)
+    role = np.asarray(ring_role, dtype=np.float64)
+    starts = np.zeros(len(sizes), dtype=np.int64)
+    np.cumsum(sizes[:-1], out=starts[1:])
+    ring_of_vertex = np.repeat(np.arange(len(sizes)), sizes)
+    nxt = np.arange(len(lon)) + 1
+    nxt[starts + sizes - 1] = starts
+
+    # Projeção equivalente, transladada para o 1º vértice do anel (precisão numérica)
+    x, y = project_equal_area(lon, lat)
+    x0 = x[starts]
+    y0 = y[starts]
+    xr = x - x0[ring_of_vertex]
+    yr = y - y0[ring_of_vertex]
+    cross = xr * yr[nxt] - xr[nxt] * yr
+    a_ring = np.add.reduceat(cross, starts) / 2.0
+    mx_ring = np.add.reduceat((xr + xr[nxt]) * cross, starts) / 6.0 + x0 * a_ring
+    my_ring = np.add.reduceat((yr + yr[nxt]) * cross, starts) / 6.0 + y0 * a_ring
+
+    # Normaliza orientação: contorno soma, furo subtrai
+    s = np.sign(a_ring) * role
+    area = np.bincount(owner, weights=a_ring * s, minlength=n)
+    mx = np.bincount(owner, weights=mx_ring * s, minlength=n)
+    my = np.bincount(owner, weights=my_ring * s, minlength=n)
+
+    # Perímetro geodésico (haversine) somando todos os anéis
+    phi1 = np.radians(lat)
+    phi2 = phi1[nxt]
+    dphi = phi2 - phi1
+    dlam = np.radians(lon[nxt] - lon)
+    h = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlam / 2) ** 2
+    edge = 2 * RAIO_MEDIO * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+    perim = np.bincount(owner[ring_of_vertex], weights=edge, minlength=n)
+
+    has_area = area > 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cx = np.where(has_area, mx / area, np.nan)
+        cy = np.where(has_area, my / area, np.nan)
+    c_lng, c_lat = _unproject(cx, cy)
+    has_ring = np.bincount(owner, minlength=n) > 0
+    return {
+        "area_ha": np.where(has_ring, area / 10000.0, np.nan),
+        "perimetro_m": np.where(has_ring, perim, np.nan),
+        "centroid_lat": np.where(has_area, c_lat, np.nan),
+        "centroid_lng": np.where(has_area, c_lng, np.nan),
+    }
+
+
+def polygon_metrics(geojson):
+    # Métricas de um único talhão; None quando não há polígono
+    res = compute_metrics_batch([polygons_from_geojson(geojson)])
+    area = float(res["area_ha"][0])
+    if math.isnan(area):
+        return None
+    clat = float(res["centroid_lat"][0])
+    clng = float(res["centroid_lng"][0])
+    return {
+        "area_ha": area,
+        "perimetro_m": float(res["perimetro_m"][0]),
+        "centroid_lat": None if math.isnan(clat) else clat,
+        "centroid_lng": None if math.isnan(clng) else clng,
+    }
+
+
+def get_tolerancia_pct():
+    try:
+        cfg = get_config_map(["talhoes_area_tolerancia_pct"])
+        val = float(str(cfg.get("talhoes_area_tolerancia_pct") or TOLERANCIA_PADRAO_PCT).replace(",", "."))
+        return val if val >= 0 else TOLERANCIA_PADRAO_PCT
+    except Exception:
+        return TOLERANCIA_PADRAO_PCT
+
+
+# Recalcula divergência entre área declarada (talhoes.area) e área do polígono.
+# Usado após upload de KML, no job em lote e quando a área declarada é editada.
+DIVERGENCIA_SET_SQL = """
+    area_divergencia_pct = CASE WHEN t.area > 0 AND t.area_poligono IS NOT NULL
+        THEN ROUND(ABS(t.area_poligono - t.area) / t.area * 100, 2) END,
+    area_divergente = CASE WHEN t.area_poligono IS NULL THEN NULL
+        WHEN t.area > 0 THEN ABS(t.area_poligono - t.area) / t.area * 100 > %s
+        ELSE t.area_poligono > 0 END
+"""
+
+
+def refresh_divergencia(cur, talhao_ids, tolerancia_pct):
+    cur.execute(
+        "UPDATE public.talhoes t SET " + DIVERGENCIA_SET_SQL + " WHERE t.id = ANY(%s)",
+        [tolerancia_pct, list(talhao_ids)],
+    )
+
+
+def store_metrics(cur, rows, tolerancia_pct):
+    # rows: [(id, area_ha, perimetro_m, centroid_lat, centroid_lng), ...]
+    if not rows:
+        return
+    execute_values(
+        cur,
+        """
+        UPDATE public.talhoes t SET
+          area_poligono = v.area_poligono,
+          perimetro_poligono = v.perimetro_poligono,
+          centroid_lat = COALESCE(v.centroid_lat, t.centroid_lat),
+          centroid_lng = COALESCE(v.centroid_lng, t.centroid_lng),
+          geometria_calculada_em = now()
+        FROM (VALUES %s) AS v(id, area_poligono, perimetro_poligono, centroid_lat, centroid_lng)
+        WHERE t.id = v.id
+        """,
+        rows,
+        template="(%s, %s::numeric, %s::numeric, %s::numeric, %s::numeric)",
+        page_size=5000,
+    )
+    refresh_divergencia(cur, [r[0] for r in rows], tolerancia_pct)
+
+
+def run_geometry_audit(tolerancia_pct=None):
+    # Job em lote: recalcula métricas de todos os talhões com geometria e
+    # marca os que divergem da área declarada além da tolerância.
+    if tolerancia_pct is None:
+        tolerancia_pct = get_tolerancia_pct()
+    started = time.time()
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT id, geojson FROM public.talhoes WHERE geojson IS NOT NULL")
+                fetched = cur.fetchall()
+                t_load = time.time()
+                ids = [r[0] for r in fetched]
+                res = compute_metrics_batch([polygons_from_geojson(r[1]) for r in fetched])
+                t_calc = time.time()
+                rows = []
+                for i, tid in enumerate(ids):
+                    area = res["area_ha"][i]
+                    if np.isnan(area):
+                        continue
+                    clat = res["centroid_lat"][i]
+                    clng = res["centroid_lng"][i]
+                    rows.append((
+                        tid,
+                        round(float(area), 4),
+                        round(float(res["perimetro_m"][i]), 2),
+                        None if np.isnan(clat) else float(clat),
+                        None if np.isnan(clng) else float(clng),
+                    ))
+                store_metrics(cur, rows, tolerancia_pct)
+                sem_poligono = [tid for i, tid in enumerate(ids) if np.isnan(res["area_ha"][i])]
+                if sem_poligono:
+                    cur.execute(
+                        "UPDATE public.talhoes SET area_poligono = NULL, perimetro_poligono = NULL, area_divergencia_pct = NULL, area_divergente = NULL, geometria_calculada_em = now() WHERE id = ANY(%s)",
+                        [sem_poligono],
+                    )
+                cur.execute("SELECT COUNT(*) FROM public.talhoes WHERE area_divergente")
+                divergentes = cur.fetchone()[0] or 0
+        return {
+            "ok": True,
+            "processed": len(rows),
+            "sem_poligono": len(sem_poligono),
+            "divergentes": divergentes,
+            "tolerancia_pct": tolerancia_pct,
+            "load_ms": int((t_load - started) * 1000),
+            "calc_ms": int((t_calc - t_load) * 1000),
+            "elapsed_ms": int((time.time() - started) * 1000),
+        }
+    finally:
+        pool.putconn(conn)
@@ -0,0 +1,64 @@
+import hashlib
+from functools import wraps
+from datetime import timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from flask import request, make_response
+from db import ensure_table_versions_schema, get_table_versions
+import serializacao
+
+# Cache HTTP condicional para endpoints de catálogo (dados de referência).
+# A versão de cada tabela vem de public.table_versions_atuais (trigger por statement),
+# então responder 304 custa uma consulta indexada, sem montar nem serializar a lista.
+
+
+def _etag_for(versions, tables):
+    parts = [request.path, request.query_string.decode("utf-8", errors="ignore"), serializacao.formato() or ""]
+    for t in tables:
+        v = versions.get(t)
+        parts.append(f"{t}:{v[0] if v else '-'}")
+    return '"' + hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest() + '"'
+
+
+def _not_modified(etag, last_modified):
+    inm = request.headers.get("If-None-Match")
+    if inm:
+        # Comparação fraca: o ETag vira W/"..." quando a resposta sai comprimida
+        tags = [t.strip()[2:] if t.strip().startswith("W/") else t.strip() for t in inm.split(",")]
+        return etag in tags or "*" in tags
+    ims = request.headers.get("If-Modified-Since")
+    if ims and last_modified is not None:
+        try:
+            return last_modified.replace(microsecond=0) <= parsedate_to_datetime(ims)
+        except Exception:
+            return False
+    return False
+
+
+def conditional_cache(*tables):
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            try:
+                ensure_table_versions_schema(tables)
+                versions = get_table_versions(tables)
+            except Exception:
+                versions = None
+            if not versions or len(versions) < len(tables):
+                # Versões ainda indisponíveis (tabela recém-criada): responde sem cache
+                return fn(*args, **kwargs)
+            etag = _etag_for(versions, tables)
+            stamps = [v[1] for v in versions.values() if v[1] is not None]
+            last_modified = max(stamps).astimezone(timezone.utc) if stamps else None
+            if _not_modified(etag, last_modified):
+                resp = make_response("", 304)
+            else:
+                resp = make_response(fn(*args, **kwargs))
+                if resp.status_code != 200:
+                    return resp
+            resp.headers["ETag"] = etag
+            if last_modified is not None:
+                resp.headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+            resp.headers["Cache-Control"] = "no-cache"
+            return resp
+        return wrapper
+    return decorator
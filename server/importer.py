@@ -0,0 +1,512 @@
+import csv
+import json
+import math
+import time
+import uuid
+import codecs
+import tempfile
+import unicodedata
+import metrics
+import swap
+import bulk
+import eventos
+from bulk import copy_campo as _copy_campo, CopyStream as _CopyStream
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+# Importação de planilhas (CSV/XLSX) direto no servidor.
+# O arquivo é lido em streaming, cada linha passa pelo mapeamento de colunas e
+# pela validação da tabela e segue por COPY para uma tabela temporária (não vai
+# para o WAL). Duplicidades e referências são resolvidas em SQL e o merge no
+# destino é um único INSERT ... SELECT ... ON CONFLICT. Linhas recusadas ficam
+# em import_rejeicoes com o número da linha no arquivo.
+
+SPOOL_BYTES = 8 * 1024 * 1024
+PEEK_BYTES = 64 * 1024
+MAX_REJEICOES_DETALHE = 10000
+PROGRESSO_LINHAS = 5000
+STAGING = "_import_stg"
+
+EXTENSOES = {".csv": "csv", ".txt": "csv", ".xlsx": "xlsx", ".xlsm": "xlsx"}
+MIMETYPES = {
+    "text/csv": "csv",
+    "application/csv": "csv",
+    "text/plain": "csv",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": "xlsx",
+}
+
+_TIPOS_SQL = {"texto": "TEXT", "maiusculo": "TEXT", "numero": "NUMERIC", "booleano": "BOOLEAN"}
+_VERDADEIRO = {"1", "true", "t", "sim", "s", "yes", "y", "x"}
+_FALSO = {"0", "false", "f", "nao", "n", "no"}
+
+def _validar_talhoes(cur, sombra):
+    # Talhão com programação não pode sumir na substituição completa
+    cur.execute("SELECT to_regclass('public.programacao_talhoes')")
+    if cur.fetchone()[0] is None:
+        return
+    # Sem novas programações apontando para talhões até o commit (não há FK)
+    swap.travar(cur, "programacao_talhoes", "SHARE ROW EXCLUSIVE")
+    cur.execute(
+        f"""
+        SELECT t.nome FROM public.talhoes t
+        WHERE EXISTS (SELECT 1 FROM public.programacao_talhoes pt WHERE pt.talhao_id = t.id)
+          AND NOT EXISTS (SELECT 1 FROM public.{sombra} s WHERE s.id = t.id)
+        ORDER BY t.nome LIMIT 11
+        """
+    )
+    nomes = [r[0] for r in cur.fetchall()]
+    if nomes:
+        lista = ", ".join(nomes[:10]) + (" ..." if len(nomes) > 10 else "")
+        raise swap.SubstituicaoRecusada(f"talhões com programação ausentes do arquivo: {lista}")
+
+
+def _preparar_talhoes(cur, sombra):
+    # Geometria herdada + área nova: recalcula a divergência na sombra, antes da troca
+    from geometry import DIVERGENCIA_SET_SQL, get_tolerancia_pct
+    cur.execute(f"UPDATE public.{sombra} t SET " + DIVERGENCIA_SET_SQL + " WHERE t.area_poligono IS NOT NULL", [get_tolerancia_pct()])
+
+
+# Colunas: (nome, tipo, obrigatória, apelidos aceitos no cabeçalho já normalizado)
+TABELAS = {
+    "produtores": {
+        "tabela": "produtores",
+        "colunas": [
+            ("numerocm", "texto", True, ["numero_cm", "cm"]),
+            ("nome", "texto", True, ["produtor", "nome_produtor"]),
+            ("numerocm_consultor", "texto", True, ["cm_consultor"]),
+            ("consultor", "texto", False, []),
+            ("cod_empresa", "texto", False, ["codempresa", "empresa"]),
+        ],
+        "chave": ["numerocm"],
+        "gera_id": True,
+    },
+    "fazendas": {
+        "tabela": "fazendas",
+        "colunas": [
+            ("numerocm", "texto", True, ["numero_cm", "cm"]),
+            ("idfazenda", "texto", True, ["id_fazenda"]),
+            ("nomefazenda", "texto", True, ["nome_fazenda", "fazenda"]),
+            ("numerocm_consultor", "texto", True, ["cm_consultor"]),
+            ("cadpro", "texto", False, []),
+            ("cod_imovel", "texto", False, ["codimovel"]),
+        ],
+        "chave": ["numerocm", "idfazenda"],
+        "gera_id": True,
+    },
+    "talhoes": {
+        "tabela": "talhoes",
+        "colunas": [
+            ("fazenda_id", "texto", True, []),
+            ("nome", "texto", True, ["talhao"]),
+            ("area", "numero", True, ["area_ha", "hectares"]),
+            ("arrendado", "booleano", False, []),
+        ],
+        "chave": None,
+        "gera_id": True,
+        "referencias": [("fazenda_id", "fazendas", "id")],
+        # limpar_antes: substituição por tabela sombra; id, safras e geometria seguem o talhão pela chave
+        "substituicao": {"chave": ["fazenda_id", "nome"], "validar": _validar_talhoes, "preparar": _preparar_talhoes},
+    },
+    "cultivares_catalog": {
+        "tabela": "cultivares_catalog",
+        "colunas": [
+            ("cultivar", "maiusculo", True, []),
+            ("cultura", "maiusculo", False, []),
+            ("nome_cientifico", "texto", False, []),
+            ("rnc", "texto", False, []),
+        ],
+        "chave": ["cultivar", "cultura"],
+        "gera_id": False,
+    },
+    "fertilizantes": {
+        "tabela": "fertilizantes_catalog",
+        "colunas": [
+            ("cod_item", "texto", True, ["coditem", "cod"]),
+            ("item", "texto", False, []),
+            ("grupo", "texto", False, []),
+            ("marca", "texto", False, []),
+            ("principio_ativo", "texto", False, []),
+            ("saldo", "numero", False, []),
+        ],
+        "chave": ["cod_item"],
+        "gera_id": False,
+    },
+    "defensivos": {
+        "tabela": "defensivos_catalog",
+        "colunas": [
+            ("cod_item", "texto", True, ["coditem", "cod"]),
+            ("item", "texto", False, []),
+            ("grupo", "texto", False, []),
+            ("marca", "texto", False, []),
+            ("principio_ativo", "texto", False, []),
+            ("saldo", "numero", False, []),
+        ],
+        "chave": ["cod_item"],
+        "gera_id": False,
+    },
+    "calendario_aplicacoes": {
+        "tabela": "calendario_aplicacoes",
+        "colunas": [
+            ("cod_aplic", "texto", True, []),
+            ("descr_aplicacao", "texto", True, ["descricao_aplicacao"]),
+            ("cod_aplic_ger", "texto", False, []),
+            ("cod_classe", "texto", True, []),
+            ("descricao_classe", "texto", True, []),
+            ("trat_sementes", "texto", False, []),
+        ],
+        "chave": ["cod_aplic"],
+        "gera_id": True,
+    },
+}
+
+
+class ImportacaoInvalida(ValueError):
+    pass
+
+
+def normalizar_cabecalho(nome):
+    s = unicodedata.normalize("NFKD", str(nome or "")).encode("ascii", "ignore").decode("ascii")
+    out = []
+    for ch in s.strip().lower():
+        out.append(ch if ch.isalnum() else "_")
+    return "_".join(p for p in "".join(out).split("_") if p)
+
+
+def detectar_formato(nome_arquivo=None, mimetype=None, cabeca=b""):
+    if cabeca[:4] == b"PK\x03\x04":
+        return "xlsx"
+    nome = (nome_arquivo or "").lower()
+    for ext, fmt in EXTENSOES.items():
+        if nome.endswith(ext):
+            return fmt
+    return MIMETYPES.get((mimetype or "").lower(), "csv")
+
+
+def spool(stream):
+    # Corpo cru (não multipart): copia em blocos para um arquivo que vai ao disco acima de SPOOL_BYTES
+    tmp = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+    while True:
+        chunk = stream.read(PEEK_BYTES)
+        if not chunk:
+            break
+        tmp.write(chunk)
+    tmp.seek(0)
+    return tmp
+
+
+def _ler_csv(fh):
+    peek = fh.read(PEEK_BYTES)
+    fh.seek(0)
+    encoding = "utf-8-sig"
+    try:
+        peek.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # Caractere cortado no fim da amostra não conta como latin-1
+        if e.start < len(peek) - 4:
+            encoding = "latin-1"
+    amostra = peek.decode(encoding, errors="ignore")
+    primeira = amostra.splitlines()[0] if amostra else ""
+    try:
+        delim = csv.Sniffer().sniff(primeira, delimiters=";,\t|").delimiter
+    except csv.Error:
+        delim = ";" if ";" in primeira else ","
+    reader = csv.reader(codecs.getreader(encoding)(fh), delimiter=delim)
+    cabecalho = next(reader, None)
+    if cabecalho is None:
+        raise ImportacaoInvalida("arquivo vazio")
+
+    def linhas():
+        for row in reader:
+            if not any((c or "").strip() for c in row):
+                continue
+            yield reader.line_num, row
+    return cabecalho, linhas()
+
+
+def _ler_xlsx(fh, aba=None):
+    if openpyxl is None:
+        raise ImportacaoInvalida("suporte a XLSX indisponível (instale openpyxl) - envie CSV")
+    wb = openpyxl.load_workbook(fh, read_only=True, data_only=True)
+    ws = wb[aba] if aba else wb.worksheets[0]
+    rows = ws.iter_rows(values_only=True)
+    cabecalho = None
+    n = 0
+    for row in rows:
+        n += 1
+        if row and any(v not in (None, "") for v in row):
+            cabecalho = ["" if v is None else str(v) for v in row]
+            break
+    if cabecalho is None:
+        wb.close()
+        raise ImportacaoInvalida("planilha vazia")
+
+    def linhas():
+        i = n
+        try:
+            for row in rows:
+                i += 1
+                if not row or all(v in (None, "") for v in row):
+                    continue
+                yield i, list(row)
+        finally:
+            wb.close()
+    return cabecalho, linhas()
+
+
+def ler_arquivo(fh, formato, aba=None):
+    if formato == "xlsx":
+        return _ler_xlsx(fh, aba)
+    return _ler_csv(fh)
+
+
+def mapear_colunas(spec, cabecalho, mapeamento=None):
+    # Retorna [(indice no arquivo, coluna destino)]; mapeamento explícito tem prioridade
+    alvo = {}
+    for nome, _tipo, _obr, apelidos in spec["colunas"]:
+        alvo[nome] = nome
+        for a in apelidos:
+            alvo[a] = nome
+    explicito = {normalizar_cabecalho(k): v for k, v in (mapeamento or {}).items()}
+    validas = {c[0] for c in spec["colunas"]}
+    indices = []
+    usadas = set()
+    for i, h in enumerate(cabecalho):
+        hn = normalizar_cabecalho(h)
+        col = explicito.get(hn) or alvo.get(hn)
+        if col and col in validas and col not in usadas:
+            indices.append((i, col))
+            usadas.add(col)
+    faltando = [c[0] for c in spec["colunas"] if c[2] and c[0] not in usadas]
+    if faltando:
+        raise ImportacaoInvalida("colunas obrigatórias ausentes: " + ", ".join(faltando))
+    return indices
+
+
+def _converter(valor, tipo, coluna):
+    if valor is None:
+        return None
+    if tipo == "booleano":
+        if isinstance(valor, bool):
+            return "t" if valor else "f"
+        s = normalizar_cabecalho(valor)
+        if s == "":
+            return None
+        if s in _VERDADEIRO:
+            return "t"
+        if s in _FALSO:
+            return "f"
+        raise ValueError(f"{coluna}: valor booleano inválido {str(valor)[:40]!r}")
+    if tipo == "numero":
+        if isinstance(valor, bool):
+            raise ValueError(f"{coluna}: valor numérico inválido")
+        if isinstance(valor, (int, float)):
+            if isinstance(valor, float) and not math.isfinite(valor):
+                raise ValueError(f"{coluna}: valor numérico inválido")
+            return repr(valor)
+        s = str(valor).strip().replace(" ", "")
+        if s == "":
+            return None
+        # 1.234,56 (planilhas em pt-BR) -> 1234.56
+        if "," in s:
+            s = s.replace(".", "").replace(",", ".")
+        try:
+            f = float(s)
+        except ValueError:
+            raise ValueError(f"{coluna}: valor numérico inválido {str(valor)[:40]!r}")
+        if not math.isfinite(f):
+            raise ValueError(f"{coluna}: valor numérico inválido {str(valor)[:40]!r}")
+        return s
+    if isinstance(valor, float) and valor.is_integer():
+        # Códigos lidos do XLSX chegam como 123.0
+        valor = int(valor)
+    s = str(valor).strip()
+    if s == "":
+        return None
+    return s.upper() if tipo == "maiusculo" else s
+
+
+class _Rejeicoes:
+    def __init__(self):
+        self.total = 0
+        self.itens = []
+
+    def add(self, linha, motivo, dados=None):
+        self.total += 1
+        if len(self.itens) < MAX_REJEICOES_DETALHE:
+            self.itens.append((linha, motivo, json.dumps(dados, default=str) if dados is not None else None))
+
+    def gravar(self, cur, import_id):
+        if self.itens:
+            bulk.upsert(cur, "import_rejeicoes", ["import_id", "linha", "motivo", "dados"], [(import_id, l, m, d) for l, m, d in self.itens], carimbo=None)
+
+
+def _linhas_copy(spec, indices, linhas, rej, contagem, progresso=None):
+    tipos = {c[0]: c[1] for c in spec["colunas"]}
+    obrigatorias = [c[0] for c in spec["colunas"] if c[2]]
+    for num, row in linhas:
+        contagem["lidas"] += 1
+        if progresso is not None and contagem["lidas"] % PROGRESSO_LINHAS == 0:
+            progresso("carregando", contagem["lidas"])
+        valores = {}
+        erro = None
+        for i, col in indices:
+            bruto = row[i] if i < len(row) else None
+            try:
+                valores[col] = _converter(bruto, tipos[col], col)
+            except ValueError as e:
+                erro = str(e)
+                break
+        if erro is None:
+            vazias = [c for c in obrigatorias if valores.get(c) is None]
+            if vazias:
+                erro = "campos obrigatórios vazios: " + ", ".join(vazias)
+        if erro is not None:
+            rej.add(num, erro, {col: (row[i] if i < len(row) else None) for i, col in indices})
+            continue
+        campos = [str(num)]
+        if spec["gera_id"]:
+            campos.append(str(uuid.uuid4()))
+        campos.extend(_copy_campo(valores.get(col)) for _i, col in indices)
+        yield ("\t".join(campos) + "\n").encode("utf-8")
+
+
+def importar(conn, tabela, fh, formato="csv", arquivo_nome=None, user_id=None, mapeamento=None, limpar_antes=False, aba=None, progresso=None, job_id=None):
+    spec = TABELAS.get(tabela)
+    if spec is None:
+        raise ImportacaoInvalida(f"tabela não suportada: {tabela}")
+    if limpar_antes and not spec.get("substituicao"):
+        raise ImportacaoInvalida(f"limpar_antes não é suportado para {tabela}")
+    t0 = time.perf_counter()
+    cabecalho, linhas = ler_arquivo(fh, formato, aba)
+    indices = mapear_colunas(spec, cabecalho, mapeamento)
+    destino = spec["tabela"]
+    tipos = {c[0]: c[1] for c in spec["colunas"]}
+    cols = [col for _i, col in indices]
+    stg_cols = ["linha"] + (["id"] if spec["gera_id"] else []) + cols
+    import_id = str(uuid.uuid4())
+    rej = _Rejeicoes()
+    contagem = {"lidas": 0}
+    deleted = 0
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO public.import_history (id, user_id, tabela_nome, registros_importados, registros_deletados, arquivo_nome, limpar_antes, job_id)
+                VALUES (%s, %s, %s, 0, 0, %s, %s, %s)
+                """,
+                [import_id, user_id, destino, arquivo_nome, bool(limpar_antes), job_id],
+            )
+            ddl = ", ".join(
+                ["linha INT PRIMARY KEY"]
+                + (["id TEXT"] if spec["gera_id"] else [])
+                + [f"{c} {_TIPOS_SQL[tipos[c]]}" for c in cols]
+            )
+            cur.execute(f"CREATE TEMP TABLE {STAGING} ({ddl}) ON COMMIT DROP")
+            cur.copy_expert(
+                f"COPY {STAGING} ({', '.join(stg_cols)}) FROM STDIN",
+                _CopyStream(_linhas_copy(spec, indices, linhas, rej, contagem, progresso)),
+            )
+            if progresso is not None:
+                progresso("validando", contagem["lidas"])
+            rej.gravar(cur, import_id)
+            cur.execute(f"ANALYZE {STAGING}")
+            rejeitadas_sql = 0
+            chave = spec.get("chave")
+            if chave:
+                # Mesma chave repetida no arquivo: vale a primeira ocorrência
+                k = ", ".join(chave)
+                cur.execute(
+                    f"""
+                    WITH dup AS (
+                      DELETE FROM {STAGING} s
+                      USING (
+                        SELECT linha, first_value(linha) OVER (PARTITION BY {k} ORDER BY linha) AS primeira
+                        FROM {STAGING}
+                      ) d
+                      WHERE s.linha = d.linha AND d.linha <> d.primeira
+                      RETURNING s.linha, d.primeira
+                    )
+                    INSERT INTO public.import_rejeicoes (import_id, linha, motivo)
+                    SELECT %s, linha, 'chave repetida no arquivo (mantida a linha ' || primeira || ')' FROM dup
+                    """,
+                    [import_id],
+                )
+                rejeitadas_sql += cur.rowcount
+            for col, ref_tabela, ref_col in spec.get("referencias") or []:
+                cur.execute(
+                    f"""
+                    WITH orfas AS (
+                      DELETE FROM {STAGING} s
+                      WHERE NOT EXISTS (SELECT 1 FROM public.{ref_tabela} r WHERE r.{ref_col} = s.{col})
+                      RETURNING s.linha, s.{col} AS valor
+                    )
+                    INSERT INTO public.import_rejeicoes (import_id, linha, motivo)
+                    SELECT %s, linha, '{col} inexistente: ' || valor FROM orfas
+                    """,
+                    [import_id],
+                )
+                rejeitadas_sql += cur.rowcount
+            ins_cols = (["id"] if spec["gera_id"] else []) + cols
+            alvo = destino
+            if limpar_antes:
+                alvo = swap.criar_sombra(cur, destino)
+            sql = f"INSERT INTO public.{alvo} ({', '.join(ins_cols)}) SELECT {', '.join(ins_cols)} FROM {STAGING} ORDER BY linha"
+            if chave:
+                atualizar = [c for c in cols if c not in chave]
+                sets = ", ".join([f"{c} = EXCLUDED.{c}" for c in atualizar] + ["updated_at = now()"])
+                sql += f" ON CONFLICT ({', '.join(chave)}) DO UPDATE SET {sets}"
+            if progresso is not None:
+                progresso("mesclando")
+            cur.execute(sql)
+            imported = cur.rowcount
+            pendentes = []
+            if limpar_antes:
+                sub = spec["substituicao"]
+                swap.preservar(cur, destino, alvo, sub["chave"], cols)
+                if sub.get("preparar"):
+                    sub["preparar"](cur, alvo)
+                if progresso is not None:
+                    progresso("substituindo")
+                resumo, pendentes = swap.trocar(cur, destino, alvo, ["id"] if spec["gera_id"] else chave, validar=sub.get("validar"))
+                deleted = resumo["removidos"]
+            if destino in eventos.TABELAS and (imported or deleted):
+                eventos.recarregar(cur, destino)
+            rejeitadas = rej.total + rejeitadas_sql
+            duracao_ms = int((time.perf_counter() - t0) * 1000)
+            cur.execute(
+                """
+                UPDATE public.import_history
+                SET registros_importados = %s, registros_deletados = %s, registros_rejeitados = %s, duracao_ms = %s
+                WHERE id = %s
+                """,
+                [imported, deleted, rejeitadas, duracao_ms, import_id],
+            )
+            if progresso is not None:
+                progresso("gravando", contagem["lidas"])
+    swap.validar_fks(conn, pendentes)
+    metrics.inc("import_rows_total", contagem["lidas"], {"tabela": tabela})
+    metrics.inc("import_rejected_total", rejeitadas, {"tabela": tabela})
+    metrics.observe("import_duration_seconds", duracao_ms / 1000.0, {"tabela": tabela}, (0.5, 1, 5, 15, 60, 300))
+    return {
+        "ok": True,
+        "import_id": import_id,
+        "lidas": contagem["lidas"],
+        "imported": imported,
+        "deleted": deleted,
+        "rejeitadas": rejeitadas,
+        "duracao_ms": duracao_ms,
+    }
+
+
+def listar_rejeicoes(cur, import_id, limit=500, offset=0):
+    cur.execute(
+        """
+        SELECT linha, motivo, dados FROM public.import_rejeicoes
+        WHERE import_id = %s ORDER BY linha LIMIT %s OFFSET %s
+        """,
+        [import_id, limit, offset],
+    )
+    return [{"linha": r[0], "motivo": r[1], "dados": r[2]} for r in cur.fetchall()]
@@ -0,0 +1,150 @@
+import time
+import threading
+from psycopg2.extensions import cursor as _pg_cursor
+from flask import request
+import metrics
+from serializacao import JSONProvider
+
+# Instrumentação por requisição: quantidade/tempo de queries (psycopg2 do pool e
+# engine SQLAlchemy), tempo de serialização JSON e tempo total do handler.
+# Os valores vão no header Server-Timing e alimentam o histograma por endpoint
+# exposto em /metrics (formato texto do Prometheus).
+
+_local = threading.local()
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+class RequestStats:
+    __slots__ = ("started", "endpoint", "db_count", "db_time", "ser_time", "parent")
+
+    def __init__(self, endpoint=None, parent=None):
+        self.started = time.perf_counter()
+        self.endpoint = endpoint
+        self.parent = parent
+        self.db_count = 0
+        self.db_time = 0.0
+        self.ser_time = 0.0
+
+
+def current_stats():
+    return getattr(_local, "stats", None)
+
+
+def record_query(duration, sql=None, params=None):
+    st = getattr(_local, "stats", None)
+    if st is not None:
+        st.db_count += 1
+        st.db_time += duration
+    for hook in _query_hooks:
+        try:
+            hook(duration, sql, params)
+        except Exception:
+            pass
+
+
+# Observadores de query (ex.: log de queries lentas); recebem (duração, sql, params)
+_query_hooks = []
+
+
+def add_query_hook(fn):
+    _query_hooks.append(fn)
+
+
+class TimedCursor(_pg_cursor):
+    # cursor_factory do pool psycopg2: mede execute/executemany
+    def execute(self, query, vars=None):
+        t0 = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(time.perf_counter() - t0, query, vars)
+
+    def executemany(self, query, vars_list):
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            record_query(time.perf_counter() - t0, query, None)
+
+
+def instrument_engine(engine):
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("_q_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("_q_start")
+        if starts:
+            record_query(time.perf_counter() - starts.pop(), statement, parameters)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("_q_start"):
+            conn.info["_q_start"].pop()
+
+    return engine
+
+
+class TimedJSONProvider(JSONProvider):
+    def dumps(self, obj, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            st = getattr(_local, "stats", None)
+            if st is not None:
+                st.ser_time += time.perf_counter() - t0
+
+
+def _endpoint_label():
+    rule = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+    return {"method": request.method, "route": rule}
+
+
+def init_app(app):
+    app.json = TimedJSONProvider(app)
+
+    @app.before_request
+    def _start_request_stats():
+        label = _endpoint_label()
+        # Requisição interna (itens de /batch) despachada dentro de outra: ao
+        # terminar, os tempos dela somam nos da requisição externa
+        _local.stats = RequestStats(f"{label['method']} {label['route']}", getattr(_local, "stats", None))
+
+    @app.after_request
+    def _finish_request_stats(response):
+        st = getattr(_local, "stats", None)
+        if st is None:
+            return response
+        total = time.perf_counter() - st.started
+        app_time = max(total - st.db_time - st.ser_time, 0.0)
+        response.headers["Server-Timing"] = ", ".join([
+            f'db;dur={st.db_time * 1000:.1f};desc="{st.db_count} queries"',
+            f"ser;dur={st.ser_time * 1000:.1f}",
+            f"app;dur={app_time * 1000:.1f}",
+            f"total;dur={total * 1000:.1f}",
+        ])
+        labels = _endpoint_label()
+        labels["status"] = str(response.status_code)
+        metrics.observe("http_request_duration_seconds", total, labels, LATENCY_BUCKETS)
+        route = {"route": labels["route"], "method": labels["method"]}
+        metrics.observe("http_request_db_queries", st.db_count, route, QUERY_COUNT_BUCKETS)
+        metrics.inc("http_request_db_seconds_total", st.db_time, route)
+        metrics.inc("http_request_serialize_seconds_total", st.ser_time, route)
+        return response
+
+    @app.teardown_request
+    def _clear_request_stats(exc):
+        st = getattr(_local, "stats", None)
+        parent = st.parent if st is not None else None
+        if parent is not None:
+            parent.db_count += st.db_count
+            parent.db_time += st.db_time
+            parent.ser_time += st.ser_time
+        _local.stats = parent
@@ -0,0 +1,292 @@
+import os
+import time
+import uuid
+import socket
+import threading
+import traceback
+from psycopg2.extras import Json
+import metrics
+
+# Tarefas em segundo plano com fila no Postgres.
+# POST só grava a linha em public.jobs; threads de cada worker do gunicorn
+# disputam as pendentes com FOR UPDATE SKIP LOCKED. Enquanto a tarefa roda, um
+# batimento grava fase/progresso a cada BATIMENTO_SEG; tarefa "executando" sem
+# batimento há mais de ABANDONO_SEG (worker reiniciado/morto) volta para a fila
+# e é reexecutada do início - os handlers precisam ser idempotentes.
+
+WORKERS = int(os.environ.get("AGROPLAN_JOB_WORKERS", "1"))
+POLL_SEG = 5
+BATIMENTO_SEG = 2
+ABANDONO_SEG = 120
+MAX_TENTATIVAS = 3
+JOBS_DIR = os.environ.get("AGROPLAN_JOBS_DIR", os.path.join(os.path.dirname(__file__), "jobs_data"))
+
+_handlers = {}
+_wake = threading.Event()
+_state = {"threads": []}
+_host_pid = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def register(tipo, fn):
+    # fn(payload, arquivo_path, progresso, job_id) -> dict (resultado)
+    _handlers[tipo] = fn
+
+
+def arquivo_path(job_id, ext=""):
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    return os.path.join(JOBS_DIR, job_id + ext)
+
+
+def submit(tipo, payload=None, user_id=None, job_id=None, arquivo=None):
+    from db import get_pool, ensure_jobs_schema
+    ensure_jobs_schema()
+    job_id = job_id or str(uuid.uuid4())
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    INSERT INTO public.jobs (id, tipo, status, fase, payload, arquivo_path, user_id)
+                    VALUES (%s, %s, 'pendente', 'na fila', %s, %s, %s)
+                    """,
+                    [job_id, tipo, Json(payload or {}), arquivo, user_id],
+                )
+    finally:
+        pool.putconn(conn)
+    metrics.inc("jobs_submitted_total", 1, {"tipo": tipo})
+    _wake.set()
+    return job_id
+
+
+_COLS = "id, tipo, status, fase, processados, total, resultado, erro, tentativas, worker, user_id, criado_em, iniciado_em, heartbeat_em, concluido_em"
+
+
+def _row_to_dict(row):
+    d = dict(zip([c.strip() for c in _COLS.split(",")], row))
+    ini = d["iniciado_em"]
+    fim = d["concluido_em"] or d["heartbeat_em"]
+    dur = (fim - ini).total_seconds() if ini and fim else None
+    d["duracao_seg"] = round(dur, 2) if dur is not None else None
+    d["linhas_por_seg"] = round(d["processados"] / dur, 1) if dur else None
+    for k in ("criado_em", "iniciado_em", "heartbeat_em", "concluido_em"):
+        d[k] = d[k].isoformat() if d[k] else None
+    return d
+
+
+def get(cur, job_id):
+    cur.execute(f"SELECT {_COLS} FROM public.jobs WHERE id = %s", [job_id])
+    row = cur.fetchone()
+    return _row_to_dict(row) if row else None
+
+
+def listar(cur, tipo=None, status=None, limit=50, user_id=None):
+    where, params = [], []
+    if user_id is not None:
+        where.append("user_id = %s")
+        params.append(user_id)
+    if tipo:
+        where.append("tipo = %s")
+        params.append(tipo)
+    if status:
+        where.append("status = %s")
+        params.append(status)
+    sql = f"SELECT {_COLS} FROM public.jobs" + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY criado_em DESC LIMIT %s"
+    cur.execute(sql, params + [limit])
+    return [_row_to_dict(r) for r in cur.fetchall()]
+
+
+def publico(item):
+    # Sem o traceback do erro (fica só no log do worker)
+    resultado = item.get("resultado")
+    if isinstance(resultado, dict) and "trace" in resultado:
+        item = dict(item, resultado={k: v for k, v in resultado.items() if k != "trace"})
+    return item
+
+
+class TarefaPerdida(Exception):
+    pass
+
+
+class Progresso:
+    # Handlers só mexem nestes campos; o batimento persiste em outra conexão.
+    # Se o batimento perde a tarefa, a próxima chamada interrompe o handler
+    # (a exceção desfaz a transação em andamento) antes de outro worker
+    # executá-la de novo. Handlers que gravam numa transação chamam progresso()
+    # logo antes do commit e não depois dele: uma interrupção após o commit
+    # descartaria o resultado e a tarefa seria refeita do início.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.perdida = threading.Event()
+        self.fase = "iniciando"
+        self.processados = 0
+        self.total = None
+
+    def __call__(self, fase=None, processados=None, total=None):
+        if self.perdida.is_set():
+            raise TarefaPerdida("tarefa sem batimento: interrompida para não executar em dobro")
+        with self.lock:
+            if fase is not None:
+                self.fase = fase
+            if processados is not None:
+                self.processados = processados
+            if total is not None:
+                self.total = total
+
+    def valores(self):
+        with self.lock:
+            return self.fase, self.processados, self.total
+
+
+def _batimento(job_id, prog, parar, worker):
+    from db import get_pool
+    pool = get_pool()
+    ultimo_ok = time.monotonic()
+    while not parar.wait(BATIMENTO_SEG):
+        atualizou = None
+        try:
+            conn = pool.getconn()
+            try:
+                fase, processados, total = prog.valores()
+                with conn:
+                    with conn.cursor() as cur:
+                        cur.execute(
+                            """
+                            UPDATE public.jobs SET fase = %s, processados = %s, total = %s, heartbeat_em = now()
+                            WHERE id = %s AND status = 'executando' AND worker = %s
+                            """,
+                            [fase, processados, total, job_id, worker],
+                        )
+                        atualizou = cur.rowcount > 0
+            finally:
+                pool.putconn(conn)
+        except Exception as e:
+            print(f"[jobs] falha no batimento de {job_id}: {e}")
+        if atualizou:
+            ultimo_ok = time.monotonic()
+        elif atualizou is False or time.monotonic() - ultimo_ok > ABANDONO_SEG / 2:
+            # A linha já não é deste worker, ou logo será retomada por outro
+            print(f"[jobs] tarefa {job_id} perdeu o batimento; interrompendo")
+            prog.perdida.set()
+            return
+
+
+def _claim(cur, worker):
+    cur.execute(
+        """
+        UPDATE public.jobs SET status = 'erro', erro = 'abandonado após ' || tentativas || ' tentativas', concluido_em = now()
+        WHERE status = 'executando' AND heartbeat_em < now() - make_interval(secs => %s) AND tentativas >= %s
+        """,
+        [ABANDONO_SEG, MAX_TENTATIVAS],
+    )
+    cur.execute(
+        """
+        UPDATE public.jobs j
+        SET status = 'executando', worker = %s, tentativas = j.tentativas + 1, fase = 'iniciando',
+            processados = 0, erro = NULL, iniciado_em = now(), heartbeat_em = now()
+        WHERE j.id = (
+          SELECT id FROM public.jobs
+          WHERE status = 'pendente'
+             OR (status = 'executando' AND heartbeat_em < now() - make_interval(secs => %s))
+          ORDER BY criado_em
+          FOR UPDATE SKIP LOCKED
+          LIMIT 1
+        )
+        RETURNING j.id, j.tipo, j.payload, j.arquivo_path, j.tentativas
+        """,
+        [worker, ABANDONO_SEG],
+    )
+    return cur.fetchone()
+
+
+def _finish(job_id, worker, status, fase, processados, total, resultado=None, erro=None):
+    from db import get_pool
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE public.jobs
+                    SET status = %s, fase = %s, processados = %s, total = %s, resultado = %s, erro = %s,
+                        concluido_em = now(), heartbeat_em = now()
+                    WHERE id = %s AND worker = %s
+                    """,
+                    [status, fase, processados, total, Json(resultado) if resultado is not None else None, erro, job_id, worker],
+                )
+    finally:
+        pool.putconn(conn)
+
+
+def _run(worker, job_id, tipo, payload, arquivo, tentativa):
+    fn = _handlers.get(tipo)
+    prog = Progresso()
+    parar = threading.Event()
+    hb = threading.Thread(target=_batimento, args=(job_id, prog, parar, worker), name=f"job-hb-{job_id[:8]}", daemon=True)
+    hb.start()
+    t0 = time.perf_counter()
+    try:
+        if fn is None:
+            raise ValueError(f"tipo de tarefa desconhecido: {tipo}")
+        resultado = fn(payload or {}, arquivo, prog, job_id)
+        status, erro = "concluido", None
+        if isinstance(resultado, dict) and resultado.get("error"):
+            status, erro = "erro", str(resultado.get("error"))
+    except TarefaPerdida:
+        # A linha será (ou já foi) retomada por outro worker: não grava resultado
+        metrics.inc("jobs_lost_total", 1, {"tipo": tipo})
+        return
+    except Exception as e:
+        trace = traceback.format_exc()
+        print(f"[jobs] tarefa {job_id} ({tipo}) falhou: {trace}")
+        resultado, status, erro = {"trace": trace[-4000:]}, "erro", str(e)
+    finally:
+        parar.set()
+        hb.join()
+    fase, processados, total = prog.valores()
+    _finish(job_id, worker, status, "concluido" if status == "concluido" else fase, processados, total, resultado, erro)
+    metrics.inc("jobs_finished_total", 1, {"tipo": tipo, "status": status})
+    metrics.observe("job_duration_seconds", time.perf_counter() - t0, {"tipo": tipo}, (1, 5, 15, 60, 300, 900))
+    if arquivo and status == "concluido":
+        try:
+            os.remove(arquivo)
+        except OSError:
+            pass
+
+
+def _loop():
+    from db import get_pool, ensure_jobs_schema
+    worker = f"{_host_pid}:{threading.current_thread().name}"
+    while True:
+        item = None
+        try:
+            ensure_jobs_schema()
+            pool = get_pool()
+            conn = pool.getconn()
+            try:
+                with conn:
+                    with conn.cursor() as cur:
+                        item = _claim(cur, worker)
+            finally:
+                pool.putconn(conn)
+        except Exception as e:
+            print(f"[jobs] erro ao buscar tarefa: {e}")
+        if item is None:
+            _wake.wait(POLL_SEG)
+            _wake.clear()
+            continue
+        try:
+            _run(worker, *item)
+        except Exception as e:
+            print(f"[jobs] erro ao finalizar tarefa {item[0]}: {e}")
+
+
+def start():
+    if _state["threads"]:
+        return
+    for i in range(max(0, WORKERS)):
+        t = threading.Thread(target=_loop, name=f"jobs-{i}", daemon=True)
+        _state["threads"].append(t)
+        t.start()
@@ -0,0 +1,81 @@
+from db import get_pool
+from serializacao import Linhas
+import sync
+
+# Leitura direta (sem ORM) para catálogos e configurações: cursor do pool,
+# tuplas -> dicts com os conversores de cada coluna resolvidos uma única vez
+# pelo OID do tipo (cur.description), em vez de carregar entidades mapeadas e
+# remontar o dict campo a campo.
+
+_OID_TIMESTAMP = (1114, 1184)
+_OID_DATE = 1082
+_OID_NUMERIC = 1700
+
+
+def _iso(v):
+    return v.isoformat() if v is not None else None
+
+
+def _num(v):
+    return float(v) if v is not None else None
+
+
+def _conversor(type_code):
+    if type_code in _OID_TIMESTAMP or type_code == _OID_DATE:
+        return _iso
+    if type_code == _OID_NUMERIC:
+        return _num
+    return None
+
+
+def dicts(cur):
+    """Converte o resultado do cursor em lista de dicts prontos para JSON."""
+    cols = [d[0] for d in cur.description]
+    convs = [(i, c) for i, c in enumerate(_conversor(d[1]) for d in cur.description) if c is not None]
+    rows = cur.fetchall()
+    if not convs:
+        return [dict(zip(cols, r)) for r in rows]
+    out = []
+    for r in rows:
+        r = list(r)
+        for i, conv in convs:
+            r[i] = conv(r[i])
+        out.append(dict(zip(cols, r)))
+    return out
+
+
+def consultar(sql, params=None):
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                return dicts(cur)
+    finally:
+        pool.putconn(conn)
+
+
+def itens(sql, params=None, incremental=None):
+    """Formato padrão das listagens: {"items": [...], "count": n}.
+
+    As linhas vão como serializacao.Linhas (ISO 8601 / NUMERIC como número),
+    codificadas direto das tuplas pelo JSONProvider. incremental=(tabela,
+    desde, reset) acrescenta cursor/deleted de sync.py; o filtro por
+    updated_at já deve estar em `sql`.
+    """
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cursor = sync.marca(cur) if incremental is not None else None
+                cur.execute(sql, params)
+                items = Linhas.do_cursor(cur, iso=True)
+                out = {"items": items, "count": len(items)}
+                if incremental is not None:
+                    tabela, desde, reset = incremental
+                    sync.completar(cur, out, tabela, desde, reset, cursor)
+    finally:
+        pool.putconn(conn)
+    return out
@@ -0,0 +1,100 @@
+import math
+import threading
+
+# Registro simples de métricas em memória (por worker).
+# Séries são identificadas por nome + labels (tupla ordenada de pares).
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+
+
+def _key(name, labels):
+    return (name, tuple(sorted((labels or {}).items())))
+
+
+def inc(name, value=1, labels=None):
+    k = _key(name, labels)
+    with _lock:
+        _counters[k] = _counters.get(k, 0) + value
+
+
+def gauge_add(name, delta, labels=None):
+    # Valor atual (requisições em andamento, fila...): soma/subtrai delta
+    k = _key(name, labels)
+    with _lock:
+        _gauges[k] = _gauges.get(k, 0) + delta
+
+
+def observe(name, value, labels=None, buckets=None):
+    k = _key(name, labels)
+    with _lock:
+        h = _histograms.get(k)
+        if h is None:
+            bounds = tuple(buckets or (0.01, 0.1, 1.0, 10.0))
+            h = _histograms[k] = {"bounds": bounds, "counts": [0] * len(bounds), "sum": 0.0, "count": 0}
+        for i, b in enumerate(h["bounds"]):
+            if value <= b:
+                h["counts"][i] += 1
+                break
+        h["sum"] += value
+        h["count"] += 1
+
+
+def snapshot(prefix=None):
+    with _lock:
+        items = list(_counters.items()) + list(_gauges.items())
+    out = []
+    for (name, labels), value in items:
+        if prefix and not name.startswith(prefix):
+            continue
+        out.append({"name": name, "labels": dict(labels), "value": value})
+    out.sort(key=lambda m: (m["name"], sorted(m["labels"].items())))
+    return out
+
+
+def _fmt_labels(labels, extra=None):
+    pairs = list(labels) + (list(extra) if extra else [])
+    if not pairs:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in pairs) + "}"
+
+
+def _fmt_value(v):
+    if isinstance(v, float) and math.isinf(v):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+def render_prometheus():
+    # Formato texto de exposição do Prometheus (0.0.4)
+    with _lock:
+        counters = sorted(_counters.items())
+        gauges = sorted(_gauges.items())
+        hists = sorted((k, {"bounds": h["bounds"], "counts": list(h["counts"]), "sum": h["sum"], "count": h["count"]}) for k, h in _histograms.items())
+    lines = []
+    seen = set()
+    for (name, labels), value in counters:
+        if name not in seen:
+            lines.append(f"# TYPE {name} counter")
+            seen.add(name)
+        lines.append(f"{name}{_fmt_labels(labels)} {_fmt_value(value)}")
+    for (name, labels), value in gauges:
+        if name not in seen:
+            lines.append(f"# TYPE {name} gauge")
+            seen.add(name)
+        lines.append(f"{name}{_fmt_labels(labels)} {_fmt_value(value)}")
+    for (name, labels), h in hists:
+        if name not in seen:
+            lines.append(f"# TYPE {name} histogram")
+            seen.add(name)
+        acc = 0
+        for b, c in zip(h["bounds"], h["counts"]):
+            acc += c
+            lines.append(f"{name}_bucket{_fmt_labels(labels, [('le', _fmt_value(float(b)))])} {acc}")
+        lines.append(f"{name}_bucket{_fmt_labels(labels, [('le', '+Inf')])} {h['count']}")
+        lines.append(f"{name}_sum{_fmt_labels(labels)} {_fmt_value(float(h['sum']))}")
+        lines.append(f"{name}_count{_fmt_labels(labels)} {h['count']}")
+    return "\n".join(lines) + "\n"
@@ -83,6 +83,11 @@ class Talhao(Base):
     bbox_min_lng = Column(Numeric)
     bbox_max_lat = Column(Numeric)
     bbox_max_lng = Column(Numeric)
+    area_poligono = Column(Numeric)
+    perimetro_poligono = Column(Numeric)
+    area_divergencia_pct = Column(Numeric)
+    area_divergente = Column(Boolean)
+    geometria_calculada_em = Column(TIMESTAMP(timezone=True))
     created_at = Column(TIMESTAMP(timezone=True), server_default=text("now()"))
     updated_at = Column(TIMESTAMP(timezone=True), server_default=text("now()"))
 
@@ -113,6 +118,9 @@ class ImportHistory(Base):
     tabela_nome = Column(String, nullable=False)
     registros_importados = Column(Integer, nullable=False)
     registros_deletados = Column(Integer, nullable=False)
+    registros_rejeitados = Column(Integer, nullable=False, server_default=text("0"))
+    duracao_ms = Column(Integer)
+    job_id = Column(String)
     arquivo_nome = Column(String)
     limpar_antes = Column(Boolean, server_default=text("false"))
     created_at = Column(TIMESTAMP(timezone=True), server_default=text("now()"))
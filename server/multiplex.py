@@ -0,0 +1,132 @@
+import os
+import time
+import threading
+from flask import request, Response
+from werkzeug.test import EnvironBuilder
+import metrics
+from db import conexao_compartilhada
+
+# Várias chamadas da API numa única requisição HTTP (POST /batch).
+#
+# Cada item {"method", "path", "body", "headers"} é despachado em sequência
+# pelo próprio Flask (rotas, decorators de cache, hooks de instrumentação),
+# sem passar de novo por nginx/CORS/compressão. O token da requisição externa
+# vale para todos os itens e é verificado uma vez; os getconn dos handlers
+# reaproveitam uma única conexão do pool (db.conexao_compartilhada), o que é
+# seguro porque os itens rodam um depois do outro e cada handler fecha a
+# própria transação.
+#
+# Limites: MAX_ITENS por lote e MAX_SEG de duração; itens que não começaram
+# dentro do prazo voltam com status 504 sem executar. A resposta é
+# {"responses": [{"id", "status", "body", "headers"}]}, na ordem do pedido,
+# com o JSON de cada item copiado sem decodificar.
+
+MAX_ITENS = int(os.environ.get("AGROPLAN_BATCH_MAX_ITENS", "500"))
+MAX_SEG = float(os.environ.get("AGROPLAN_BATCH_MAX_SEG", "30"))
+METODOS = ("GET", "POST", "PUT", "PATCH", "DELETE")
+PROIBIDAS = ("/batch", "/eventos")
+# Cabeçalhos do item repassados à sub-requisição e devolvidos na resposta
+REPASSE = ("accept", "content-type", "if-none-match", "if-modified-since")
+DEVOLVIDOS = ("ETag", "Last-Modified", "Location", "Retry-After", "X-Cache")
+
+_local = threading.local()
+
+
+def token_verificado(token):
+    """Payload já verificado neste lote (ou None fora de /batch)."""
+    tokens = getattr(_local, "tokens", None)
+    return tokens.get(token) if tokens else None
+
+
+def _caminho(path):
+    # Mesmo tratamento do StripApiPrefixMiddleware
+    if path == "/api":
+        return "/"
+    return path[4:] if path.startswith("/api/") else path
+
+
+def validar(itens):
+    if not isinstance(itens, list) or not itens:
+        return "requests vazio"
+    if len(itens) > MAX_ITENS:
+        return f"máximo de {MAX_ITENS} itens por lote"
+    for n, item in enumerate(itens):
+        if not isinstance(item, dict) or not isinstance(item.get("path"), str) or not item["path"].startswith("/"):
+            return f"item {n}: path inválido"
+        if str(item.get("method") or "GET").upper() not in METODOS:
+            return f"item {n}: método inválido"
+        rota = _caminho(item["path"].split("?", 1)[0])
+        if any(rota == p or rota.startswith(p + "/") for p in PROIBIDAS):
+            return f"item {n}: rota não permitida em lote"
+    return None
+
+
+def _despachar(app, item, auth):
+    metodo = str(item.get("method") or "GET").upper()
+    headers = {k: v for k, v in (item.get("headers") or {}).items() if k.lower() in REPASSE}
+    if auth:
+        headers["Authorization"] = auth
+    extra = {"json": item["body"]} if item.get("body") is not None else {}
+    builder = EnvironBuilder(
+        path=_caminho(item["path"]), method=metodo, base_url=request.host_url, headers=headers,
+        environ_overrides={"REMOTE_ADDR": request.remote_addr}, **extra,
+    )
+    try:
+        environ = builder.get_environ()
+    finally:
+        builder.close()
+    with app.request_context(environ):
+        try:
+            resp = app.full_dispatch_request()
+        except Exception as e:
+            print(f"[batch] erro em {metodo} {item['path']}: {e}")
+            resp = app.make_response(({"error": str(e)}, 500))
+        try:
+            if resp.direct_passthrough or resp.mimetype == "text/event-stream":
+                # Arquivos (send_file) e streams sem fim ficam fora do lote
+                return 400, {}, app.json.dumps({"error": "resposta em stream não suportada em lote"})
+            dados = resp.get_data()
+            if not dados:
+                corpo = "null"
+            elif resp.is_json:
+                corpo = dados.decode("utf-8").rstrip()
+            elif resp.status_code >= 400:
+                # Páginas de erro HTML do werkzeug (404, 405...)
+                corpo = app.json.dumps({"error": resp.status})
+            elif resp.mimetype.startswith("text/"):
+                corpo = app.json.dumps(resp.get_data(as_text=True))
+            else:
+                return 400, {}, app.json.dumps({"error": f"conteúdo {resp.mimetype} não suportado em lote"})
+            return resp.status_code, {h: resp.headers[h] for h in DEVOLVIDOS if h in resp.headers}, corpo
+        finally:
+            resp.close()
+
+
+def executar(app, itens, verificar):
+    t0 = time.perf_counter()
+    prazo = time.monotonic() + MAX_SEG
+    auth = request.headers.get("Authorization") or ""
+    tokens = {}
+    if auth.lower().startswith("bearer "):
+        token = auth.split(" ", 1)[1]
+        try:
+            tokens[token] = verificar(token)
+        except Exception:
+            pass  # cada item responde 401 como responderia sozinho
+    partes = []
+    _local.tokens = tokens
+    try:
+        with conexao_compartilhada():
+            for n, item in enumerate(itens):
+                if time.monotonic() > prazo:
+                    status, headers, corpo = 504, {}, app.json.dumps({"error": "tempo do lote esgotado"})
+                else:
+                    status, headers, corpo = _despachar(app, item, auth)
+                metrics.inc("batch_items_total", 1, {"status": str(status)})
+                meta = app.json.dumps({"headers": headers, "id": item.get("id", n), "status": status}, separators=(",", ":"))
+                partes.append('{"body":' + corpo + "," + meta[1:])
+    finally:
+        _local.tokens = None
+    metrics.observe("batch_size", len(itens), None, (1, 5, 10, 25, 50, 100, 250, 500))
+    metrics.observe("batch_duration_seconds", time.perf_counter() - t0, None, (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+    return Response('{"count":' + str(len(partes)) + ',"responses":[' + ",".join(partes) + "]}", mimetype="application/json")
@@ -0,0 +1,141 @@
+import time
+from psycopg2.extras import execute_values
+from shapely.geometry import Polygon
+from shapely.ops import unary_union
+from db import get_pool
+from geometry import project_equal_area
+from spatial import talhao_index, _rings_from_geojson
+
+# Detecção de sobreposição/duplicidade de polígonos entre talhões.
+# Os candidatos vêm do índice espacial (interseção de bbox); só esses pares
+# passam pelo cálculo exato de interseção. As coordenadas são levadas para a
+# projeção equivalente de geometry.py, então a área da interseção sai em m².
+
+AREA_MINIMA_HA = 0.01
+DUPLICADO_PCT = 98.0
+
+
+def _shape(polys):
+    parts = []
+    for rings in polys:
+        projected = []
+        for ring in rings:
+            x, y = project_equal_area(ring[:, 0], ring[:, 1])
+            projected.append(list(zip(x.tolist(), y.tolist())))
+        poly = Polygon(projected[0], projected[1:])
+        if not poly.is_valid:
+            poly = poly.buffer(0)
+        if not poly.is_empty:
+            parts.append(poly)
+    if not parts:
+        return None
+    return parts[0] if len(parts) == 1 else unary_union(parts)
+
+
+class _ShapeCache:
+    def __init__(self, shapes=None):
+        self._shapes = dict(shapes or {})
+
+    def get(self, talhao_id):
+        if talhao_id not in self._shapes:
+            self._shapes[talhao_id] = _shape(talhao_index.polygons(talhao_id))
+        return self._shapes[talhao_id]
+
+
+def _compare(cache, a_id, b_id):
+    a = cache.get(a_id)
+    b = cache.get(b_id)
+    if a is None or b is None or not a.intersects(b):
+        return None
+    inter = a.intersection(b).area / 10000.0
+    if inter < AREA_MINIMA_HA:
+        return None
+    area_a = a.area / 10000.0
+    area_b = b.area / 10000.0
+    pct_a = inter / area_a * 100 if area_a > 0 else None
+    pct_b = inter / area_b * 100 if area_b > 0 else None
+    duplicado = bool(pct_a and pct_b and pct_a >= DUPLICADO_PCT and pct_b >= DUPLICADO_PCT)
+    lo, hi = (a_id, b_id) if a_id < b_id else (b_id, a_id)
+    p_lo, p_hi = (pct_a, pct_b) if a_id < b_id else (pct_b, pct_a)
+    return (
+        lo,
+        hi,
+        round(inter, 4),
+        round(p_lo, 2) if p_lo is not None else None,
+        round(p_hi, 2) if p_hi is not None else None,
+        duplicado,
+    )
+
+
+def _insert(cur, rows):
+    if not rows:
+        return
+    execute_values(
+        cur,
+        """
+        INSERT INTO public.talhao_sobreposicoes (talhao_a_id, talhao_b_id, area_intersecao, pct_a, pct_b, duplicado)
+        VALUES %s
+        ON CONFLICT (talhao_a_id, talhao_b_id) DO UPDATE SET
+          area_intersecao = EXCLUDED.area_intersecao,
+          pct_a = EXCLUDED.pct_a,
+          pct_b = EXCLUDED.pct_b,
+          duplicado = EXCLUDED.duplicado,
+          detectado_em = now()
+        """,
+        rows,
+        page_size=1000,
+    )
+
+
+def check_talhao(cur, talhao_id, bbox, geojson):
+    # Verificação incremental após upload de KML: só contra os vizinhos no índice.
+    # A geometria nova vem do upload (o índice só recebe o talhão após o commit)
+    talhao_index.ensure_fresh()
+    cache = _ShapeCache({talhao_id: _shape(_rings_from_geojson(geojson))})
+    rows = []
+    for other in talhao_index.candidates(talhao_id, bbox):
+        r = _compare(cache, talhao_id, other)
+        if r:
+            rows.append(r)
+    cur.execute(
+        "DELETE FROM public.talhao_sobreposicoes WHERE talhao_a_id = %s OR talhao_b_id = %s",
+        [talhao_id, talhao_id],
+    )
+    _insert(cur, rows)
+    return rows
+
+
+def run_overlap_analysis():
+    # Job completo: cada par candidato é avaliado uma vez (id menor contra maior)
+    started = time.time()
+    talhao_index.rebuild()
+    cache = _ShapeCache()
+    rows = []
+    pares = 0
+    for tid in talhao_index.ids():
+        for other in talhao_index.candidates(tid):
+            if other <= tid:
+                continue
+            pares += 1
+            r = _compare(cache, tid, other)
+            if r:
+                rows.append(r)
+    t_calc = time.time()
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM public.talhao_sobreposicoes")
+                _insert(cur, rows)
+    finally:
+        pool.putconn(conn)
+    return {
+        "ok": True,
+        "talhoes": len(talhao_index.ids()),
+        "pares_avaliados": pares,
+        "sobreposicoes": len(rows),
+        "duplicados": sum(1 for r in rows if r[5]),
+        "calc_ms": int((t_calc - started) * 1000),
+        "elapsed_ms": int((time.time() - started) * 1000),
+    }
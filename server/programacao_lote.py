@@ -0,0 +1,235 @@
+import uuid
+from psycopg2.extras import execute_values
+import duplicacao
+
+# Criação/atualização de várias programações (glebas) numa transação.
+# Mesmas regras do POST/PUT /programacoes, mas validadas em conjunto: conflito
+# de talhão dentro do lote e contra o banco numa consulta só, catálogos
+# (cultura, cod_item de defensivos/fertilizantes) e consultor da fazenda
+# resolvidos uma vez para o lote inteiro, e gravação com INSERT multi-linha.
+# Itens com "id" substituem a programação existente (como o PUT completo).
+
+MAX_ITENS = 500
+_PAGINA = 1000
+
+_COLS_CULTIVAR = (
+    "id, programacao_id, user_id, produtor_numerocm, area, area_hectares, numerocm_consultor, cultivar, quantidade, unidade, "
+    "percentual_cobertura, tipo_embalagem, tipo_tratamento, tratamento_id, data_plantio, populacao_recomendada, "
+    "semente_propria, referencia_rnc_mapa, sementes_por_saca, safra, epoca_id, porcentagem_salva, cultura, "
+    "tipo_lancamento, quant_densidade, espacamento, quant_est_prod, perc_planta, fl_consorcio, cod_sistema_plantio, cod_proposito"
+)
+_COLS_ADUBACAO = (
+    "id, programacao_id, user_id, produtor_numerocm, area, numerocm_consultor, formulacao, cod_item, dose, percentual_cobertura, "
+    "data_aplicacao, embalagem, justificativa_nao_adubacao_id, fertilizante_salvo, "
+    "porcentagem_salva, total, safra_id, epoca_aplicacao, forma_aplicacao"
+)
+
+
+def _normalizar(item):
+    # Erros de formato que dispensam o banco; retorna a mensagem ou None
+    if not (item.get("produtor_numerocm") and item.get("fazenda_idfazenda") and item.get("area")):
+        return "Campos obrigatórios ausentes"
+    for c in item.get("cultivares") or []:
+        try:
+            if c.get("tipo_lancamento") and int(c.get("tipo_lancamento")) not in (1, 2):
+                return "tipo_lancamento deve ser 1 ou 2"
+        except (TypeError, ValueError):
+            return "tipo_lancamento deve ser 1 ou 2"
+    return None
+
+
+def validar(cur, itens):
+    """Valida o lote inteiro; retorna {indice: erro (dict)} (vazio quando tudo ok)."""
+    erros = {}
+    for i, it in enumerate(itens):
+        msg = _normalizar(it)
+        if msg:
+            erros[i] = {"error": msg}
+
+    ids_update = [it["id"] for it in itens if it.get("id")]
+    if ids_update:
+        if len(set(ids_update)) != len(ids_update):
+            for i, it in enumerate(itens):
+                if it.get("id") and ids_update.count(it["id"]) > 1:
+                    erros.setdefault(i, {"error": "programação repetida no lote"})
+        cur.execute("SELECT id FROM public.programacoes WHERE id = ANY(%s)", [ids_update])
+        existentes = {r[0] for r in cur.fetchall()}
+        for i, it in enumerate(itens):
+            if it.get("id") and it["id"] not in existentes:
+                erros.setdefault(i, {"error": "programacao nao encontrada"})
+
+    # Talhão/safra/época repetido entre itens do lote
+    vistos = {}
+    chaves = []
+    for i, it in enumerate(itens):
+        if not it.get("safra_id"):
+            continue
+        for tid in dict.fromkeys(it.get("talhao_ids") or []):
+            k = (it["safra_id"], it.get("fazenda_idfazenda"), tid, it.get("epoca_id"))
+            if k in vistos and vistos[k] != i:
+                e = erros.setdefault(i, {"error": "talhao repetido no lote nesta safra e época", "talhoes": []})
+                e.setdefault("talhoes", []).append(tid)
+            else:
+                vistos[k] = i
+                chaves.append((i,) + k)
+
+    # Conflito com programações já gravadas (as que o lote substitui não contam)
+    if chaves:
+        cur.execute(
+            """
+            SELECT k.i, pt.talhao_id, t.nome
+            FROM unnest(%s::int[], %s::text[], %s::text[], %s::text[], %s::text[]) AS k(i, safra_id, fazenda_idfazenda, talhao_id, epoca_id)
+            JOIN public.programacoes p ON p.safra_id = k.safra_id AND p.fazenda_idfazenda = k.fazenda_idfazenda
+            JOIN public.programacao_talhoes pt ON pt.programacao_id = p.id AND pt.talhao_id = k.talhao_id
+              AND pt.epoca_id IS NOT DISTINCT FROM k.epoca_id
+            LEFT JOIN public.talhoes t ON t.id = pt.talhao_id
+            WHERE NOT (p.id = ANY(%s))
+            """,
+            [[c[0] for c in chaves], [c[1] for c in chaves], [c[2] for c in chaves], [c[3] for c in chaves], [c[4] for c in chaves], ids_update],
+        )
+        for i, tid, nome in cur.fetchall():
+            e = erros.setdefault(i, {"error": "talhao já possui programação nesta safra e época"})
+            e.setdefault("talhoes", []).append(tid)
+            if nome is not None:
+                e.setdefault("talhoes_nomes", []).append(nome)
+    return erros
+
+
+def _catalogos(cur, itens):
+    cultivares, defensivos, formulacoes = set(), set(), set()
+    for it in itens:
+        for c in it.get("cultivares") or []:
+            if not c.get("cultura") and c.get("cultivar"):
+                cultivares.add(c["cultivar"])
+            if str(c.get("tipo_tratamento") or "").upper() == "NA FAZENDA":
+                defensivos.update(d.get("defensivo") for d in (c.get("defensivos_fazenda") or []) if d.get("defensivo"))
+        formulacoes.update(a.get("formulacao") for a in (it.get("adubacao") or []) if a.get("formulacao"))
+    cultura, defs, ferts = {}, {}, {}
+    if cultivares:
+        cur.execute("SELECT cultivar, cultura FROM public.cultivares_catalog WHERE cultivar = ANY(%s)", [list(cultivares)])
+        cultura = dict(cur.fetchall())
+    if defensivos:
+        cur.execute(
+            "SELECT item, grupo, MIN(cod_item) FROM public.defensivos_catalog WHERE item = ANY(%s) GROUP BY item, grupo",
+            [list(defensivos)],
+        )
+        for item, grupo, cod in cur.fetchall():
+            defs[(item, grupo)] = cod
+            if defs.get((item, None)) is None or cod < defs[(item, None)]:
+                defs[(item, None)] = cod
+    if formulacoes:
+        cur.execute("SELECT item, MIN(cod_item) FROM public.fertilizantes_catalog WHERE item = ANY(%s) GROUP BY item", [list(formulacoes)])
+        ferts = dict(cur.fetchall())
+    return cultura, defs, ferts
+
+
+def _consultores(cur, itens):
+    pares = {(it["fazenda_idfazenda"], it["produtor_numerocm"]) for it in itens}
+    cur.execute(
+        """
+        SELECT f.idfazenda, f.numerocm, f.numerocm_consultor
+        FROM public.fazendas f
+        JOIN unnest(%s::text[], %s::text[]) AS k(idfazenda, numerocm) ON f.idfazenda = k.idfazenda AND f.numerocm = k.numerocm
+        """,
+        [[p[0] for p in pares], [p[1] for p in pares]],
+    )
+    return {(r[0], r[1]): r[2] for r in cur.fetchall()}
+
+
+def gravar(cur, itens, user_id=None, cm_token=None):
+    """Grava o lote já validado; retorna um resultado por item, na ordem recebida."""
+    cultura_cat, defs_cat, ferts_cat = _catalogos(cur, itens)
+    cm_fazenda = {} if cm_token else _consultores(cur, itens)
+    novos = iter(duplicacao.novos_ids(sum(1 for it in itens if not it.get("id"))))
+
+    cab_novas, cab_update, cultivares, tratamentos, defensivos, adubacao, talhoes = [], [], [], [], [], [], []
+    resultados = []
+    for i, it in enumerate(itens):
+        pid = it.get("id") or next(novos)
+        uid = user_id or it.get("user_id")
+        numerocm, idfazenda, area = it["produtor_numerocm"], it["fazenda_idfazenda"], it["area"]
+        area_ha, safra_id, epoca_id = it.get("area_hectares"), it.get("safra_id"), it.get("epoca_id")
+        cm_cons = cm_token or cm_fazenda.get((idfazenda, numerocm))
+        tipo = (it.get("tipo") or "PROGRAMACAO").strip().upper()
+        cab = [pid, uid, numerocm, idfazenda, area, area_ha, safra_id, tipo, it.get("cod_unidade_fabril"),
+               it.get("campo_semente"), it.get("categoria"), it.get("renasem"), bool(it.get("proposito_semente"))]
+        if it.get("id"):
+            cab_update.append(tuple(cab + [it.get("revisada")]))
+        else:
+            cab_novas.append(tuple(cab))
+        resultados.append({"index": i, "id": pid, "status": "atualizado" if it.get("id") else "criado"})
+
+        for c in it.get("cultivares") or []:
+            cult_id = c.get("id") or str(uuid.uuid4())
+            tr_ids = c.get("tratamento_ids") or ([c.get("tratamento_id")] if c.get("tratamento_id") else [])
+            tipo_trat = str(c.get("tipo_tratamento") or "").upper()
+            first_tr = None if tipo_trat == "NÃO" else (tr_ids[0] if tr_ids else None)
+            cultivares.append((
+                cult_id, pid, uid, numerocm, area, area_ha, cm_cons, c.get("cultivar"), 0, "kg",
+                c.get("percentual_cobertura"), c.get("tipo_embalagem"), c.get("tipo_tratamento"), first_tr,
+                c.get("data_plantio"), c.get("populacao_recomendada") or 0, bool(c.get("semente_propria")),
+                c.get("referencia_rnc_mapa"), c.get("sementes_por_saca") or 0, safra_id, epoca_id, 0,
+                c.get("cultura") or cultura_cat.get(c.get("cultivar")),
+                c.get("tipo_lancamento"), c.get("quant_densidade"), c.get("espacamento"), c.get("quant_est_prod"),
+                c.get("perc_planta"), c.get("fl_consorcio"), c.get("cod_sistema_plantio"), c.get("cod_proposito"),
+            ))
+            tratamentos.extend((str(uuid.uuid4()), cult_id, tid) for tid in tr_ids if tid)
+            if tipo_trat == "NA FAZENDA":
+                for d in c.get("defensivos_fazenda") or []:
+                    defensivos.append((
+                        str(uuid.uuid4()), cult_id, d.get("classe"), d.get("aplicacao"), d.get("defensivo"),
+                        defs_cat.get((d.get("defensivo"), d.get("classe"))), d.get("dose"), d.get("cobertura"),
+                        d.get("total"), bool(d.get("produto_salvo")),
+                    ))
+        for a in it.get("adubacao") or []:
+            adubacao.append((
+                str(uuid.uuid4()), pid, uid, numerocm, area, cm_cons, a.get("formulacao"), ferts_cat.get(a.get("formulacao")),
+                a.get("dose"), a.get("percentual_cobertura"), a.get("data_aplicacao"), a.get("embalagem"),
+                a.get("justificativa_nao_adubacao_id"), bool(a.get("fertilizante_salvo")),
+                float(a.get("porcentagem_salva") or 0), None, safra_id, a.get("epoca_aplicacao"), a.get("forma_aplicacao"),
+            ))
+        talhoes.extend((str(uuid.uuid4()), pid, tid, safra_id, idfazenda, epoca_id) for tid in dict.fromkeys(it.get("talhao_ids") or []))
+
+    ids_update = [r[0] for r in cab_update]
+    if ids_update:
+        execute_values(
+            cur,
+            """
+            UPDATE public.programacoes p
+            SET user_id = v.user_id, produtor_numerocm = v.produtor_numerocm, fazenda_idfazenda = v.fazenda_idfazenda,
+                area = v.area, area_hectares = v.area_hectares, safra_id = v.safra_id, tipo = v.tipo,
+                revisada = COALESCE(v.revisada, p.revisada), cod_unidade_fabril = v.cod_unidade_fabril,
+                campo_semente = v.campo_semente, categoria = v.categoria, renasem = v.renasem,
+                proposito_semente = v.proposito_semente, updated_at = now()
+            FROM (VALUES %s) AS v(id, user_id, produtor_numerocm, fazenda_idfazenda, area, area_hectares, safra_id, tipo,
+                                  cod_unidade_fabril, campo_semente, categoria, renasem, proposito_semente, revisada)
+            WHERE p.id = v.id
+            """,
+            cab_update,
+            template="(%s, %s, %s, %s, %s, %s::numeric, %s, %s, %s, %s, %s, %s, %s::boolean, %s::boolean)",
+            page_size=_PAGINA,
+        )
+        cur.execute("DELETE FROM public.programacao_cultivares WHERE programacao_id = ANY(%s)", [ids_update])
+        cur.execute("DELETE FROM public.programacao_talhoes WHERE programacao_id = ANY(%s)", [ids_update])
+        cur.execute("DELETE FROM public.programacao_adubacao WHERE programacao_id = ANY(%s)", [ids_update])
+    if cab_novas:
+        execute_values(
+            cur,
+            """
+            INSERT INTO public.programacoes (id, user_id, produtor_numerocm, fazenda_idfazenda, area, area_hectares, safra_id, tipo,
+                                             cod_unidade_fabril, campo_semente, categoria, renasem, proposito_semente)
+            VALUES %s
+            """,
+            cab_novas,
+            page_size=_PAGINA,
+        )
+    for sql, rows in (
+        (f"INSERT INTO public.programacao_cultivares ({_COLS_CULTIVAR}) VALUES %s", cultivares),
+        ("INSERT INTO public.programacao_cultivares_tratamentos (id, programacao_cultivar_id, tratamento_id) VALUES %s", tratamentos),
+        ("INSERT INTO public.programacao_cultivares_defensivos (id, programacao_cultivar_id, classe, aplicacao, defensivo, cod_item, dose, cobertura, total, produto_salvo) VALUES %s", defensivos),
+        (f"INSERT INTO public.programacao_adubacao ({_COLS_ADUBACAO}) VALUES %s", adubacao),
+        ("INSERT INTO public.programacao_talhoes (id, programacao_id, talhao_id, safra_id, fazenda_idfazenda, epoca_id) VALUES %s", talhoes),
+    ):
+        if rows:
+            execute_values(cur, sql, rows, page_size=_PAGINA)
+    return resultados
@@ -1,6 +1,7 @@
 import os
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from instrumentation import instrument_engine
 
 _engine = None
 SessionLocal = None
@@ -18,7 +19,7 @@ def get_engine():
     global _engine, SessionLocal
     if _engine is None:
         url = get_database_url()
-        _engine = create_engine(url, pool_pre_ping=True, future=True)
+        _engine = instrument_engine(create_engine(url, pool_pre_ping=True, future=True))
         SessionLocal = sessionmaker(bind=_engine, autoflush=False, autocommit=False, expire_on_commit=False, future=True)
     return _engine
 
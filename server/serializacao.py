@@ -0,0 +1,315 @@
+import json
+import datetime
+from decimal import Decimal
+from json.encoder import encode_basestring, encode_basestring_ascii
+from flask import request, has_request_context
+from flask.json.provider import DefaultJSONProvider, _default
+
+try:
+    import orjson
+except ImportError:  # backend opcional; sem ele usa o json da biblioteca padrão
+    orjson = None
+
+# Serialização das respostas JSON.
+#
+# Linhas(cols, rows) carrega o resultado de um cursor sem montar um dict por
+# linha: o JSON de cada linha é escrito direto das tuplas, com o codificador de
+# cada coluna escolhido uma vez pelo OID do tipo (cur.description). Por padrão
+# a saída é a mesma do DefaultJSONProvider do Flask (NUMERIC como string, datas
+# no formato HTTP); com iso=True datas saem em ISO 8601 e NUMERIC como número,
+# que é o formato das listagens de catálogo.
+#
+# JSONProvider usa orjson quando instalado para o restante do documento e cai
+# para o json padrão em saídas indentadas (modo debug) ou tipos não suportados.
+#
+# Formato colunar (?format=columnar ou Accept: application/vnd.agroplan.columnar+json):
+# toda lista de objetos no primeiro nível da resposta vira
+#   {"columns": [...], "rows": [[...], ...], "dicts": {"coluna": [valores]}}
+# Colunas de texto com poucos valores distintos (cultura, unidade, embalagem...)
+# vão codificadas por dicionário: na linha fica o índice em dicts[coluna].
+
+_DIAS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+_MESES = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+_OID_TEXTO = (19, 25, 1042, 1043)
+_OID_INTEIRO = (20, 21, 23, 26)
+_OID_REAL = (700, 701)
+_OID_BOOL = 16
+_OID_NUMERIC = 1700
+_OID_DATA = (1082, 1114, 1184)
+_OID_UUID = 2950
+
+MIME_COLUNAR = "application/vnd.agroplan.columnar+json"
+DICT_MIN_LINHAS = 32
+DICT_MAX_VALORES = 255
+
+
+def http_date(v):
+    # Mesmo resultado de werkzeug.http.http_date, sem passar por email.utils
+    if isinstance(v, datetime.datetime):
+        if v.tzinfo is not None:
+            v = v.astimezone(datetime.timezone.utc)
+        return f"{_DIAS[v.weekday()]}, {v.day:02d} {_MESES[v.month - 1]} {v.year:04d} {v.hour:02d}:{v.minute:02d}:{v.second:02d} GMT"
+    return f"{_DIAS[v.weekday()]}, {v.day:02d} {_MESES[v.month - 1]} {v.year:04d} 00:00:00 GMT"
+
+
+def formato():
+    """Formato negociado da resposta: "columnar" ou None (lista de objetos)."""
+    if not has_request_context():
+        return None
+    f = request.args.get("format")
+    if f is not None:
+        return "columnar" if f.strip().lower() == "columnar" else None
+    if MIME_COLUNAR in (request.headers.get("Accept") or ""):
+        return "columnar"
+    return None
+
+
+def _padrao(o):
+    if isinstance(o, datetime.date):
+        return http_date(o)
+    if isinstance(o, Linhas):
+        return o.dicts()
+    return _default(o)
+
+
+def _padrao_orjson(o):
+    if isinstance(o, Decimal):
+        return str(o)
+    return _padrao(o)
+
+
+class _Codificador:
+    # Opções do provider (ensure_ascii/sort_keys) + backend para valores avulsos
+    __slots__ = ("sort_keys", "texto", "_ascii")
+
+    def __init__(self, ensure_ascii=True, sort_keys=True):
+        self.sort_keys = sort_keys
+        self._ascii = ensure_ascii
+        self.texto = encode_basestring_ascii if ensure_ascii else encode_basestring
+
+    def dumps(self, obj):
+        if orjson is not None:
+            opt = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+            if self.sort_keys:
+                opt |= orjson.OPT_SORT_KEYS
+            try:
+                return orjson.dumps(obj, default=_padrao_orjson, option=opt).decode("utf-8")
+            except TypeError:
+                pass  # inteiros > 64 bits, chaves mistas etc.: json padrão
+        return json.dumps(obj, default=_padrao, ensure_ascii=self._ascii, sort_keys=self.sort_keys, separators=(",", ":"))
+
+
+def _real(v):
+    s = repr(float(v))
+    return s if s[-1].isdigit() else "null"
+
+
+def _codificador_coluna(oid, iso, enc):
+    if oid in _OID_TEXTO:
+        return enc.texto
+    if oid in _OID_INTEIRO:
+        return str
+    if oid == _OID_BOOL:
+        return lambda v: "true" if v else "false"
+    if oid == _OID_NUMERIC:
+        return _real if iso else (lambda v: '"' + str(v) + '"')
+    if oid in _OID_REAL:
+        return _real
+    if oid in _OID_DATA:
+        return (lambda v: '"' + v.isoformat() + '"') if iso else (lambda v: '"' + http_date(v) + '"')
+    if oid == _OID_UUID:
+        return lambda v: '"' + str(v) + '"'
+    return enc.dumps
+
+
+class Linhas:
+    """Resultado de consulta serializado direto das tuplas.
+
+    extras: {nome: fn(row)} com campos calculados por linha (listas, mapas),
+    codificados pelo backend. len() e iteração (dicts) continuam disponíveis.
+    """
+
+    __slots__ = ("cols", "rows", "tipos", "extras", "iso")
+
+    def __init__(self, cols, rows, tipos=None, extras=None, iso=False):
+        self.cols = list(cols)
+        self.rows = rows
+        self.tipos = list(tipos) if tipos is not None else [None] * len(self.cols)
+        self.extras = extras or {}
+        self.iso = iso
+
+    @classmethod
+    def de_dicts(cls, items):
+        cols = {}
+        for d in items:
+            for k in d:
+                cols.setdefault(k, None)
+        cols = list(cols)
+        return cls(cols, [tuple(d.get(c) for c in cols) for d in items])
+
+    @classmethod
+    def do_cursor(cls, cur, rows=None, extras=None, iso=False):
+        desc = cur.description
+        return cls([d[0] for d in desc], cur.fetchall() if rows is None else rows, [d[1] for d in desc], extras, iso)
+
+    def indice(self, col):
+        return self.cols.index(col)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.dicts())
+
+    def dicts(self):
+        convs = []
+        if self.iso:
+            for i, oid in enumerate(self.tipos):
+                if oid in _OID_DATA:
+                    convs.append((i, lambda v: v.isoformat() if v is not None else None))
+                elif oid == _OID_NUMERIC or oid in _OID_REAL:
+                    convs.append((i, lambda v: float(v) if v is not None else None))
+        out = []
+        for r in self.rows:
+            if convs:
+                r = list(r)
+                for i, conv in convs:
+                    r[i] = conv(r[i])
+            d = dict(zip(self.cols, r))
+            for nome, fn in self.extras.items():
+                d[nome] = fn(r)
+            out.append(d)
+        return out
+
+    def colunar(self, dicionario=True):
+        """{"columns", "rows", "dicts"} com os valores já no formato de saída."""
+        idx = {c: i for i, c in enumerate(self.cols) if c not in self.extras}
+        cols = list(idx) + list(self.extras)
+        pos = list(idx.values())
+        convs = []
+        dicts = {}
+        n = len(self.rows)
+        for j, i in enumerate(pos):
+            oid = self.tipos[i]
+            if oid == _OID_NUMERIC:
+                convs.append((j, float if self.iso else str))
+            elif oid in _OID_DATA:
+                convs.append((j, (lambda v: v.isoformat()) if self.iso else http_date))
+            elif oid == _OID_UUID:
+                convs.append((j, str))
+            elif dicionario and n >= DICT_MIN_LINHAS and (oid in _OID_TEXTO or oid is None):
+                valores = {}
+                for r in self.rows:
+                    v = r[i]
+                    if v is not None:
+                        if oid is None and not isinstance(v, str):
+                            valores = None
+                            break
+                        if v not in valores:
+                            valores[v] = len(valores)
+                            if len(valores) > DICT_MAX_VALORES:
+                                break
+                if valores and len(valores) <= min(DICT_MAX_VALORES, n // 4):
+                    dicts[cols[j]] = list(valores)
+                    convs.append((j, valores.__getitem__))
+        calc = list(self.extras.values())
+        rows = []
+        for r in self.rows:
+            linha = [r[i] for i in pos]
+            for j, conv in convs:
+                v = linha[j]
+                if v is not None:
+                    linha[j] = conv(v)
+            for fn in calc:
+                linha.append(fn(r))
+            rows.append(linha)
+        return {"columns": cols, "rows": rows, "dicts": dicts}
+
+    def json(self, enc):
+        # Colunas repetidas (ex.: pc.* + alias) ficam com a última, como no dict(zip())
+        idx = {c: i for i, c in enumerate(self.cols) if c not in self.extras}
+        nomes = list(idx) + list(self.extras)
+        if enc.sort_keys:
+            nomes.sort()
+        campos = []
+        for n, nome in enumerate(nomes):
+            prefixo = ("" if n == 0 else ",") + enc.texto(nome) + ":"
+            if nome in idx:
+                i = idx[nome]
+                campos.append((prefixo, i, _codificador_coluna(self.tipos[i], self.iso, enc)))
+            else:
+                campos.append((prefixo, None, self.extras[nome]))
+        partes = []
+        for r in self.rows:
+            s = ["{"]
+            for prefixo, i, f in campos:
+                s.append(prefixo)
+                if i is None:
+                    s.append(enc.dumps(f(r)))
+                else:
+                    v = r[i]
+                    s.append("null" if v is None else f(v))
+            s.append("}")
+            partes.append("".join(s))
+        return "[" + ",".join(partes) + "]"
+
+
+def _tabela(v):
+    return isinstance(v, Linhas) or (isinstance(v, list) and all(isinstance(d, dict) for d in v))
+
+
+def colunarizar(obj, dicionario=True):
+    """Converte as listas de objetos do primeiro nível para o formato colunar."""
+    if isinstance(obj, Linhas):
+        return obj.colunar(dicionario)
+    if isinstance(obj, list) and _tabela(obj):
+        return Linhas.de_dicts(obj).colunar(dicionario)
+    if isinstance(obj, dict) and any(_tabela(v) for v in obj.values()):
+        return {k: (colunarizar(v, dicionario) if _tabela(v) else v) for k, v in obj.items()}
+    return obj
+
+
+def _tem_linhas(obj):
+    # Linhas em qualquer nível de dicts aninhados (/bootstrap, /sync/changes)
+    if isinstance(obj, Linhas):
+        return True
+    return isinstance(obj, dict) and any(_tem_linhas(v) for v in obj.values())
+
+
+def _compor(obj, enc):
+    if isinstance(obj, Linhas):
+        return obj.json(enc)
+    if isinstance(obj, dict) and _tem_linhas(obj):
+        chaves = sorted(obj, key=str) if enc.sort_keys else list(obj)
+        return "{" + ",".join(enc.texto(str(k)) + ":" + _compor(obj[k], enc) for k in chaves) + "}"
+    return enc.dumps(obj)
+
+
+class JSONProvider(DefaultJSONProvider):
+    default = staticmethod(_padrao)
+
+    def response(self, *args, **kwargs):
+        resp = super().response(*args, **kwargs)
+        if has_request_context():
+            resp.vary.add("Accept")
+            if formato() == "columnar" and MIME_COLUNAR in (request.headers.get("Accept") or ""):
+                resp.mimetype = MIME_COLUNAR
+        return resp
+
+    def dumps(self, obj, **kwargs):
+        # Saída compacta (respostas): caminho rápido. Demais formatos (indent,
+        # separadores padrão do json.dumps): DefaultJSONProvider com Linhas -> dicts.
+        if formato() == "columnar":
+            obj = colunarizar(obj, request.args.get("dict") not in ("0", "false"))
+        if set(kwargs) <= {"separators"} and kwargs.get("separators") == (",", ":"):
+            return _compor(obj, _Codificador(self.ensure_ascii, self.sort_keys))
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            try:
+                return orjson.loads(s)
+            except orjson.JSONDecodeError:
+                pass  # mesma exceção/mensagem do json padrão
+        return super().loads(s, **kwargs)
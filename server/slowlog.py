@@ -0,0 +1,240 @@
+import os
+import re
+import time
+import queue
+import hashlib
+import threading
+from collections import deque
+import instrumentation
+
+# Log de queries lentas agrupadas por fingerprint.
+# O SQL é normalizado (literais, placeholders, listas IN/VALUES e espaços) para
+# que as queries montadas com f-string nos relatórios caiam no mesmo grupo.
+# Fingerprints novos ou que regridem disparam um EXPLAIN em thread separada.
+
+RING_SIZE = 500
+REGRESSAO_FATOR = 2.0
+REGRESSAO_MIN_CHAMADAS = 5
+EXPLAIN_INTERVALO_SEG = 600
+CONFIG_INTERVALO_SEG = 60
+
+_lock = threading.Lock()
+_recent = deque(maxlen=RING_SIZE)
+_stats = {}
+_explain_queue = queue.Queue(maxsize=50)
+_local = threading.local()
+_state = {
+    "threshold_ms": float(os.environ.get("AGROPLAN_SLOW_QUERY_MS", "200")),
+    "worker": None,
+}
+
+_RE_COMMENT = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_RE_STRING = re.compile(r"'(?:[^']|'')*'")
+_RE_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_RE_PARAM = re.compile(r"%\(\w+\)s|%s|\$\d+")
+_RE_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_RE_VALUES = re.compile(r"(values\s*\(\s*[^()]*\))(\s*,\s*\([^()]*\))+", re.I)
+_RE_SPACES = re.compile(r"\s+")
+# Escrita (inclusive em CTE), travas de linha e funções com efeito colateral:
+# EXPLAIN ANALYZE executaria de novo contra as tabelas reais
+_RE_EFEITO = re.compile(
+    r"\b(insert|update|delete|merge|truncate|into|nextval|setval|pg_notify|pg_advisory\w*)\b"
+    r"|\bfor\s+(no\s+key\s+update|key\s+share|share)\b"
+)
+
+
+def normalize(sql):
+    if isinstance(sql, bytes):
+        sql = sql.decode("utf-8", errors="ignore")
+    s = _RE_COMMENT.sub(" ", str(sql))
+    s = _RE_STRING.sub("?", s)
+    s = _RE_PARAM.sub("?", s)
+    s = _RE_NUMBER.sub("?", s)
+    s = _RE_VALUES.sub(r"\1", s)
+    s = _RE_IN_LIST.sub("(...)", s)
+    return _RE_SPACES.sub(" ", s).strip().lower()
+
+
+def fingerprint(sql):
+    norm = normalize(sql)
+    return hashlib.md5(norm.encode("utf-8")).hexdigest()[:16], norm
+
+
+def _params_shape(params):
+    # Só tipos/tamanhos: valores de parâmetros não são guardados
+    def one(v):
+        if isinstance(v, (list, tuple)):
+            return f"{type(v).__name__}[{len(v)}]"
+        return type(v).__name__
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {k: one(v) for k, v in params.items()}
+    if isinstance(params, (list, tuple)):
+        return [one(v) for v in params]
+    return one(params)
+
+
+def _explainable(sql):
+    # Só leituras puras passam por ANALYZE; o resto recebe EXPLAIN simples
+    norm = normalize(sql)
+    if not (norm.startswith("select") or norm.startswith("with")):
+        return False
+    return _RE_EFEITO.search(norm) is None
+
+
+def on_query(duration, sql, params):
+    if sql is None or getattr(_local, "busy", False):
+        return
+    ms = duration * 1000.0
+    if ms < _state["threshold_ms"]:
+        return
+    fp, norm = fingerprint(sql)
+    st = instrumentation.current_stats()
+    endpoint = st.endpoint if st is not None else None
+    now = time.time()
+    entry = {
+        "fingerprint": fp,
+        "duration_ms": round(ms, 1),
+        "endpoint": endpoint,
+        "params_shape": _params_shape(params),
+        "at": now,
+    }
+    want_explain = False
+    with _lock:
+        _recent.append(entry)
+        agg = _stats.get(fp)
+        if agg is None:
+            agg = _stats[fp] = {
+                "fingerprint": fp,
+                "query": norm[:2000],
+                "calls": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "endpoints": {},
+                "first_seen": now,
+                "last_seen": now,
+                "explain": None,
+                "explained_at": None,
+                "explain_reason": None,
+            }
+            want_explain = "novo"
+        elif (
+            agg["calls"] >= REGRESSAO_MIN_CHAMADAS
+            and ms > REGRESSAO_FATOR * (agg["total_ms"] / agg["calls"])
+            and (agg["explained_at"] is None or now - agg["explained_at"] > EXPLAIN_INTERVALO_SEG)
+        ):
+            want_explain = "regressao"
+        agg["calls"] += 1
+        agg["total_ms"] += ms
+        agg["max_ms"] = max(agg["max_ms"], ms)
+        agg["last_seen"] = now
+        if endpoint:
+            agg["endpoints"][endpoint] = agg["endpoints"].get(endpoint, 0) + 1
+        if want_explain:
+            agg["explained_at"] = now
+    # executemany do SQLAlchemy (lista de dicts) não tem um plano único para capturar
+    batch = isinstance(params, list) and bool(params) and isinstance(params[0], dict)
+    if want_explain and not batch:
+        try:
+            _explain_queue.put_nowait((fp, sql, params, want_explain))
+        except queue.Full:
+            pass
+
+
+def _run_explain(cur, sql, params):
+    analyze = _explainable(sql)
+    opts = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+    cur.execute("SET LOCAL statement_timeout = '30s'")
+    cur.execute(f"EXPLAIN ({opts}) " + (sql.decode("utf-8") if isinstance(sql, bytes) else sql), params)
+    return cur.fetchone()[0], analyze
+
+
+def _refresh_threshold():
+    from db import get_config_map
+    cfg = get_config_map(["slow_query_threshold_ms"])
+    val = cfg.get("slow_query_threshold_ms")
+    if val:
+        _state["threshold_ms"] = float(str(val).replace(",", "."))
+
+
+def _worker():
+    from db import get_pool
+    _local.busy = True
+    last_cfg = 0.0
+    while True:
+        try:
+            item = _explain_queue.get(timeout=CONFIG_INTERVALO_SEG)
+        except queue.Empty:
+            item = None
+        if time.time() - last_cfg >= CONFIG_INTERVALO_SEG:
+            last_cfg = time.time()
+            try:
+                _refresh_threshold()
+            except Exception:
+                pass
+        if item is None:
+            continue
+        fp, sql, params, reason = item
+        pool = get_pool()
+        conn = pool.getconn()
+        try:
+            with conn.cursor() as cur:
+                plan, analyze = _run_explain(cur, sql, params)
+            result = {"plan": plan, "analyze": analyze}
+        except Exception as e:
+            result = {"error": str(e)}
+        finally:
+            # EXPLAIN ANALYZE executa a query: sempre descartar
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            pool.putconn(conn)
+        with _lock:
+            agg = _stats.get(fp)
+            if agg is not None:
+                agg["explain"] = result
+                agg["explain_reason"] = reason
+
+
+def start():
+    if _state["worker"] is not None:
+        return
+    t = threading.Thread(target=_worker, name="slowlog-explain", daemon=True)
+    _state["worker"] = t
+    instrumentation.add_query_hook(on_query)
+    t.start()
+
+
+def get_threshold_ms():
+    return _state["threshold_ms"]
+
+
+def set_threshold_ms(value):
+    _state["threshold_ms"] = float(value)
+
+
+def top(limit=20, order="total"):
+    key = {"total": "total_ms", "max": "max_ms", "calls": "calls"}.get(order, "total_ms")
+    with _lock:
+        items = [dict(a, endpoints=dict(a["endpoints"])) for a in _stats.values()]
+    for a in items:
+        a["mean_ms"] = round(a["total_ms"] / a["calls"], 1) if a["calls"] else None
+        a["total_ms"] = round(a["total_ms"], 1)
+        a["max_ms"] = round(a["max_ms"], 1)
+    items.sort(key=lambda a: a[key], reverse=True)
+    return items[:limit]
+
+
+def recent(limit=100):
+    with _lock:
+        items = list(_recent)[-limit:]
+    items.reverse()
+    return items
+
+
+def reset():
+    with _lock:
+        _recent.clear()
+        _stats.clear()
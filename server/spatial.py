@@ -0,0 +1,243 @@
+import threading
+import time
+import numpy as np
+from db import get_pool
+from geometry import polygons_from_geojson
+
+# Índice espacial em memória (por worker) dos talhões com KML.
+# Grade regular sobre os bboxes armazenados (bbox_min_lat ... bbox_max_lng):
+# cada célula guarda os ids cujos bboxes a tocam. A consulta por ponto olha uma
+# única célula e refina com ponto-em-polígono; a consulta por viewport percorre
+# as células cobertas e filtra por interseção de bbox.
+# O índice é construído na primeira consulta, atualizado incrementalmente no
+# upload/remoção de KML deste worker (só depois do commit: um rollback não
+# deixa o índice divergente da tabela) e reconstruído quando a assinatura da
+# tabela (contagem + último upload) muda por ação de outro worker.
+
+CELULA_GRAUS = 0.05
+VERIFICACAO_SEG = 30
+
+
+def _point_in_polygon(lng, lat, rings):
+    # Regra par-ímpar sobre todos os anéis: furos são tratados naturalmente
+    inside = False
+    for ring in rings:
+        x = ring[:, 0]
+        y = ring[:, 1]
+        xn = np.roll(x, -1)
+        yn = np.roll(y, -1)
+        crosses = (y > lat) != (yn > lat)
+        if not crosses.any():
+            continue
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_int = x[crosses] + (lat - y[crosses]) * (xn[crosses] - x[crosses]) / (yn[crosses] - y[crosses])
+        if int(np.count_nonzero(lng < x_int)) % 2 == 1:
+            inside = not inside
+    return inside
+
+
+def _rings_from_geojson(geojson):
+    polys = []
+    for poly in polygons_from_geojson(geojson):
+        rings = []
+        for ring in poly or []:
+            pts = [p[:2] for p in (ring or []) if p is not None and len(p) >= 2]
+            if len(pts) >= 3:
+                rings.append(np.asarray(pts, dtype=np.float64))
+        if rings:
+            polys.append(rings)
+    return polys
+
+
+class TalhaoSpatialIndex:
+    def __init__(self, cell_deg=CELULA_GRAUS):
+        self.cell = float(cell_deg)
+        self._lock = threading.RLock()
+        self._grid = {}
+        self._entries = {}
+        self._signature = None
+        self._checked_at = 0.0
+        self._built = False
+
+    def _cells(self, bbox):
+        min_lat, min_lng, max_lat, max_lng = bbox
+        i0 = int(np.floor(min_lng / self.cell))
+        i1 = int(np.floor(max_lng / self.cell))
+        j0 = int(np.floor(min_lat / self.cell))
+        j1 = int(np.floor(max_lat / self.cell))
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                yield (i, j)
+
+    def _remove_locked(self, talhao_id):
+        old = self._entries.pop(talhao_id, None)
+        if not old:
+            return
+        for c in self._cells(old["bbox"]):
+            bucket = self._grid.get(c)
+            if bucket is not None:
+                bucket.discard(talhao_id)
+                if not bucket:
+                    del self._grid[c]
+
+    def _add_locked(self, talhao_id, fazenda_id, bbox, geojson):
+        if any(v is None for v in bbox):
+            return
+        bbox = tuple(float(v) for v in bbox)
+        self._entries[talhao_id] = {
+            "fazenda_id": fazenda_id,
+            "bbox": bbox,
+            "polys": _rings_from_geojson(geojson),
+        }
+        for c in self._cells(bbox):
+            self._grid.setdefault(c, set()).add(talhao_id)
+
+    def _read_signature(self, cur):
+        cur.execute(
+            "SELECT COUNT(*), MAX(kml_uploaded_at) FROM public.talhoes WHERE bbox_min_lat IS NOT NULL"
+        )
+        r = cur.fetchone()
+        return (r[0], str(r[1]) if r[1] is not None else None)
+
+    def rebuild(self):
+        pool = get_pool()
+        conn = pool.getconn()
+        try:
+            with conn.cursor() as cur:
+                sig = self._read_signature(cur)
+                cur.execute(
+                    """
+                    SELECT id, fazenda_id, bbox_min_lat, bbox_min_lng, bbox_max_lat, bbox_max_lng, geojson
+                    FROM public.talhoes
+                    WHERE bbox_min_lat IS NOT NULL
+                    """
+                )
+                rows = cur.fetchall()
+        finally:
+            pool.putconn(conn)
+        with self._lock:
+            self._grid = {}
+            self._entries = {}
+            for r in rows:
+                self._add_locked(r[0], r[1], (r[2], r[3], r[4], r[5]), r[6])
+            self._signature = sig
+            self._checked_at = time.time()
+            self._built = True
+
+    def ensure_fresh(self):
+        if not self._built:
+            self.rebuild()
+            return
+        if time.time() - self._checked_at < VERIFICACAO_SEG:
+            return
+        pool = get_pool()
+        conn = pool.getconn()
+        try:
+            with conn.cursor() as cur:
+                sig = self._read_signature(cur)
+        finally:
+            pool.putconn(conn)
+        if sig != self._signature:
+            self.rebuild()
+        else:
+            self._checked_at = time.time()
+
+    def assinatura(self, cur):
+        # Lida na transação que altera o talhão, antes e depois da alteração;
+        # as duas são passadas a upsert/remove depois do commit
+        return self._read_signature(cur)
+
+    def _adotar_locked(self, antes, depois):
+        # A assinatura nova só vale se antes da escrita o índice estava em dia;
+        # se outro worker alterou a tabela nesse meio tempo, a assinatura fica
+        # velha e a próxima verificação reconstrói o índice
+        if antes is not None and depois is not None and antes == self._signature:
+            self._signature = depois
+            self._checked_at = time.time()
+        else:
+            self._checked_at = 0.0
+
+    def upsert(self, talhao_id, fazenda_id, bbox, geojson, antes=None, depois=None):
+        # Chamar só depois do commit do upload
+        if not self._built:
+            return
+        with self._lock:
+            self._remove_locked(talhao_id)
+            self._add_locked(talhao_id, fazenda_id, bbox, geojson)
+            self._adotar_locked(antes, depois)
+
+    def remove(self, talhao_id, antes=None, depois=None):
+        # Chamar só depois do commit da exclusão
+        if not self._built:
+            return
+        with self._lock:
+            self._remove_locked(talhao_id)
+            self._adotar_locked(antes, depois)
+
+    def at(self, lat, lng):
+        self.ensure_fresh()
+        with self._lock:
+            cell = (int(np.floor(lng / self.cell)), int(np.floor(lat / self.cell)))
+            hits = []
+            for tid in self._grid.get(cell, ()):
+                e = self._entries[tid]
+                min_lat, min_lng, max_lat, max_lng = e["bbox"]
+                if not (min_lat <= lat <= max_lat and min_lng <= lng <= max_lng):
+                    continue
+                if any(_point_in_polygon(lng, lat, rings) for rings in e["polys"]):
+                    hits.append(tid)
+            return hits
+
+    def in_bbox(self, min_lat, min_lng, max_lat, max_lng, limit=None):
+        self.ensure_fresh()
+        return self._query_bbox(min_lat, min_lng, max_lat, max_lng, limit)
+
+    def _query_bbox(self, min_lat, min_lng, max_lat, max_lng, limit=None):
+        with self._lock:
+            n_cells = (
+                (int(np.floor(max_lng / self.cell)) - int(np.floor(min_lng / self.cell)) + 1)
+                * (int(np.floor(max_lat / self.cell)) - int(np.floor(min_lat / self.cell)) + 1)
+            )
+            # Viewport muito grande (zoom afastado): varrer as entradas sai mais barato que as células
+            if n_cells > len(self._grid):
+                pool_ids = self._entries.keys()
+            else:
+                pool_ids = (tid for c in self._cells((min_lat, min_lng, max_lat, max_lng)) for tid in self._grid.get(c, ()))
+            found = []
+            seen = set()
+            for tid in pool_ids:
+                if tid in seen:
+                    continue
+                seen.add(tid)
+                b = self._entries[tid]["bbox"]
+                if b[0] <= max_lat and b[2] >= min_lat and b[1] <= max_lng and b[3] >= min_lng:
+                    found.append(tid)
+                    if limit and len(found) >= limit:
+                        break
+            return found
+
+    def candidates(self, talhao_id, bbox=None):
+        # Vizinhos cujo bbox intersecta o do talhão (poda para a análise de sobreposição);
+        # bbox informa a geometria nova de um talhão ainda não aplicada ao índice
+        if bbox is None:
+            e = self._entries.get(talhao_id)
+            if not e:
+                return []
+            bbox = e["bbox"]
+        return [t for t in self._query_bbox(*bbox) if t != talhao_id]
+
+    def polygons(self, talhao_id):
+        # Anéis (lon, lat) do talhão já carregados no índice
+        e = self._entries.get(talhao_id)
+        return e["polys"] if e else []
+
+    def ids(self):
+        with self._lock:
+            return list(self._entries.keys())
+
+    def stats(self):
+        with self._lock:
+            return {"talhoes": len(self._entries), "celulas": len(self._grid), "celula_graus": self.cell}
+
+
+talhao_index = TalhaoSpatialIndex()
@@ -0,0 +1,265 @@
+import re
+import time
+from db import TABLE_CHANGES_CHANNEL
+
+# Substituição completa de tabela ("limpar antes") sem DELETE em massa.
+# A carga vai para uma tabela sombra (LIKE ... INCLUDING ALL) fora de qualquer
+# lock da tabela real. Antes de copiar da tabela atual as colunas que a carga
+# não traz (ids, flags editadas no app, geometria), preservar() pega SHARE ROW
+# EXCLUSIVE nela: leituras seguem, mas nenhuma escrita commita entre a cópia,
+# a validação e a troca (senão seria perdida ou escaparia da validação); os
+# validadores travam do mesmo jeito as tabelas de referência que consultam.
+# A troca sobe para ACCESS EXCLUSIVE, que bloqueia também as leituras até o
+# commit, enquanto conta as linhas que saíram, aplica o ON DELETE das FKs que
+# apontam para a tabela (varreduras NOT EXISTS, DELETE em cascata e DROP das
+# FKs nas tabelas que referenciam), renomeia e recria triggers, grants e nomes
+# de índices/constraints. As FKs voltam NOT VALID e são validadas depois do
+# commit, sem bloquear leitura nem escrita.
+
+LOCK_TIMEOUT = "5s"
+LOCK_TENTATIVAS = 3
+SUFIXO = "__novo"
+SUFIXO_ANTIGO = "__antigo"
+
+_RE_INDEXDEF = re.compile(r"INDEX \S+ ON \S+ ")
+
+
+class SubstituicaoRecusada(ValueError):
+    pass
+
+
+def _colunas(cur, tabela):
+    cur.execute(
+        "SELECT column_name FROM information_schema.columns WHERE table_schema = 'public' AND table_name = %s ORDER BY ordinal_position",
+        [tabela],
+    )
+    return [r[0] for r in cur.fetchall()]
+
+
+def _igual(chave, a="s", b="o"):
+    # COALESCE em vez de IS NOT DISTINCT FROM para o planner poder usar hash join (chaves TEXT)
+    return " AND ".join(f"COALESCE({a}.{c}, '') = COALESCE({b}.{c}, '')" for c in chave)
+
+
+def criar_sombra(cur, tabela):
+    sombra = tabela + SUFIXO
+    # Uma substituição por tabela de cada vez (a sombra tem nome fixo)
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [f"swap:{tabela}"])
+    cur.execute(f"DROP TABLE IF EXISTS public.{sombra}")
+    cur.execute(f"CREATE TABLE public.{sombra} (LIKE public.{tabela} INCLUDING ALL)")
+    return sombra
+
+
+def preservar(cur, tabela, sombra, chave, carregadas):
+    # Copia da tabela atual as colunas que a carga não preencheu (inclusive o id,
+    # para manter referências). Com chave repetida só a primeira linha herda.
+    # Daqui até o commit da troca nenhuma escrita na tabela atual é aceita.
+    travar(cur, tabela, "SHARE ROW EXCLUSIVE")
+    colunas = _colunas(cur, tabela)
+    manter = [c for c in colunas if c not in chave and c not in carregadas and c != "updated_at"]
+    if not manter:
+        return 0
+    k = ", ".join(chave)
+    ordem = k + (", created_at" if "created_at" in colunas else "")
+    sets = ", ".join(f"{c} = o.{c}" for c in manter)
+    cur.execute(
+        f"""
+        UPDATE public.{sombra} s SET {sets}
+        FROM (SELECT DISTINCT ON ({k}) * FROM public.{tabela} ORDER BY {ordem}) o
+        WHERE {_igual(chave)}
+          AND s.ctid IN (SELECT DISTINCT ON ({k}) ctid FROM public.{sombra} ORDER BY {k}, ctid)
+        """
+    )
+    return cur.rowcount
+
+
+def _fks_para(cur, tabela):
+    cur.execute(
+        """
+        SELECT c.conname, r.relname, pg_get_constraintdef(c.oid), c.confdeltype,
+               ARRAY(SELECT a.attname::text FROM unnest(c.conkey) WITH ORDINALITY k(n, i)
+                     JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = k.n ORDER BY k.i),
+               ARRAY(SELECT a.attname::text FROM unnest(c.confkey) WITH ORDINALITY k(n, i)
+                     JOIN pg_attribute a ON a.attrelid = c.confrelid AND a.attnum = k.n ORDER BY k.i)
+        FROM pg_constraint c
+        JOIN pg_class r ON r.oid = c.conrelid
+        WHERE c.contype = 'f' AND c.confrelid = %s::regclass AND c.conrelid <> c.confrelid
+        """,
+        [f"public.{tabela}"],
+    )
+    return cur.fetchall()
+
+
+def _indices(cur, tabela):
+    cur.execute(
+        """
+        SELECT ic.relname, pg_get_indexdef(i.indexrelid), con.conname
+        FROM pg_index i
+        JOIN pg_class ic ON ic.oid = i.indexrelid
+        LEFT JOIN pg_constraint con ON con.conindid = i.indexrelid AND con.conrelid = i.indrelid
+        WHERE i.indrelid = %s::regclass
+        """,
+        [f"public.{tabela}"],
+    )
+    return [(nome, _RE_INDEXDEF.sub("INDEX ON ", d), con) for nome, d, con in cur.fetchall()]
+
+
+def travar(cur, tabela, modo="ACCESS EXCLUSIVE"):
+    # Lock até o fim da transação, com lock_timeout e novas tentativas para não
+    # enfileirar as demais sessões atrás de uma espera longa
+    cur.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+    for tentativa in range(LOCK_TENTATIVAS):
+        cur.execute("SAVEPOINT swap_lock")
+        try:
+            cur.execute(f"LOCK TABLE public.{tabela} IN {modo} MODE")
+            cur.execute("RELEASE SAVEPOINT swap_lock")
+            return
+        except Exception:
+            cur.execute("ROLLBACK TO SAVEPOINT swap_lock")
+            if tentativa == LOCK_TENTATIVAS - 1:
+                raise
+            time.sleep(0.5 * (tentativa + 1))
+
+
+def _tombstones(cur, tabela, sombra):
+    # A troca não dispara o trigger de DELETE: registra para a sincronização
+    # incremental as linhas que saíram (pela chave primária, como o trigger)
+    cur.execute(
+        "SELECT 1 FROM pg_trigger WHERE tgrelid = %s::regclass AND tgname = %s",
+        [f"public.{tabela}", f"{tabela}_sync_tombstone"],
+    )
+    if cur.fetchone() is None:
+        return
+    cur.execute(
+        """
+        SELECT a.attname FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+        WHERE i.indrelid = %s::regclass AND i.indisprimary
+        ORDER BY array_position(i.indkey::int2[], a.attnum)
+        """,
+        [f"public.{tabela}"],
+    )
+    pk = [r[0] for r in cur.fetchall()]
+    if not pk:
+        return
+    campos = ", ".join(f"'{c}', o.{c}" for c in pk)
+    # Pela PK e não pela chave de negócio: se a carga gerou ids novos, o
+    # cliente precisa apagar também as linhas com o id antigo
+    igual = " AND ".join(f"s.{c} = o.{c}" for c in pk)
+    cur.execute(
+        f"""
+        INSERT INTO public.sync_tombstones (tabela, chave)
+        SELECT %s, jsonb_build_object({campos}) FROM public.{tabela} o
+        WHERE NOT EXISTS (SELECT 1 FROM public.{sombra} s WHERE {igual})
+        """,
+        [tabela],
+    )
+
+
+def trocar(cur, tabela, sombra, chave, min_linhas=1, validar=None):
+    """Valida a sombra e a coloca no lugar de `tabela`.
+
+    Retorna (resumo, fks_pendentes); passe fks_pendentes para validar_fks
+    depois do commit.
+    """
+    # Normalmente já obtido em preservar(); a validação precisa ver o estado final
+    travar(cur, tabela, "SHARE ROW EXCLUSIVE")
+    cur.execute(f"SELECT COUNT(*) FROM public.{sombra}")
+    linhas = cur.fetchone()[0] or 0
+    if linhas < min_linhas:
+        raise SubstituicaoRecusada(f"substituição de {tabela} recusada: carga com {linhas} linhas")
+    if validar is not None:
+        validar(cur, sombra)
+    cur.execute(f"ANALYZE public.{sombra}")
+
+    travar(cur, tabela)
+    cur.execute(f"SELECT COUNT(*) FROM public.{tabela} o WHERE NOT EXISTS (SELECT 1 FROM public.{sombra} s WHERE {_igual(chave)})")
+    removidos = cur.fetchone()[0] or 0
+    _tombstones(cur, tabela, sombra)
+
+    # FKs que apontam para a tabela: aplica a ação de ON DELETE nas linhas que saíram e remove a FK
+    fks = _fks_para(cur, tabela)
+    pendentes = []
+    for conname, ref, definicao, acao, cols, refcols in fks:
+        orfas = " AND ".join(f"x.{c} IS NOT NULL" for c in cols) + " AND NOT EXISTS (SELECT 1 FROM public." + sombra + " s WHERE " + " AND ".join(f"s.{rc} = x.{c}" for c, rc in zip(cols, refcols)) + ")"
+        if acao == "c":
+            cur.execute(f"DELETE FROM public.{ref} x WHERE {orfas}")
+        elif acao == "n":
+            cur.execute(f"UPDATE public.{ref} x SET " + ", ".join(f"{c} = NULL" for c in cols) + f" WHERE {orfas}")
+        else:
+            cur.execute(f"SELECT COUNT(*) FROM public.{ref} x WHERE {orfas}")
+            n = cur.fetchone()[0] or 0
+            if n:
+                raise SubstituicaoRecusada(f"substituição de {tabela} recusada: {n} linhas de {ref} ficariam sem referência ({conname})")
+        cur.execute(f"ALTER TABLE public.{ref} DROP CONSTRAINT {conname}")
+        pendentes.append((ref, conname, definicao))
+
+    cur.execute(
+        "SELECT pg_get_triggerdef(oid) FROM pg_trigger WHERE tgrelid = %s::regclass AND NOT tgisinternal",
+        [f"public.{tabela}"],
+    )
+    triggers = [r[0] for r in cur.fetchall()]
+    cur.execute(
+        """
+        SELECT grantee, privilege_type FROM information_schema.role_table_grants
+        WHERE table_schema = 'public' AND table_name = %s AND grantee <> current_user
+        """,
+        [tabela],
+    )
+    grants = cur.fetchall()
+    antigos = _indices(cur, tabela)
+    novos = _indices(cur, sombra)
+    # Sequências de colunas serial pertencem à tabela antiga e sumiriam no DROP
+    cur.execute(
+        """
+        SELECT s.relname, a.attname FROM pg_depend d
+        JOIN pg_class s ON s.oid = d.objid AND s.relkind = 'S'
+        JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid
+        WHERE d.refobjid = %s::regclass AND d.deptype = 'a'
+        """,
+        [f"public.{tabela}"],
+    )
+    sequencias = cur.fetchall()
+
+    antigo = tabela + SUFIXO_ANTIGO
+    cur.execute(f"ALTER TABLE public.{tabela} RENAME TO {antigo}")
+    cur.execute(f"ALTER TABLE public.{sombra} RENAME TO {tabela}")
+    for seq, col in sequencias:
+        cur.execute(f"ALTER SEQUENCE public.{seq} OWNED BY public.{tabela}.{col}")
+    cur.execute(f"DROP TABLE public.{antigo}")
+
+    # Índices/constraints da sombra voltam aos nomes originais (os ensure_* usam IF NOT EXISTS por nome)
+    livres = list(antigos)
+    for nome, definicao, con in novos:
+        par = next((a for a in livres if a[1] == definicao and bool(a[2]) == bool(con)), None)
+        if par is None:
+            continue
+        livres.remove(par)
+        if con:
+            cur.execute(f"ALTER TABLE public.{tabela} RENAME CONSTRAINT {con} TO {par[2]}")
+        else:
+            cur.execute(f"ALTER INDEX public.{nome} RENAME TO {par[0]}")
+    for definicao in triggers:
+        cur.execute(definicao)
+    for grantee, priv in grants:
+        cur.execute(f'GRANT {priv} ON public.{tabela} TO "{grantee}"')
+    for ref, conname, definicao in pendentes:
+        cur.execute(f"ALTER TABLE public.{ref} ADD CONSTRAINT {conname} {definicao} NOT VALID")
+
+    # A carga foi na sombra, sem o trigger de versão: avisa os caches de catálogo
+    cur.execute("SELECT to_regclass('public.table_version_deltas')")
+    if cur.fetchone()[0] is not None:
+        cur.execute("INSERT INTO public.table_version_deltas (table_name) VALUES (%s)", [tabela])
+        cur.execute("SELECT pg_notify(%s, %s)", [TABLE_CHANGES_CHANNEL, tabela])
+    return {"linhas": linhas, "removidos": removidos}, pendentes
+
+
+def validar_fks(conn, pendentes):
+    # VALIDATE CONSTRAINT só pega SHARE UPDATE EXCLUSIVE: roda depois do commit da troca
+    for ref, conname, _definicao in pendentes or []:
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(f"ALTER TABLE public.{ref} VALIDATE CONSTRAINT {conname}")
+        except Exception as e:
+            print(f"[swap] falha ao validar {ref}.{conname}: {e}")
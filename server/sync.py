@@ -0,0 +1,205 @@
+import os
+import time
+import datetime
+from flask import request
+from db import ensure_sync_schema
+from serializacao import Linhas
+
+# Sincronização incremental para uso offline.
+#
+# Cursor: instante (ISO 8601) abaixo do qual todas as alterações já estavam
+# commitadas quando a resposta foi montada: o menor entre now() e o início das
+# transações ainda abertas no banco. Como updated_at (trigger sync_touch) e
+# deleted_at recebem o now() da transação que escreve, qualquer alteração que
+# não estava visível tem carimbo >= cursor e volta na próxima sincronização.
+# Linhas podem vir repetidas entre duas sincronizações; o cliente aplica
+# "deleted" e depois "items" como upsert pela chave.
+#
+# Exclusões ficam em sync_tombstones por RETENCAO_DIAS; um cursor mais antigo
+# que isso recebe "reset": true e a coleção completa.
+
+RETENCAO_DIAS = int(os.environ.get("AGROPLAN_SYNC_TOMBSTONE_DIAS", "30"))
+
+CATALOGOS = (
+    "defensivos_catalog", "fertilizantes_catalog", "cultivares_catalog", "embalagens",
+    "safras", "epocas", "tratamentos_sementes",
+)
+ESCOPADAS = ("produtores", "fazendas", "talhoes", "programacoes", "programacao_cultivares")
+TABELAS = ESCOPADAS + CATALOGOS
+
+# Colunas pesadas que não vão no feed (baixadas sob demanda pelo endpoint próprio)
+EXCLUIR = {"talhoes": ("kml_text",)}
+
+_SQL_CURSOR = """
+    SELECT LEAST(now(), COALESCE((
+      SELECT min(xact_start) FROM pg_stat_activity
+      WHERE datname = current_database() AND pid <> pg_backend_pid() AND xact_start IS NOT NULL
+    ), now()))
+"""
+
+_colunas_cache = {}
+_ultima_limpeza = 0.0
+
+
+def parametro():
+    """Lê ?updated_since: (desde, reset). ValueError se o cursor for inválido."""
+    bruto = (request.args.get("updated_since") or "").strip()
+    if not bruto:
+        return None, False
+    try:
+        desde = datetime.datetime.fromisoformat(bruto)
+    except ValueError:
+        try:
+            # "+00:00" sem escape na URL chega como espaço
+            desde = datetime.datetime.fromisoformat(bruto.replace(" ", "+"))
+        except ValueError:
+            raise ValueError("updated_since inválido")
+    if desde.tzinfo is None:
+        desde = desde.replace(tzinfo=datetime.timezone.utc)
+    horizonte = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=RETENCAO_DIAS)
+    if desde < horizonte:
+        return None, True
+    return desde, False
+
+
+def marca(cur):
+    # Executar antes da consulta dos dados, na mesma conexão
+    ensure_sync_schema(TABELAS)
+    cur.execute(_SQL_CURSOR)
+    return cur.fetchone()[0].isoformat()
+
+
+def apagados(cur, tabela, desde):
+    cur.execute(
+        "SELECT chave FROM public.sync_tombstones WHERE tabela = %s AND deleted_at >= %s ORDER BY seq",
+        [tabela, desde],
+    )
+    return [r[0] for r in cur.fetchall()]
+
+
+def completar(cur, out, tabela, desde, reset, cursor):
+    """Acrescenta cursor/deleted/reset à resposta de uma listagem."""
+    out["cursor"] = cursor
+    if desde is not None:
+        out["deleted"] = apagados(cur, tabela, desde)
+    if reset:
+        out["reset"] = True
+    return out
+
+
+def _colunas(cur, tabela):
+    cols = _colunas_cache.get(tabela)
+    if cols is None:
+        cur.execute(
+            "SELECT column_name FROM information_schema.columns WHERE table_schema = 'public' AND table_name = %s ORDER BY ordinal_position",
+            [tabela],
+        )
+        fora = EXCLUIR.get(tabela, ())
+        cols = [r[0] for r in cur.fetchall() if r[0] not in fora]
+        _colunas_cache[tabela] = cols
+    return cols
+
+
+# Escopo por perfil, com as mesmas regras das listagens (/produtores, /fazendas,
+# /talhoes, /programacoes, /programacao_cultivares), exceto que um gestor sem
+# vínculos não recebe nada. Parâmetros nomeados: %(cm)s = numerocm_consultor
+# do token, %(uid)s = user_id.
+
+def _fazenda_ok(a, role):
+    vinculos = (
+        f"{a}.numerocm IN (SELECT produtor_numerocm FROM public.user_produtores WHERE user_id = %(uid)s)"
+        f" OR {a}.id IN (SELECT fazenda_id FROM public.user_fazendas WHERE user_id = %(uid)s)"
+    )
+    if role == "gestor":
+        return f"({vinculos} OR {a}.numerocm_consultor IN (SELECT numerocm_consultor FROM public.gestor_consultores WHERE user_id = %(uid)s))"
+    return (
+        f"({a}.numerocm_consultor = %(cm)s"
+        f" OR {a}.numerocm IN (SELECT p.numerocm FROM public.produtores p WHERE p.numerocm_consultor = %(cm)s)"
+        f" OR {vinculos})"
+    )
+
+
+def _programacao_ok(a, role):
+    vinculos = (
+        f"{a}.produtor_numerocm IN (SELECT produtor_numerocm FROM public.user_produtores WHERE user_id = %(uid)s)"
+        f" OR EXISTS (SELECT 1 FROM public.fazendas f2 JOIN public.user_fazendas uf ON uf.fazenda_id = f2.id"
+        f" WHERE uf.user_id = %(uid)s AND f2.idfazenda = {a}.fazenda_idfazenda AND f2.numerocm = {a}.produtor_numerocm)"
+    )
+    if role == "gestor":
+        return f"({vinculos})"
+    return (
+        f"({vinculos}"
+        f" OR EXISTS (SELECT 1 FROM public.programacao_cultivares pc2 WHERE pc2.programacao_id = {a}.id AND pc2.numerocm_consultor = %(cm)s)"
+        f" OR EXISTS (SELECT 1 FROM public.programacao_adubacao pa WHERE pa.programacao_id = {a}.id AND pa.numerocm_consultor = %(cm)s)"
+        f" OR EXISTS (SELECT 1 FROM public.fazendas f WHERE f.numerocm_consultor = %(cm)s AND f.idfazenda = {a}.fazenda_idfazenda AND f.numerocm = {a}.produtor_numerocm))"
+    )
+
+
+def _escopo(tabela, role):
+    if role == "admin" or tabela in CATALOGOS:
+        return "TRUE"
+    if tabela == "fazendas":
+        return _fazenda_ok("x", role)
+    if tabela == "produtores":
+        vinculos = (
+            "x.numerocm IN (SELECT produtor_numerocm FROM public.user_produtores WHERE user_id = %(uid)s)"
+            " OR x.numerocm IN (SELECT f.numerocm FROM public.fazendas f JOIN public.user_fazendas uf ON uf.fazenda_id = f.id WHERE uf.user_id = %(uid)s)"
+        )
+        if role == "gestor":
+            return f"({vinculos} OR x.numerocm_consultor = %(cm)s OR x.numerocm_consultor IN (SELECT numerocm_consultor FROM public.gestor_consultores WHERE user_id = %(uid)s))"
+        return f"(x.numerocm_consultor = %(cm)s OR x.numerocm IN (SELECT numerocm FROM public.fazendas WHERE numerocm_consultor = %(cm)s) OR {vinculos})"
+    if tabela == "programacoes":
+        return _programacao_ok("x", role)
+    if role != "consultor":
+        # /talhoes e /programacao_cultivares só restringem o consultor
+        return "TRUE"
+    if tabela == "talhoes":
+        return (
+            "EXISTS (SELECT 1 FROM public.fazendas fz WHERE fz.id = x.fazenda_id AND (fz.numerocm_consultor = %(cm)s"
+            " OR fz.numerocm IN (SELECT produtor_numerocm FROM public.user_produtores WHERE user_id = %(uid)s)))"
+        )
+    if tabela == "programacao_cultivares":
+        return "x.numerocm_consultor = %(cm)s"
+    return "FALSE"
+
+
+def _limpar(cur):
+    global _ultima_limpeza
+    if time.time() - _ultima_limpeza < 3600:
+        return
+    _ultima_limpeza = time.time()
+    cur.execute(
+        "DELETE FROM public.sync_tombstones WHERE deleted_at < now() - make_interval(days => %s)",
+        [RETENCAO_DIAS],
+    )
+
+
+def mudancas(conn, payload, tabelas, desde, reset):
+    """Delta de várias tabelas num único snapshot (REPEATABLE READ, somente leitura).
+
+    payload: token verificado (role, user_id, numerocm_consultor).
+    """
+    role = (payload.get("role") or "consultor").lower()
+    params = {"cm": payload.get("numerocm_consultor"), "uid": payload.get("user_id")}
+    out = {"changes": {}}
+    if desde is not None or reset:
+        with conn:
+            with conn.cursor() as cur:
+                _limpar(cur)
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+            out["cursor"] = marca(cur)
+            for t in tabelas:
+                cols = ", ".join(f"x.{c}" for c in _colunas(cur, t))
+                sql = f"SELECT {cols} FROM public.{t} x WHERE {_escopo(t, role)}"
+                if desde is not None:
+                    sql += " AND x.updated_at >= %(desde)s"
+                cur.execute(sql + " ORDER BY x.updated_at", {**params, "desde": desde})
+                delta = {"items": Linhas.do_cursor(cur)}
+                if desde is not None:
+                    delta["deleted"] = apagados(cur, t, desde)
+                out["changes"][t] = delta
+    if reset:
+        out["reset"] = True
+    return out
@@ -0,0 +1,120 @@
+import spatial
+from spatial import TalhaoSpatialIndex
+
+
+def _quadrado(lng, lat, lado=0.01):
+    return {
+        "type": "Polygon",
+        "coordinates": [[[lng, lat], [lng + lado, lat], [lng + lado, lat + lado], [lng, lat + lado], [lng, lat]]],
+    }
+
+
+class _Tabela:
+    # public.talhoes em memória: id -> (fazenda_id, bbox, geojson, kml_uploaded_at)
+    def __init__(self):
+        self.linhas = {}
+        self.relogio = 0
+
+    def gravar(self, talhao_id, lng, lat, lado=0.01):
+        self.relogio += 1
+        self.linhas[talhao_id] = ("f1", (lat, lng, lat + lado, lng + lado), _quadrado(lng, lat, lado), self.relogio)
+
+    def assinatura(self):
+        return (len(self.linhas), str(max(r[3] for r in self.linhas.values())) if self.linhas else None)
+
+
+class _Cursor:
+    def __init__(self, tabela):
+        self.tabela = tabela
+        self._sql = ""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self._sql = sql
+
+    def fetchone(self):
+        return self.tabela.assinatura()
+
+    def fetchall(self):
+        return [(tid, r[0], *r[1], r[2]) for tid, r in self.tabela.linhas.items()]
+
+
+class _Pool:
+    def __init__(self, tabela):
+        self.tabela = tabela
+
+    def getconn(self):
+        return self
+
+    def putconn(self, conn):
+        pass
+
+    def cursor(self):
+        return _Cursor(self.tabela)
+
+
+def _indice(monkeypatch, tabela):
+    monkeypatch.setattr(spatial, "get_pool", lambda: _Pool(tabela))
+    idx = TalhaoSpatialIndex()
+    idx.rebuild()
+    return idx
+
+
+def test_escrita_propria_nao_exige_rebuild(monkeypatch):
+    tabela = _Tabela()
+    tabela.gravar("a", -50.0, -15.0)
+    idx = _indice(monkeypatch, tabela)
+    cur = _Cursor(tabela)
+
+    antes = idx.assinatura(cur)
+    tabela.gravar("b", -49.0, -15.0)
+    depois = idx.assinatura(cur)
+    idx.upsert("b", "f1", tabela.linhas["b"][1], tabela.linhas["b"][2], antes, depois)
+
+    chamadas = []
+    monkeypatch.setattr(idx, "rebuild", lambda: chamadas.append(1))
+    idx._checked_at = 0.0
+    idx.ensure_fresh()
+    assert chamadas == []
+    assert idx.at(-14.995, -48.995) == ["b"]
+
+
+def test_alteracao_de_outro_worker_aparece_apos_escrita_propria(monkeypatch):
+    tabela = _Tabela()
+    tabela.gravar("a", -50.0, -15.0)
+    idx = _indice(monkeypatch, tabela)
+    cur = _Cursor(tabela)
+
+    # Outro worker envia um KML; este worker ainda não verificou a assinatura
+    tabela.gravar("c", -48.0, -15.0)
+
+    antes = idx.assinatura(cur)
+    tabela.gravar("b", -49.0, -15.0)
+    depois = idx.assinatura(cur)
+    idx.upsert("b", "f1", tabela.linhas["b"][1], tabela.linhas["b"][2], antes, depois)
+
+    assert idx.at(-14.995, -47.995) == ["c"]
+    assert sorted(idx.in_bbox(-16.0, -51.0, -14.0, -47.0)) == ["a", "b", "c"]
+
+
+def test_remocao_de_outro_worker_aparece_apos_remocao_propria(monkeypatch):
+    tabela = _Tabela()
+    tabela.gravar("a", -50.0, -15.0)
+    tabela.gravar("b", -49.0, -15.0)
+    tabela.gravar("c", -48.0, -15.0)
+    idx = _indice(monkeypatch, tabela)
+    cur = _Cursor(tabela)
+
+    del tabela.linhas["c"]  # excluído por outro worker
+
+    antes = idx.assinatura(cur)
+    del tabela.linhas["b"]
+    depois = idx.assinatura(cur)
+    idx.remove("b", antes, depois)
+
+    assert idx.in_bbox(-16.0, -51.0, -14.0, -47.0) == ["a"]
@@ -30,6 +30,7 @@ export default defineConfig(async ({ mode }) => {
       strictPort: true,
       ...(hmr ? { hmr } : {}),
       proxy: {
+        "/api/eventos": { target: "http://127.0.0.1:5001", changeOrigin: true },
         "/api": { target: "http://127.0.0.1:5000", changeOrigin: true },
         "/api/": { target: "http://127.0.0.1:5000", changeOrigin: true },
         "/auth/login": { target: "http://127.0.0.1:5000", changeOrigin: true },